@@ -1,14 +1,13 @@
 import os
 import sys
 from typing import List, Dict, Any, Optional
-from openai import OpenAI, Agent as OpenAIAgent
-from openai.agents import tool
 
 # 将 vector-kb 目录添加到 Python 路径中
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'vector-kb'))
 
 # 导入知识库模块
 from kb import kb
+from kb_client import KBClient
 
 
 class Agent:
@@ -17,6 +16,7 @@ class Agent:
         self.api_key = None
         self.system_prompt = "你是一个知识检索智能体。当用户提出问题时，请遵循以下规则：\n1. 先生成关键词并调用 kb_query 工具；\n2. 若结果不充分，请根据 metadata 信息缩小范围并再次调用；\n3. 当你认为信息已充分时，生成最终答案。"
         self.kb_path = None
+        self.kb_server = None
         self.kb_instance = None
         self.max_rounds = 3
         self.verbose = False
@@ -37,15 +37,38 @@ class Agent:
         """设置知识库路径"""
         self.kb_path = path
         self.kb_instance = kb(path)
+        self._register_tools()
+
+    def set_kb_server(self, url: str):
+        """设置知识库查询服务地址（见 vector-kb/kb_server.py），多个进程共用一个已加载的模型"""
+        self.kb_server = url
+        self.kb_instance = KBClient(url)
+        self._register_tools()
+
+    def _register_tools(self):
+        """生成调用当前知识库的工具"""
+        # 延迟导入 openai，避免导入本模块时就加载 SDK
+        from openai.agents import tool
+
+        @tool
+        def kb_query(text: str, top_k: int = 5, where: Optional[Dict[str, Any]] = None,
+                     include: Optional[List[str]] = None, min_score: Optional[float] = None) -> List[Dict[str, Any]]:
+            """查询本地知识库内容；text 只由 HS 编码组成时（如 8471、84.71、CH85、第十一类）直接返回对应条目。
+            include 可选 ids、scores、metadata、text，只看元数据时省略 text，再用 kb_get_texts 按 id 读取全文；
+            min_score 为相似度下限"""
+            if self.verbose:
+                print(f"调用 kb_query: text={text}, top_k={top_k}, where={where}, include={include}, min_score={min_score}")
+            return self.kb_instance.query(text, top_k, where, include=include, min_score=min_score)
 
         @tool
-        def kb_query(text: str, top_k: int = 5, where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
-            """查询本地知识库内容"""
+        def kb_get_texts(ids: List[str]) -> List[Optional[str]]:
+            """按 kb_query 返回的 id 读取知识库条目全文"""
             if self.verbose:
-                print(f"调用 kb_query: text={text}, top_k={top_k}, where={where}")
-            return self.kb_instance.query(text, top_k, where)
+                print(f"调用 kb_get_texts: ids={ids}")
+            return self.kb_instance.get_texts(ids)
 
         self.kb_query = kb_query
+        self.kb_get_texts = kb_get_texts
         
     def set_max_rounds(self, rounds: int):
         """设置最大递归深度"""
@@ -61,8 +84,10 @@ class Agent:
             raise ValueError("请先设置 API 端点和密钥")
             
         if not self.kb_instance:
-            raise ValueError("请先设置知识库路径")
+            raise ValueError("请先设置知识库路径或查询服务地址")
             
+        from openai import OpenAI, Agent as OpenAIAgent
+
         # 初始化 OpenAI 客户端
         client = OpenAI(
             base_url=self.endpoint,
@@ -72,7 +97,7 @@ class Agent:
         # 创建 Agent 实例
         agent = OpenAIAgent(
             instructions=self.system_prompt,
-            tools=[self.kb_query],
+            tools=[self.kb_query, self.kb_get_texts],
             client=client
         )
         
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+embedding 后端吞吐量基准：比较 PyTorch（SentenceTransformer）、ONNX Runtime 以及
+ONNX Runtime + 动态 int8 量化在 CPU 上的编码速度，并报告与 PyTorch 输出的偏差。
+
+用法:
+    python benchmarks/bench_embedding.py --model C:\\models\\bge-large-zh-v1.5
+    python benchmarks/bench_embedding.py --model BAAI/bge-large-zh-v1.5 --texts-file chunks.txt -n 1024
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "vector-kb"))
+
+from embedding_backends import (  # noqa: E402
+    SentenceTransformerBackend, OnnxBackend, export_onnx, compare_backends, VERIFY_TEXTS
+)
+
+
+def load_texts(path, n, length):
+    """从文件读取文本（每行一条），或由样例文本随机拼接生成"""
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            texts = [line.strip() for line in f if line.strip()]
+        return (texts * (n // max(len(texts), 1) + 1))[:n]
+
+    rng = random.Random(0)
+    texts = []
+    for _ in range(n):
+        text = ""
+        while len(text) < length:
+            text += rng.choice(VERIFY_TEXTS)
+        texts.append(text[:length])
+    return texts
+
+
+def measure(backend, texts, batch_size, repeat):
+    """返回最佳一次的吞吐量（条/秒）"""
+    backend.encode(texts[:batch_size], batch_size=batch_size)  # 预热
+    best = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        backend.encode(texts, batch_size=batch_size)
+        best = max(best, len(texts) / (time.perf_counter() - start))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="embedding 后端吞吐量基准")
+    parser.add_argument('--model', required=True, help='SentenceTransformer 模型名称或路径')
+    parser.add_argument('--texts-file', help='文本文件，每行一条；不指定时随机生成')
+    parser.add_argument('-n', type=int, default=512, help='文本数量，默认512')
+    parser.add_argument('--length', type=int, default=450, help='随机生成文本的长度，默认450（与 chunk_size 一致）')
+    parser.add_argument('--batch-size', type=int, default=32, help='每次推理的文本数量，默认32')
+    parser.add_argument('--repeat', type=int, default=3, help='重复次数，默认3')
+    parser.add_argument('--threads', type=int, default=0, help='ONNX Runtime 推理线程数，默认自动')
+    parser.add_argument('--onnx-dir', help='导出的 ONNX 模型目录，默认使用临时目录')
+    args = parser.parse_args()
+
+    texts = load_texts(args.texts_file, args.n, args.length)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        onnx_dir = args.onnx_dir or os.path.join(tmp, "onnx")
+        print("导出 ONNX 模型...")
+        export_onnx(args.model, onnx_dir, quantize=True)
+
+        torch_backend = SentenceTransformerBackend(args.model)
+        backends = [
+            ("torch", torch_backend),
+            ("onnx", OnnxBackend(onnx_dir, quantize=False, threads=args.threads)),
+            ("onnx-int8", OnnxBackend(onnx_dir, quantize=True, threads=args.threads)),
+        ]
+
+        print(f"\n文本数 {len(texts)}，batch_size {args.batch_size}")
+        print(f"{'后端':<12} {'吞吐量(条/秒)':<16} {'加速比':<8} {'最小余弦相似度':<16} {'最大逐元素误差'}")
+        print("-" * 80)
+        baseline = None
+        for name, backend in backends:
+            throughput = measure(backend, texts, args.batch_size, args.repeat)
+            baseline = baseline or throughput
+            diff = compare_backends(torch_backend, backend, texts[:64])
+            print(f"{name:<12} {throughput:<16.1f} {throughput / baseline:<8.2f} "
+                  f"{diff['min_cosine']:<16.5f} {diff['max_abs_diff']:.5f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+向量索引后端基准：比较 Chroma（HNSW 近似检索）、NumPy 精确检索（float32 / float16）以及
+NumPy 压缩模式（int8 / 乘积量化 + 精确重排）的查询延迟、召回率和每个向量常驻内存的字节数。
+召回率以 float32 暴力检索的结果为基准。
+
+用法:
+    python benchmarks/bench_index.py
+    python benchmarks/bench_index.py -n 50000 --dim 1024 --queries 200 --filter
+    python benchmarks/bench_index.py --skip-chroma --pq-m 128 --rerank-factor 8
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "vector-kb"))
+
+from numpy_index import NumpyCollection  # noqa: E402
+
+
+def make_data(n, dim, n_queries, seed=0, n_topics=200):
+    """
+    生成归一化的随机向量：向量围绕若干主题中心分布（与真实 embedding 一样有聚簇结构），
+    查询向量取自库中向量加噪声，更接近真实检索场景
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_topics, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, n_topics, n)] + rng.standard_normal((n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    picks = rng.integers(0, n, n_queries)
+    queries = vectors[picks] + 0.5 * rng.standard_normal((n_queries, dim)).astype(np.float32) / np.sqrt(dim)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return vectors, queries
+
+
+def ground_truth(vectors, queries, top_k, allowed=None):
+    """float32 暴力检索的 top_k 结果"""
+    scores = queries @ vectors.T
+    if allowed is not None:
+        scores[:, ~allowed] = -np.inf
+    return [set(np.argsort(-row)[:top_k].tolist()) for row in scores]
+
+
+def fill(collection, vectors, batch_size=5000):
+    """分批写入向量，返回耗时"""
+    start = time.perf_counter()
+    for s in range(0, len(vectors), batch_size):
+        rows = range(s, min(s + batch_size, len(vectors)))
+        collection.add(
+            ids=[str(i) for i in rows],
+            embeddings=vectors[s:s + batch_size].tolist(),
+            documents=[f"doc {i}" for i in rows],
+            metadatas=[{"file_id": f"f{i % 10}", "chunk_index": i} for i in rows],
+        )
+    return time.perf_counter() - start
+
+
+def measure(collection, queries, top_k, truth, where):
+    """逐条查询，返回 (p50 毫秒, p95 毫秒, 召回率)"""
+    collection.query(query_embeddings=[queries[0].tolist()], n_results=top_k, where=where)  # 预热
+    latencies = []
+    hits = 0
+    for q, expected in zip(queries, truth):
+        start = time.perf_counter()
+        result = collection.query(query_embeddings=[q.tolist()], n_results=top_k, where=where)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(expected & {int(i) for i in result['ids'][0][:top_k]})
+    latencies.sort()
+    return (latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)],
+            hits / (len(truth) * top_k))
+
+
+def measure_batch(collection, queries, top_k, where):
+    """一次提交全部查询，返回平均每条耗时（毫秒）"""
+    start = time.perf_counter()
+    collection.query(query_embeddings=queries.tolist(), n_results=top_k, where=where)
+    return (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量索引后端基准")
+    parser.add_argument('-n', type=int, default=20000, help='向量数量，默认20000')
+    parser.add_argument('--dim', type=int, default=1024, help='向量维度，默认1024（bge-large-zh-v1.5）')
+    parser.add_argument('--queries', type=int, default=100, help='查询数量，默认100')
+    parser.add_argument('--top-k', type=int, default=5, help='每次查询返回的结果数，默认5')
+    parser.add_argument('--filter', action='store_true', help='查询时附加 file_id 过滤条件（保留约 30%% 的向量）')
+    parser.add_argument('--skip-chroma', action='store_true', help='不测试 Chroma 后端')
+    parser.add_argument('--pq-m', type=int, default=64, help='乘积量化的子空间个数，默认64')
+    parser.add_argument('--rerank-factor', type=int, default=4, help='压缩模式下精确重排的候选倍数，默认4')
+    args = parser.parse_args()
+
+    vectors, queries = make_data(args.n, args.dim, args.queries)
+    where = None
+    allowed = None
+    if args.filter:
+        where = {"file_id": {"$in": ["f0", "f1", "f2"]}}
+        allowed = np.arange(args.n) % 10 < 3
+    truth = ground_truth(vectors, queries, args.top_k, allowed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = []
+        if not args.skip_chroma:
+            import chromadb
+            from chromadb.config import Settings
+
+            client = chromadb.PersistentClient(path=os.path.join(tmp, "chroma"),
+                                               settings=Settings(anonymized_telemetry=False))
+            backends.append(("chroma", client.get_or_create_collection(name="bench")))
+        backends.append(("numpy-float32", NumpyCollection(os.path.join(tmp, "f32"), "bench", dtype="float32")))
+        backends.append(("numpy-float16", NumpyCollection(os.path.join(tmp, "f16"), "bench", dtype="float16")))
+        backends.append(("numpy-int8", NumpyCollection(os.path.join(tmp, "int8"), "bench", compression="int8",
+                                                        rerank_factor=args.rerank_factor)))
+        backends.append((f"numpy-pq{args.pq_m}", NumpyCollection(os.path.join(tmp, "pq"), "bench", compression="pq",
+                                                                 pq_m=args.pq_m, rerank_factor=args.rerank_factor)))
+
+        print(f"向量数 {args.n}，维度 {args.dim}，查询数 {args.queries}，top_k {args.top_k}"
+              f"{'，带过滤条件' if where else ''}")
+        print(f"{'后端':<16} {'写入(秒)':<10} {'p50(毫秒)':<11} {'p95(毫秒)':<11} {'批量(毫秒/条)':<15} "
+              f"{'召回率':<8} {'字节/向量'}")
+        print("-" * 90)
+        for name, collection in backends:
+            build = fill(collection, vectors)
+            p50, p95, recall = measure(collection, queries, args.top_k, truth, where)
+            batch = measure_batch(collection, queries, args.top_k, where)
+            bytes_per_vector = collection.stats()['bytes_per_vector'] if hasattr(collection, 'stats') else args.dim * 4
+            print(f"{name:<16} {build:<10.2f} {p50:<11.2f} {p95:<11.2f} {batch:<15.3f} {recall:<8.4f} {bytes_per_vector}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+冷启动耗时基准：在全新的解释器进程中测量 kb、cli_client 和 agent.Agent 的导入/启动时间，
+并检查重量级依赖没有在启动阶段被导入。超过阈值时以非零状态码退出，可用作回归检查。
+
+用法:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 10 --max-seconds 0.5
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VECTOR_KB = os.path.join(ROOT, "vector-kb")
+
+# 启动阶段不应被导入的模块
+HEAVY_MODULES = ["chromadb", "sentence_transformers", "torch", "PyPDF2", "docx", "openai", "onnxruntime"]
+
+# 在子进程中执行的代码，最后一行输出已导入的重量级模块
+CHECK_MODULES = (
+    "import sys, json; "
+    f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+)
+
+
+def build_cases(kb_dir):
+    """构造各个测试场景：(名称, 命令行参数列表, 是否检查重量级模块)"""
+    return [
+        ("import kb", [
+            "-c", f"import sys; sys.path.insert(0, {VECTOR_KB!r}); import kb; {CHECK_MODULES}"
+        ], True),
+        ("kb(path)", [
+            "-c", f"import sys; sys.path.insert(0, {VECTOR_KB!r}); from kb import kb; kb({kb_dir!r}); {CHECK_MODULES}"
+        ], True),
+        ("cli_client.py --help", [
+            os.path.join(VECTOR_KB, "cli_client.py"), "--help"
+        ], False),
+        ("agent.Agent()", [
+            "-c", f"import sys; sys.path.insert(0, {ROOT!r}); from agent import Agent; Agent(); {CHECK_MODULES}"
+        ], True),
+    ]
+
+
+def run_case(args, runs):
+    """
+    多次在新进程中执行同一场景
+
+    Returns:
+        (耗时列表, 最后一次运行检测到的重量级模块列表, 错误信息)
+    """
+    timings = []
+    heavy = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable] + args, capture_output=True, text=True, cwd=ROOT)
+        timings.append(time.perf_counter() - start)
+        if proc.returncode != 0:
+            return timings, heavy, proc.stderr.strip().splitlines()[-1:] or ["未知错误"]
+        last_line = proc.stdout.strip().splitlines()[-1:] or ["[]"]
+        try:
+            heavy = json.loads(last_line[0])
+        except ValueError:
+            heavy = []
+    return timings, heavy, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="kb / cli_client / agent 冷启动耗时基准")
+    parser.add_argument('--runs', type=int, default=5, help='每个场景运行次数，默认5')
+    parser.add_argument('--max-seconds', type=float, default=1.0,
+                        help='每个场景中位数耗时的上限（秒），默认1.0')
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        kb_dir = os.path.join(tmp, "kb")
+        print(f"{'场景':<24} {'中位数(s)':<10} {'最小值(s)':<10} 结果")
+        print("-" * 70)
+        for name, case_args, check_heavy in build_cases(kb_dir):
+            timings, heavy, error = run_case(case_args, args.runs)
+            median = statistics.median(timings)
+            status = "OK"
+            if error:
+                status = f"失败: {error[0]}"
+                failed = True
+            elif median > args.max_seconds:
+                status = f"超出阈值 {args.max_seconds}s"
+                failed = True
+            elif check_heavy and heavy:
+                status = f"启动时导入了 {', '.join(heavy)}"
+                failed = True
+            print(f"{name:<24} {median:<10.3f} {min(timings):<10.3f} {status}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+知识库行为测试的公共夹具
+
+测试不加载真实的 embedding 模型：kb 模块中的 create_backend 被替换为按字符二元组哈希生成向量的
+FakeBackend，文本相近的 chunk 向量也相近，足以检验检索、路由和去重的行为。
+
+用法:
+    python -m pytest -q tests
+"""
+
+import os
+import sys
+import hashlib
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "vector-kb"))
+
+import kb as kb_module  # noqa: E402
+from auto_add_files import extract_metadata_from_filename  # noqa: E402
+
+
+class FakeBackend:
+    """按字符二元组哈希生成归一化向量的测试用后端"""
+
+    dim = 32
+
+    def __init__(self):
+        self.encoded = 0
+
+    def encode(self, texts):
+        self.encoded += len(texts)
+        vectors = np.full((len(texts), self.dim), 1e-3, dtype=np.float32)
+        for row, text in enumerate(texts):
+            for i in range(len(text) - 1):
+                h = int(hashlib.md5(text[i:i + 2].encode('utf-8')).hexdigest(), 16)
+                vectors[row, h % self.dim] += 1.0
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors.tolist()
+
+    def memory_bytes(self):
+        return 0
+
+
+@pytest.fixture(autouse=True)
+def fake_backend(monkeypatch):
+    """所有测试使用 FakeBackend，不导入 torch / sentence_transformers"""
+    monkeypatch.setattr(kb_module, "create_backend", lambda properties, kb_path, **kwargs: FakeBackend())
+
+
+@pytest.fixture
+def make_kb(tmp_path):
+    """
+    创建知识库的工厂：make_kb(name="kb", **create 参数)，测试结束时关闭所有实例
+    """
+    opened = []
+
+    def factory(name="kb", read_only=False, create=True, **options):
+        instance = kb_module.kb(str(tmp_path / name), read_only=read_only)
+        if create and not read_only:
+            options.setdefault("chunk_size", 40)
+            options.setdefault("model", "fake")
+            options.setdefault("name", "test_collection")
+            instance.create(**options)
+        opened.append(instance)
+        return instance
+
+    yield factory
+    for instance in opened:
+        instance.close()
+
+
+@pytest.fixture
+def write_files(tmp_path):
+    """
+    写入一组测试文件：write_files({"0101.txt": "内容", ...})，返回 (路径列表, 元数据列表)，
+    元数据按 auto_add_files 的规则从文件名提取
+    """
+    source_dir = tmp_path / "files"
+    source_dir.mkdir(exist_ok=True)
+
+    def factory(contents):
+        paths, metadatas = [], []
+        for filename, text in contents.items():
+            path = source_dir / filename
+            path.write_text(text, encoding='utf-8')
+            paths.append(str(path))
+            metadatas.append(extract_metadata_from_filename(filename))
+        return paths, metadatas
+
+    return factory
+
+
+# 不同类/章主题的测试文本，每个文件切分为多个 chunk
+TOPICS = {
+    "0101.txt": "活马 活驴 骡 马匹 改良种用 " * 12,
+    "0102.txt": "活牛 水牛 改良种用牛 " * 12,
+    "0203.txt": "鲜冷冻猪肉 猪胴体 半胴体 " * 12,
+    "1161.txt": "针织钩编服装 棉制衬衫 针织套头衫 " * 12,
+    "1162.txt": "非针织服装 大衣 西服套装 " * 12,
+    "11.txt": "第十一类 纺织原料及纺织制品 类注 " * 8,
+}
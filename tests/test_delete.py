@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+delItems / delWhere：返回的删除数量，以及对路由、编码、倒排和去重索引的影响
+"""
+
+import pytest
+
+from conftest import TOPICS
+
+pytest.importorskip("chromadb")
+
+
+@pytest.fixture
+def loaded_kb(make_kb, write_files):
+    vkb = make_kb(dedup=True)
+    paths, metadatas = write_files(TOPICS)
+    results = vkb.addItems(paths, metadatas)
+    file_ids = {r["filepath"].rsplit("/", 1)[-1]: r["file_id"] for r in results}
+    return vkb, paths, metadatas, file_ids
+
+
+def chunk_total(vkb):
+    """collection 中的向量数加上以引用形式保存的 chunk 数"""
+    return vkb.collection.count() + vkb.dedup_stats()["references"]
+
+
+def assert_indexes_consistent(vkb):
+    count = vkb.collection.count()
+    assert vkb.route_stats()["chunks"] == count
+    assert vkb._get_route_index().stale_keys() == []
+    assert vkb._get_lexical_index().stats()["docs"] == count
+    assert sum(f["chunk_count"] for f in vkb.list()) == chunk_total(vkb)
+
+
+def test_del_items_counts_and_indexes(loaded_kb):
+    vkb, _, _, file_ids = loaded_kb
+    total = chunk_total(vkb)
+    removed = [file_ids["1161.txt"], file_ids["1162.txt"]]
+    expected = sum(f["chunk_count"] for f in vkb.list() if f["file_id"] in removed)
+
+    assert vkb.delItems(removed + ["missing"]) == {"files": 2, "chunks": expected}
+    assert chunk_total(vkb) == total - expected
+    assert vkb.collection.get(where={"file_id": {"$in": removed}}, include=[])['ids'] == []
+    assert vkb._get_dedup_index().matching({"file_id": {"$in": removed}}) == []
+    assert vkb.query("第61章", include=["ids"], exact=True) == []
+    assert_indexes_consistent(vkb)
+
+    assert vkb.delItem(file_ids["0101.txt"]) > 0
+    assert vkb.delItems(removed) == {"files": 0, "chunks": 0}
+
+
+def test_del_where_whole_chapter(loaded_kb):
+    vkb, _, _, _ = loaded_kb
+    route_before = vkb.route_stats()
+    expected = sum(f["chunk_count"] for f in vkb.list() if f["source_file"] in ("0101.txt",))
+
+    assert vkb.delWhere({"chapter": "01"}) == {"files": 1, "chunks": expected}
+    assert vkb.route_stats()["chapters"] == route_before["chapters"] - 1
+    assert vkb.query("第1章", include=["ids"], exact=True) == []
+    assert "0101.txt" not in {f["source_file"] for f in vkb.list()}
+    assert_indexes_consistent(vkb)
+
+    with pytest.raises(ValueError):
+        vkb.delWhere({})
+
+
+def test_partial_del_where_is_restored_on_reingest(loaded_kb):
+    vkb, paths, metadatas, _ = loaded_kb
+    total = chunk_total(vkb)
+
+    result = vkb.delWhere({"chunk_index": 0})
+
+    # 每个文件只删除了第一个 chunk，文件记录保留
+    assert result == {"files": 0, "chunks": len(paths)}
+    assert chunk_total(vkb) == total - len(paths)
+    assert_indexes_consistent(vkb)
+
+    vkb.addItems(paths, metadatas)
+    assert chunk_total(vkb) == total
+    assert_indexes_consistent(vkb)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+addItem / addItems：重复导入不做修改，变化的文件按导入清单只改写差异部分
+"""
+
+import pytest
+
+from conftest import TOPICS
+
+pytest.importorskip("chromadb")
+
+
+def file_chunks(vkb, file_id):
+    stored = vkb.collection.get(where={"file_id": file_id}, include=["documents", "metadatas"])
+    return {chunk_id: (document, metadata['chunk_index'])
+            for chunk_id, document, metadata in zip(stored['ids'], stored['documents'], stored['metadatas'])}
+
+
+def test_add_item_is_idempotent(make_kb, write_files):
+    paths, metadatas = write_files({"0101.txt": TOPICS["0101.txt"]})
+    vkb = make_kb()
+
+    file_id = vkb.addItem(paths[0], metadatas[0])
+    count = vkb.collection.count()
+    generation = vkb.generation
+
+    assert count == len(vkb._parser(paths[0]))
+    assert vkb.addItem(paths[0], metadatas[0]) == file_id
+    assert vkb.collection.count() == count
+    assert vkb.generation == generation
+
+
+def test_add_items_is_idempotent(make_kb, write_files):
+    paths, metadatas = write_files(TOPICS)
+    vkb = make_kb()
+
+    first = vkb.addItems(paths, metadatas)
+    count = vkb.collection.count()
+    generation = vkb.generation
+    second = vkb.addItems(paths, metadatas)
+
+    assert all(result["error"] is None and result["failed_chunks"] == 0 for result in first)
+    assert [r["file_id"] for r in second] == [r["file_id"] for r in first]
+    assert vkb.collection.count() == count == sum(len(vkb._parser(path)) for path in paths)
+    assert vkb.generation == generation
+    assert sorted(f["chunk_count"] for f in vkb.list()) == sorted(len(vkb._parser(path)) for path in paths)
+
+
+def test_changed_file_keeps_unchanged_chunks(make_kb, write_files):
+    paths, metadatas = write_files({"0101.txt": TOPICS["0101.txt"]})
+    vkb = make_kb()
+    file_id = vkb.addItem(paths[0], metadatas[0])
+    before = file_chunks(vkb, file_id)
+
+    # 在开头插入恰好一个 chunk 的新内容：原有 chunk 只是位置后移，只需写入新 chunk
+    prefix = ("家禽 鸡鸭鹅 " * 6)[:40]
+    with open(paths[0], 'w', encoding='utf-8') as f:
+        f.write(prefix + TOPICS["0101.txt"])
+    assert vkb.addItem(paths[0], metadatas[0]) == file_id
+    after = file_chunks(vkb, file_id)
+
+    documents = vkb._parser(paths[0])
+    assert sorted(document for document, _ in after.values()) == sorted(documents)
+    assert set(before) < set(after)
+    assert all(after[chunk_id] == (document, index + 1) for chunk_id, (document, index) in before.items())
+    assert sorted(index for _, index in after.values()) == list(range(len(documents)))
+
+    # 删减内容：消失的 chunk 从 collection 和各索引中删除
+    with open(paths[0], 'w', encoding='utf-8') as f:
+        f.write(prefix)
+    vkb.addItem(paths[0], metadatas[0])
+    after = file_chunks(vkb, file_id)
+    assert sorted(document for document, _ in after.values()) == sorted(vkb._parser(paths[0]))
+    assert vkb._get_lexical_index().stats()["docs"] == vkb.collection.count()
+    assert vkb.route_stats()["chunks"] == vkb.collection.count()
+
+
+def test_metadata_change_updates_chunks_in_place(make_kb, write_files):
+    paths, metadatas = write_files({"0101.txt": TOPICS["0101.txt"]})
+    vkb = make_kb()
+    file_id = vkb.addItem(paths[0], metadatas[0])
+    before = file_chunks(vkb, file_id)
+
+    vkb.addItem(paths[0], dict(metadatas[0], section="02", chapter="03"))
+
+    stored = vkb.collection.get(where={"file_id": file_id}, include=["metadatas"])
+    assert set(stored['ids']) == set(before)
+    assert {(m["section"], m["chapter"]) for m in stored['metadatas']} == {("02", "03")}
+    assert vkb.query("第1章", include=["ids"], exact=True) == []
+    assert len(vkb.query("第3章", top_k=100, include=["ids"], exact=True)) == len(before)
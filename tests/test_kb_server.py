@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+kb_server：并发的单条查询经 KBClient 到达服务后合并为批量查询
+"""
+
+import threading
+
+import pytest
+
+from conftest import TOPICS
+
+pytest.importorskip("chromadb")
+
+from kb_server import KBServer  # noqa: E402
+from kb_client import KBClient  # noqa: E402
+
+
+@pytest.fixture
+def server(make_kb, write_files):
+    vkb = make_kb()
+    paths, metadatas = write_files(TOPICS)
+    vkb.addItems(paths, metadatas)
+    vkb.close()
+
+    servers = []
+
+    def factory(**options):
+        instance = KBServer(vkb.path, port=0, **options)
+        instance.start()
+        servers.append(instance)
+        return instance
+
+    yield factory
+    for instance in servers:
+        instance.shutdown()
+
+
+def test_concurrent_queries_are_batched(server):
+    instance = server(max_batch=8, max_wait=0.5, query_cache_size=0)
+    client = KBClient(instance.url)
+    assert client.health()
+
+    calls = []
+    query_many = instance.kb.query_many
+    instance.kb.query_many = lambda texts, **options: calls.append(list(texts)) or query_many(texts, **options)
+
+    texts = ["活马", "活牛", "猪肉", "针织衬衫", "西服套装", "纺织原料", "水牛", "大衣"]
+    results = [None] * len(texts)
+    barrier = threading.Barrier(len(texts))
+
+    def run(i):
+        barrier.wait()
+        results[i] = client.query(texts[i], top_k=2, include=["ids", "metadata"])
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(texts))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    batcher = client.stats()["batcher"]
+    assert batcher["requests"] == len(texts)
+    assert batcher["batches"] < len(texts)
+    assert sum(len(batch) for batch in calls) == len(texts) and len(calls) == batcher["batches"]
+    # 合并执行的结果与单独查询一致
+    assert results == [query_many([text], top_k=2, include=["ids", "metadata"])[0] for text in texts]
+
+
+def test_requests_with_different_options_are_grouped(server):
+    instance = server(max_batch=4, max_wait=0.5, query_cache_size=0)
+    client = KBClient(instance.url)
+    calls = []
+    query_many = instance.kb.query_many
+    instance.kb.query_many = lambda texts, **options: calls.append(options["top_k"]) or query_many(texts, **options)
+    results = {}
+    barrier = threading.Barrier(3)
+
+    def run(text, top_k):
+        barrier.wait()
+        results[(text, top_k)] = client.query(text, top_k=top_k, include=["ids"])
+
+    threads = [threading.Thread(target=run, args=args) for args in (("活马", 1), ("活牛", 1), ("猪肉", 3))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert {key: len(rows) for key, rows in results.items()} == {("活马", 1): 1, ("活牛", 1): 1, ("猪肉", 3): 3}
+    # 同一批中参数相同的请求合并为一次 query_many
+    assert client.stats()["batcher"]["batches"] == 1
+    assert sorted(calls) == [1, 3]
+
+
+def test_client_maps_errors(server):
+    client = KBClient(server(read_only=True).url)
+    with pytest.raises(ValueError):
+        client.query("活马", mode="fuzzy")
+    with pytest.raises(PermissionError):
+        client.delItem("missing")
+    assert sorted(f["source_file"] for f in client.list()) == sorted(TOPICS)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+升级前创建的知识库（没有导入清单）再次导入时不应重复写入 chunk
+"""
+
+import os
+import json
+import uuid
+
+import pytest
+
+from conftest import TOPICS, FakeBackend
+
+pytest.importorskip("chromadb")
+
+
+def make_legacy_kb(make_kb, paths, metadatas):
+    """按升级前的格式写入 chunk，并删除升级后才有的清单和索引文件"""
+    legacy = make_kb("legacy")
+    file_ids = {}
+    for path, metadata in zip(paths, metadatas):
+        chunks = legacy._parser(path)
+        source_file = os.path.basename(path)
+        file_id = str(uuid.uuid4())
+        file_ids[source_file] = file_id
+        legacy.collection.add(
+            ids=[f"{file_id}_{source_file}_{i}" for i in range(len(chunks))],
+            embeddings=FakeBackend().encode(chunks),
+            documents=chunks,
+            metadatas=[dict(metadata, source_file=source_file, chunk_index=i, file_id=file_id)
+                       for i in range(len(chunks))],
+        )
+    count = legacy.collection.count()
+    legacy.close()
+
+    properties_path = os.path.join(legacy.path, "properties.json")
+    with open(properties_path, 'r', encoding='utf-8') as f:
+        properties = json.load(f)
+    with open(properties_path, 'w', encoding='utf-8') as f:
+        json.dump({key: properties[key] for key in ("name", "chunk_size", "model")}, f)
+    for filename in os.listdir(legacy.path):
+        if filename.endswith(".sqlite3"):
+            os.remove(os.path.join(legacy.path, filename))
+    return file_ids, count
+
+
+def test_reingest_pre_upgrade_kb_keeps_chunk_count(make_kb, write_files):
+    paths, metadatas = write_files(TOPICS)
+    file_ids, count = make_legacy_kb(make_kb, paths, metadatas)
+
+    upgraded = make_kb("legacy", create=False)
+    results = upgraded.addItems(paths, metadatas)
+
+    assert all(result["error"] is None for result in results)
+    assert upgraded.collection.count() == count
+    # 沿用升级前的文件ID，清单中补上源文件路径
+    assert {os.path.basename(r["filepath"]): r["file_id"] for r in results} == file_ids
+    assert sorted(f["source_path"] for f in upgraded.list()) == sorted(os.path.abspath(p) for p in paths)
+
+    # 之后按路径识别，再次导入不做任何修改
+    generation = upgraded.generation
+    upgraded.addItems(paths, metadatas)
+    assert upgraded.generation == generation
+    assert upgraded.collection.count() == count
+
+
+def test_reingest_changed_pre_upgrade_file_replaces_chunks(make_kb, write_files):
+    paths, metadatas = write_files(TOPICS)
+    file_ids, _ = make_legacy_kb(make_kb, paths, metadatas)
+
+    with open(paths[0], 'w', encoding='utf-8') as f:
+        f.write(TOPICS["0101.txt"] + "新增的马匹说明 " * 10)
+    upgraded = make_kb("legacy", create=False)
+    file_id = upgraded.addItem(paths[0], metadatas[0])
+
+    assert file_id == file_ids["0101.txt"]
+    stored = upgraded.collection.get(where={"file_id": file_id}, include=["documents"])
+    assert sorted(stored['documents']) == sorted(upgraded._parser(paths[0]))
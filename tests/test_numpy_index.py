@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NumpyCollection：Chroma 风格的过滤条件，以及 int8 / pq 压缩候选集的精确重排
+"""
+
+import numpy as np
+import pytest
+
+from numpy_index import NumpyCollection, PQ_MIN_TRAIN
+
+
+def make_collection(tmp_path, n, dim=32, seed=0, **options):
+    vectors = np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    collection = NumpyCollection(str(tmp_path / "index"), "index", **options)
+    ids = [f"c{i}" for i in range(n)]
+    metadatas = [{"section": f"{i % 3:02d}", "chapter": f"{i % 6:02d}", "chunk_index": i} for i in range(n)]
+    for start in range(0, n, 500):
+        collection.add(ids=ids[start:start + 500], embeddings=vectors[start:start + 500].tolist(),
+                       documents=[f"文本{i}" for i in range(start, min(start + 500, n))],
+                       metadatas=metadatas[start:start + 500])
+    return collection, vectors, metadatas
+
+
+@pytest.mark.parametrize("where, expected", [
+    ({"section": "01"}, lambda m: m["section"] == "01"),
+    ({"section": {"$ne": "01"}}, lambda m: m["section"] != "01"),
+    ({"chapter": {"$in": ["02", "05"]}}, lambda m: m["chapter"] in ("02", "05")),
+    ({"chunk_index": {"$gte": 10, "$lt": 20}}, lambda m: 10 <= m["chunk_index"] < 20),
+    ({"$and": [{"section": "00"}, {"chunk_index": {"$lte": 30}}]},
+     lambda m: m["section"] == "00" and m["chunk_index"] <= 30),
+    ({"$or": [{"chapter": "01"}, {"chunk_index": {"$nin": list(range(50, 60))}, "section": "02"}]},
+     lambda m: m["chapter"] == "01" or (m["section"] == "02" and not 50 <= m["chunk_index"] < 60)),
+])
+def test_where_filtering(tmp_path, where, expected):
+    collection, vectors, metadatas = make_collection(tmp_path, 120)
+    matching = {f"c{i}" for i, metadata in enumerate(metadatas) if expected(metadata)}
+
+    assert set(collection.get(where=where, include=[])['ids']) == matching
+    found = collection.query(vectors[:2].tolist(), n_results=len(metadatas), where=where)
+    assert all(set(ids) == matching for ids in found['ids'])
+
+    collection.delete(where=where)
+    assert collection.count() == len(metadatas) - len(matching)
+    assert not set(collection.get(include=[])['ids']) & matching
+
+
+def test_where_rejects_unknown_operator(tmp_path):
+    collection, _, _ = make_collection(tmp_path, 10)
+    with pytest.raises(ValueError):
+        collection.get(where={"section": {"$like": "0%"}})
+
+
+@pytest.mark.parametrize("compression", ["int8", "pq"])
+def test_compressed_candidates_are_reranked_exactly(tmp_path, compression):
+    n = PQ_MIN_TRAIN + 500
+    collection, vectors, _ = make_collection(tmp_path, n, compression=compression, pq_m=8, rerank_factor=8)
+    assert collection._codes is not None
+
+    approximate = []
+    original = collection._quantizer.distances
+    collection._quantizer.distances = lambda *args: approximate.append(1) or original(*args)
+
+    queries = vectors[:20]
+    found = collection.query(queries.tolist(), n_results=5, include=["distances"])
+
+    # 候选集来自压缩编码，返回的距离是原始向量的精确平方 L2 距离
+    assert approximate
+    for q, (ids, distances) in enumerate(zip(found['ids'], found['distances'])):
+        rows = [int(chunk_id[1:]) for chunk_id in ids]
+        exact = ((vectors[rows] - queries[q]) ** 2).sum(axis=1)
+        np.testing.assert_allclose(distances, exact, atol=1e-4)
+        assert distances == sorted(distances)
+        assert ids[0] == f"c{q}"
+
+    # 过滤条件与压缩候选集同时使用
+    filtered = collection.query(queries[:3].tolist(), n_results=5, where={"section": "01"}, include=["metadatas"])
+    assert all(m["section"] == "01" for metadatas in filtered['metadatas'] for m in metadatas)
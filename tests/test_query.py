@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+query：include / min_score 选项，vector、routed、hybrid、lexical 与编码精确查找，以及查询结果缓存
+"""
+
+import pytest
+
+from conftest import TOPICS
+
+pytest.importorskip("chromadb")
+
+
+@pytest.fixture
+def loaded_kb(make_kb, write_files):
+    vkb = make_kb()
+    paths, metadatas = write_files(TOPICS)
+    vkb.addItems(paths, metadatas)
+    return vkb, write_files
+
+
+def test_include_selects_fields(loaded_kb):
+    vkb, _ = loaded_kb
+
+    default = vkb.query("活牛 水牛", top_k=3)
+    assert len(default) == 3 and all(set(row) == {"text", "metadata"} for row in default)
+    slim = vkb.query("活牛 水牛", top_k=3, include=["ids", "scores"])
+    assert all(set(row) == {"id", "score"} for row in slim)
+    assert vkb.get_texts([row["id"] for row in slim]) == [row["text"] for row in default]
+
+    with pytest.raises(ValueError):
+        vkb.query("活牛", include=["vectors"])
+
+
+def test_min_score_filters_results(loaded_kb):
+    vkb, _ = loaded_kb
+    scores = [row["score"] for row in vkb.query("活牛 水牛", top_k=10, include=["scores"])]
+    assert scores == sorted(scores, reverse=True)
+
+    threshold = scores[2]
+    filtered = vkb.query("活牛 水牛", top_k=10, include=["scores", "metadata"], min_score=threshold)
+    assert [row["score"] for row in filtered] == [s for s in scores if s >= threshold]
+    assert vkb.query("活牛 水牛", top_k=10, min_score=1.01) == []
+
+
+@pytest.mark.parametrize("mode", ["vector", "routed", "hybrid", "lexical"])
+def test_modes_find_matching_chapter(loaded_kb, mode):
+    vkb, _ = loaded_kb
+    results = vkb.query("非针织服装 大衣 西服套装", top_k=3, mode=mode, include=["ids", "scores", "metadata"])
+    assert results[0]["metadata"]["source_file"] == "1162.txt"
+    assert [row["score"] for row in results] == sorted((row["score"] for row in results), reverse=True)
+
+    # 过滤掉最相关的第62章后，结果只来自满足条件的第61章
+    filtered = vkb.query("非针织服装 大衣", top_k=5, mode=mode, where={"chapter": "61"})
+    assert filtered and all(row["metadata"]["chapter"] == "61" for row in filtered)
+
+
+def test_routed_mode_searches_top_chapters_only(loaded_kb):
+    vkb, _ = loaded_kb
+    results = vkb.query("活马 活驴 骡", top_k=20, mode="routed", route_sections=1, route_chapters=1)
+    assert results and {row["metadata"]["chapter"] for row in results} == {"01"}
+
+    with pytest.raises(ValueError):
+        vkb.query("活马", mode="fuzzy")
+
+
+def test_exact_code_lookup(loaded_kb):
+    vkb, _ = loaded_kb
+    encoded = []
+    backend = vkb._load_embedding_model()
+    original = backend.encode
+    backend.encode = lambda texts: encoded.append(texts) or original(texts)
+
+    results = vkb.query("第十一类", top_k=50, include=["scores", "metadata"])
+    assert results and {row["metadata"]["section"] for row in results} == {"11"}
+    assert {row["score"] for row in results} == {1.0}
+    assert encoded == []
+
+    # exact=False 时始终做向量检索；exact=True 时文本含编码即只做精确查找
+    assert vkb.query("第十一类", top_k=3, exact=False, include=["scores"])[0]["score"] < 1.0
+    assert encoded
+    assert vkb.query("第85章", exact=True) == []
+
+
+def test_query_cache_invalidated_on_generation_bump(loaded_kb):
+    vkb, write_files = loaded_kb
+    first = vkb.query("鲜冷冻猪肉", top_k=2)
+    assert vkb.query("鲜冷冻猪肉", top_k=2) == first
+    assert vkb.query_cache_stats()["hits"] == 1
+
+    generation = vkb.generation
+    paths, metadatas = write_files({"0206.txt": "鲜冷冻猪肉 食用杂碎 " * 4})
+    vkb.addItems(paths, metadatas)
+    assert vkb.generation > generation
+
+    refreshed = vkb.query("鲜冷冻猪肉", top_k=2)
+    assert vkb.query_cache_stats()["hits"] == 1
+    assert vkb.query_cache_stats()["entries"] == 1
+    assert "0206.txt" in {row["metadata"]["source_file"] for row in refreshed}
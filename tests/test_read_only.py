@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+只读实例：发现写入进程修改知识库后重新打开，且不写入知识库目录
+"""
+
+import os
+import json
+import sqlite3
+
+import pytest
+
+import embedding_backends
+from conftest import TOPICS
+
+
+def kb_files(path):
+    return {os.path.join(root, name): os.path.getmtime(os.path.join(root, name))
+            for root, _, names in os.walk(path) for name in names}
+
+
+def test_reader_sees_writer_changes(make_kb, write_files):
+    pytest.importorskip("chromadb")
+    paths, metadatas = write_files(TOPICS)
+    writer = make_kb()
+    writer.addItems(paths[:3], metadatas[:3])
+    reader = make_kb(read_only=True)
+
+    assert reader.query("针织棉制衬衫", top_k=1)[0]['metadata']['section'] != "11"
+    before = kb_files(writer.path)
+    reader.query("活马", mode="hybrid")
+    reader.list()
+    # 只读实例不修改知识库目录中的任何文件
+    assert kb_files(writer.path) == before
+    with pytest.raises(PermissionError):
+        reader.addItems(paths, metadatas)
+
+    writer.addItems(paths[3:], metadatas[3:])
+    assert reader.query("针织棉制衬衫", top_k=1)[0]['metadata']['section'] == "11"
+    assert sorted(f['source_file'] for f in reader.list()) == sorted(TOPICS)
+
+    writer.delItems([f['file_id'] for f in writer.list() if f['source_file'].startswith("11")])
+    assert all(row['metadata']['source_file'] != "11.txt"
+               for row in reader.query("第十一类 纺织原料", top_k=30))
+
+
+def test_reader_routes_without_deleted_chapter(make_kb, write_files):
+    pytest.importorskip("chromadb")
+    paths, metadatas = write_files(TOPICS)
+    writer = make_kb()
+    writer.addItems(paths, metadatas)
+    reader = make_kb(read_only=True)
+    reader.query("活牛 水牛", mode="routed")
+    assert reader.route_stats() == writer.route_stats()
+
+    writer.delWhere({"chapter": "02"})
+    results = reader.query("活牛 水牛 改良种用牛", top_k=10, mode="routed", route_chapters=2)
+
+    # 读取进程的质心与写入进程一致，不会路由到已删除的章
+    assert reader.route_stats() == writer.route_stats()
+    assert results and all(row['metadata']['chapter'] != "02" for row in results)
+    assert reader._get_route_index().stale_keys() == []
+
+
+def test_refresh_reopens_only_own_client(make_kb, write_files):
+    pytest.importorskip("chromadb")
+    from chromadb.api.client import SharedSystemClient
+
+    paths, metadatas = write_files(TOPICS)
+    writer = make_kb("writer")
+    writer.addItems(paths[:2], metadatas[:2])
+    other = make_kb("other")
+    other.addItems(paths[2:3], metadatas[2:3])
+    reader = make_kb("writer", read_only=True)
+
+    reader.query("活马", mode="routed")
+    old_client = reader.client
+    old_route_index = reader._get_route_index()
+    systems = SharedSystemClient._identifer_to_system
+    other_system = systems[other.client._identifier]
+
+    writer.addItems(paths[3:], metadatas[3:])
+    results = reader.query("针织棉制衬衫", top_k=1)
+
+    assert results[0]['metadata']['section'] == "11"
+    assert reader.client is not old_client
+    # 同一进程中其他知识库的 Chroma 系统实例不受影响
+    assert systems[other.client._identifier] is other_system
+    assert other.query("猪肉", top_k=1)[0]['metadata']['chapter'] == "03"
+    # 旧的路由索引已关闭
+    with pytest.raises(sqlite3.ProgrammingError):
+        old_route_index._conn.execute("SELECT 1")
+
+
+class _Exported:
+    """记录模型目录的 OnnxBackend 替身，backend.json 中带有已通过的校验结果"""
+
+    def __init__(self, model_dir, quantize=False, threads=0):
+        self.model_dir = model_dir
+        self.config = {"verified": {"passed": True, "tolerance": 0.02}}
+
+
+@pytest.fixture
+def fake_onnx(monkeypatch, tmp_path):
+    """不导出模型，OnnxBackend 替换为 _Exported"""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setattr(embedding_backends, "export_onnx", lambda model_name, output_dir, quantize=False: None)
+    monkeypatch.setattr(embedding_backends, "OnnxBackend", _Exported)
+
+
+def test_read_only_onnx_export_goes_to_user_cache(fake_onnx, tmp_path):
+    properties = {"model": "BAAI/bge-small-zh", "embedding_backend": "onnx"}
+    kb_path = str(tmp_path / "kb")
+
+    backend = embedding_backends.create_backend(properties, kb_path, read_only=True)
+
+    assert backend.model_dir == os.path.join(str(tmp_path / "cache"), "vector-kb", "onnx", "bge-small-zh")
+    assert not os.path.exists(kb_path)
+    backend = embedding_backends.create_backend(properties, kb_path)
+    assert backend.model_dir == os.path.join(kb_path, "onnx", "bge-small-zh")
+
+
+def test_read_only_uses_verified_model_in_kb(fake_onnx, tmp_path):
+    model_dir = tmp_path / "kb" / "onnx" / "bge-small-zh"
+    model_dir.mkdir(parents=True)
+    (model_dir / "model.onnx").write_bytes(b"")
+    (model_dir / "backend.json").write_text(json.dumps({"verified": {"passed": True, "tolerance": 0.02}}))
+    properties = {"model": "BAAI/bge-small-zh", "embedding_backend": "onnx"}
+
+    backend = embedding_backends.create_backend(properties, str(tmp_path / "kb"), read_only=True)
+
+    assert backend.model_dir == str(model_dir)
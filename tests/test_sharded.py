@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按类分片的知识库：整个类的删除直接删除分片，rebuild_section 从源文件重新导入
+"""
+
+import os
+
+import pytest
+
+from conftest import TOPICS
+
+
+@pytest.fixture(params=["chroma", "numpy"])
+def sharded_kb(request, make_kb, write_files):
+    if request.param == "chroma":
+        pytest.importorskip("chromadb")
+    vkb = make_kb(sharded=True, index_backend=request.param, dedup=True)
+    paths, metadatas = write_files(TOPICS)
+    vkb.addItems(paths, metadatas)
+    return vkb, paths, metadatas
+
+
+def section_ids(vkb, section):
+    return vkb.collection.get(where={"section": section}, include=[])['ids']
+
+
+def test_delete_whole_section_drops_shard(sharded_kb):
+    vkb, _, _ = sharded_kb
+    name = vkb.properties['name']
+    count = vkb.collection.count()
+    removed = section_ids(vkb, "11")
+    references = vkb._get_dedup_index().matching({"section": "11"})
+    assert f"{name}-section-11" in vkb._list_indexes()
+
+    shard = vkb.collection.shard("11")
+    deleted_rows = []
+    original_delete = shard.delete
+    object.__setattr__(shard, "delete", lambda *a, **kw: deleted_rows.append(kw) or original_delete(*a, **kw))
+
+    result = vkb.delWhere({"section": "11"})
+
+    # 不逐条删除向量，分片整体删除
+    assert deleted_rows == []
+    assert f"{name}-section-11" not in vkb._list_indexes()
+    assert vkb.collection.shard("11") is None
+    # 近似重复的引用一并删除
+    assert result == {"files": 3, "chunks": len(removed) + len(references)}
+    assert vkb.collection.count() == count - len(removed)
+
+    # 各索引与 collection 保持一致
+    assert vkb.route_stats()['chunks'] == vkb.collection.count()
+    assert vkb.route_stats()['sections'] == 2
+    assert vkb._get_lexical_index().stats()['docs'] == vkb.collection.count()
+    assert not vkb._get_dedup_index().matching({"section": "11"})
+    assert sorted(f['source_file'] for f in vkb.list()) == ["0101.txt", "0102.txt", "0203.txt"]
+    assert all(r['metadata']['section'] != "11" for r in vkb.query("针织棉制衬衫", top_k=20, mode="hybrid"))
+
+    # 再次写入该类时重新创建分片
+    vkb.addItems(*sharded_kb[1:])
+    assert len(section_ids(vkb, "11")) == len(removed)
+
+
+def test_rebuild_section_reingests_from_source(sharded_kb):
+    vkb, paths, _ = sharded_kb
+    before = {f['source_file']: f for f in vkb.list()}
+    other = sorted(section_ids(vkb, "01"))
+
+    with open(paths[3], 'w', encoding='utf-8') as f:
+        f.write("针织钩编服装 羊毛制开襟衫 " * 12)
+    results = vkb.rebuild_section("11")
+
+    section_files = ("1161.txt", "1162.txt", "11.txt")
+    assert sorted(r['file_id'] for r in results) == sorted(before[name]['file_id'] for name in section_files)
+    assert all(r['error'] is None for r in results)
+    after = {f['source_file']: f for f in vkb.list()}
+    assert after["1161.txt"]['chunk_count'] == len(vkb._parser(paths[3]))
+    top = vkb.query("羊毛制开襟衫", top_k=1, where={"section": "11"})[0]
+    assert top['metadata']['source_file'] == "1161.txt" and "羊毛制开襟衫" in top['text']
+    # 其他类不受影响
+    assert sorted(section_ids(vkb, "01")) == other
+    assert vkb.route_stats()['chunks'] == vkb.collection.count()
+
+    # 源文件缺失时不做任何修改
+    os.remove(paths[4])
+    count = vkb.collection.count()
+    with pytest.raises(ValueError):
+        vkb.rebuild_section("11")
+    assert vkb.collection.count() == count
@@ -76,14 +76,18 @@ def extract_metadata_from_filename(filename):
     }
 
 
-def add_all_files_to_kb(folder_path, kb_instance):
+def add_all_files_to_kb(folder_path, kb_instance, workers=0):
     """
-    遍历指定文件夹中的所有文件，并将其添加到知识库中
+    遍历指定文件夹中的所有文件，并将其批量添加到知识库中
     
     Args:
         folder_path: 要遍历的文件夹路径
         kb_instance: 知识库实例
+        workers: 解析文件的进程数，0 表示在当前进程中顺序解析
     """
+    filepaths = []
+    metadatas = []
+    
     # 遍历文件夹中的所有文件
     for root, dirs, files in os.walk(folder_path):
         for file in files:
@@ -94,16 +98,22 @@ def add_all_files_to_kb(folder_path, kb_instance):
             file_path = os.path.join(root, file)
             print(f"正在处理文件: {file_path}")
             
-            try:
-                # 提取metadata
-                metadata = extract_metadata_from_filename(file)
-                print(f"提取的metadata: {metadata}")
-                
-                # 添加文件到知识库
-                file_id = kb_instance.addItem(file_path, metadata)
-                print(f"文件已成功添加到知识库，文件ID: {file_id}")
-            except Exception as e:
-                print(f"处理文件 {file_path} 时出错: {str(e)}")
+            # 提取metadata
+            metadata = extract_metadata_from_filename(file)
+            print(f"提取的metadata: {metadata}")
+            
+            filepaths.append(file_path)
+            metadatas.append(metadata)
+    
+    # 批量添加文件到知识库
+    print(f"共 {len(filepaths)} 个文件，开始批量添加...")
+    results = kb_instance.addItems(filepaths, metadatas, workers=workers)
+    
+    for result in results:
+        if result["error"] is None:
+            print(f"文件 {result['filepath']} 已成功添加到知识库，文件ID: {result['file_id']}")
+        else:
+            print(f"处理文件 {result['filepath']} 时出错: {result['error']}")
 
 
 def main():
@@ -134,7 +144,7 @@ def main():
     
     # 添加所有文件到知识库
     print(f"开始处理文件夹: {folder_path}")
-    add_all_files_to_kb(folder_path, knowledge_base)
+    add_all_files_to_kb(folder_path, knowledge_base, workers=os.cpu_count() or 1)
     
     print("所有文件已处理完毕！")
 
@@ -15,6 +15,7 @@ from pathlib import Path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from kb import kb
+from kb_client import KBClient
 
 try:
     from prompt_toolkit import prompt
@@ -31,16 +32,21 @@ except ImportError:
 class KBCLI:
     """知识库CLI客户端主类"""
     
-    def __init__(self, kb_path: Optional[str] = None):
+    def __init__(self, kb_path: Optional[str] = None, server_url: Optional[str] = None):
         """
         初始化CLI客户端
         
         Args:
             kb_path: 知识库路径，如果为None则使用当前目录
+            server_url: 知识库查询服务地址（见 kb_server.py），指定时通过服务访问知识库，不在本进程加载模型
         """
         self.kb_path = kb_path or os.getcwd()
+        self.server_url = server_url
         self.vkb = None
-        self._ensure_kb_exists()
+        if server_url:
+            self._connect_server()
+        else:
+            self._ensure_kb_exists()
         self.command_history_file = os.path.join(self.kb_path, ".cli_history")
         
         # 设置命令补全
@@ -62,6 +68,13 @@ class KBCLI:
             print(f"初始化知识库时出错: {e}")
             sys.exit(1)
     
+    def _connect_server(self):
+        """连接知识库查询服务"""
+        self.vkb = KBClient(self.server_url)
+        if not self.vkb.health():
+            print(f"无法连接知识库查询服务: {self.server_url}")
+            sys.exit(1)
+    
     def _create_kb(self):
         """创建新的知识库"""
         try:
@@ -267,7 +280,7 @@ class KBCLI:
         print("\n" + "="*50)
         print("知识库管理系统")
         print("="*50)
-        print(f"当前知识库路径: {self.kb_path}")
+        print(f"当前知识库路径: {self.server_url or self.kb_path}")
         print("\n可用命令:")
         print("  1. list     - 列出所有文件")
         print("  2. delete   - 删除文件")
@@ -284,6 +297,7 @@ class KBCLI:
 1. 路径管理:
    - 默认使用当前工作目录作为知识库路径
    - 可通过命令行参数 -p 或 --path 指定其他路径
+   - 可通过命令行参数 -s 或 --server 连接知识库查询服务（kb_server.py），不在本进程加载模型
 
 2. 知识库检测与创建:
    - 自动检测指定路径是否存在知识库
@@ -314,6 +328,7 @@ class KBCLI:
 示例用法:
   python cli_client.py           # 使用当前目录
   python cli_client.py -p /path/to/kb  # 指定知识库路径
+  python cli_client.py -s http://127.0.0.1:8765  # 连接查询服务
 
 安装prompt_toolkit以获得更好的交互体验:
   pip install prompt_toolkit
@@ -349,7 +364,7 @@ class KBCLI:
     def run(self):
         """运行CLI客户端主循环"""
         print(f"欢迎使用知识库管理系统!")
-        print(f"知识库路径: {self.kb_path}")
+        print(f"知识库路径: {self.server_url or self.kb_path}")
         
         if not HAS_PROMPT_TOOLKIT:
             print("\n提示: 安装 prompt_toolkit 可获得命令补全和历史记录功能:")
@@ -391,11 +406,12 @@ def main():
     """主函数"""
     parser = argparse.ArgumentParser(description="知识库管理系统CLI客户端")
     parser.add_argument('-p', '--path', help='知识库路径，默认为当前目录')
+    parser.add_argument('-s', '--server', help='知识库查询服务地址，例如 http://127.0.0.1:8765')
     
     args = parser.parse_args()
     
     # 创建并运行CLI客户端
-    cli = KBCLI(args.path)
+    cli = KBCLI(args.path, args.server)
     cli.run()
 
 
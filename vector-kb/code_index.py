@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HS 编码精确索引：类、章、税目编码 -> chunk id
+
+编码统一规范化为:
+- 类: S + 两位数字，例如 S11（第十一类 / Section XI）
+- 章: C + 两位数字，例如 C85（第85章 / 第八十五章 / Chapter 85 / CH85）
+- 税目: H + 四位数字，例如 H8471（8471 / 84.71 / 8471.30 / 84713000）
+
+编码来源于 chunk 元数据（section、chapter、heading 字段）以及 chunk 文本中出现的编码，
+查询文本只由编码组成时可直接通过该索引返回结果，无需向量化。
+"""
+
+import re
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+
+from concurrency import connect_sqlite
+
+
+# 编码来源，数值越小排序越靠前：元数据 > 本章文本中出现 > 其他文本中出现（如其他章的排除条款）
+SOURCE_METADATA = 0
+SOURCE_OWN_TEXT = 1
+SOURCE_TEXT = 2
+
+_CN_DIGITS = {"零": 0, "〇": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4,
+              "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_ROMAN = {"I": 1, "V": 5, "X": 10, "L": 50}
+_NUMBER = r"(\d{1,2}|[零〇一二两三四五六七八九十]{1,3})"
+
+_TEXT_PATTERNS = [
+    # 第十一类 / 第11类
+    ("S", re.compile(r"第" + _NUMBER + r"类")),
+    # Section XI / Section 11
+    ("S", re.compile(r"\bsection\s*([IVXL]{1,6}|\d{1,2})\b", re.IGNORECASE)),
+    # 第八十五章 / 第85章
+    ("C", re.compile(r"第" + _NUMBER + r"章")),
+    # Chapter 85 / CH85
+    ("C", re.compile(r"\b(?:chapter|ch)\s*(\d{1,2})\b", re.IGNORECASE)),
+    # 84.71，但不匹配 1.84.71、84.7112 以及带单位的数值（12.50元、12.50%）
+    ("H", re.compile(r"(?<![\d.])(\d{2})\.(\d{2})(?![\d%])(?!\.\d)"
+                     r"(?!\s*(?:元|美元|克|千克|公斤|吨|毫米|厘米|米|升|kg|g\b|mm|cm|m\b|l\b))", re.IGNORECASE)),
+    # 8471.30 / 8471.3010
+    ("H", re.compile(r"(?<![\d.])(\d{4})\.\d{2,4}(?![\d%])")),
+    # 84713000 / 8471300010
+    ("H", re.compile(r"(?<!\d)(\d{4})(?:\d{4}|\d{6})(?!\d)")),
+    # 税目8471 / 品目 8471 / heading 8471
+    ("H", re.compile(r"(?:税目|品目|税号|编号|heading)\s*(\d{4})(?!\d)", re.IGNORECASE)),
+]
+
+_QUERY_PATTERNS = [
+    ("S", re.compile(r"^(?:第" + _NUMBER + r"类|s(\d{1,2})|section([IVXL]{1,6}|\d{1,2}))$", re.IGNORECASE)),
+    ("C", re.compile(r"^(?:第?" + _NUMBER + r"章|(?:ch|chapter)(\d{1,2}))$", re.IGNORECASE)),
+    ("H", re.compile(r"^(?:税目|品目|税号|heading)?(\d{2})\.?(\d{2})(?:\.?\d{2}(?:\.?\d{2}){0,2})?$",
+                     re.IGNORECASE)),
+]
+
+
+def _to_int(value: str) -> Optional[int]:
+    """将阿拉伯数字、中文数字（一至九十九）或罗马数字转换为整数"""
+    if value.isdigit():
+        return int(value)
+    if value.upper() and all(c in _ROMAN for c in value.upper()):
+        total = 0
+        digits = [_ROMAN[c] for c in value.upper()]
+        for i, digit in enumerate(digits):
+            total += -digit if i + 1 < len(digits) and digit < digits[i + 1] else digit
+        return total
+    if "十" in value:
+        tens, _, ones = value.partition("十")
+        if (tens and tens not in _CN_DIGITS) or (ones and ones not in _CN_DIGITS):
+            return None
+        return (_CN_DIGITS[tens] if tens else 1) * 10 + (_CN_DIGITS[ones] if ones else 0)
+    if len(value) == 1 and value in _CN_DIGITS:
+        return _CN_DIGITS[value]
+    return None
+
+
+def _make_code(kind: str, number: Optional[int]) -> Optional[str]:
+    """生成规范化编码，超出 HS 编码范围的数字返回 None"""
+    if number is None:
+        return None
+    if kind == "S" and 1 <= number <= 22:
+        return f"S{number:02d}"
+    if kind == "C" and 1 <= number <= 97 and number != 77:
+        return f"C{number:02d}"
+    if kind == "H" and 100 <= number <= 9799 and number // 100 != 77 and number % 100 != 0:
+        return f"H{number:04d}"
+    return None
+
+
+def _match_code(kind: str, match) -> Optional[str]:
+    """将正则匹配结果转换为规范化编码"""
+    groups = [g for g in match.groups() if g]
+    if not groups:
+        return None
+    if kind == "H":
+        return _make_code("H", int("".join(groups)[:4]))
+    return _make_code(kind, _to_int(groups[0]))
+
+
+def extract_codes(text: str) -> List[str]:
+    """
+    提取文本中出现的类、章、税目编码
+
+    Args:
+        text: chunk 文本
+
+    Returns:
+        去重后的规范化编码列表
+    """
+    codes = []
+    for kind, pattern in _TEXT_PATTERNS:
+        for match in pattern.finditer(text):
+            code = _match_code(kind, match)
+            if code and code not in codes:
+                codes.append(code)
+    return codes
+
+
+def metadata_codes(metadata: Dict[str, Any]) -> List[str]:
+    """
+    从 chunk 元数据的 section、chapter、heading 字段生成编码
+
+    Args:
+        metadata: chunk 元数据
+
+    Returns:
+        规范化编码列表
+    """
+    codes = []
+    for kind, field in (("S", "section"), ("C", "chapter"), ("H", "heading")):
+        value = str(metadata.get(field) or "").replace(".", "")
+        if value.isdigit():
+            code = _make_code(kind, int(value[:4]) if kind == "H" else int(value))
+            if code:
+                codes.append(code)
+    return codes
+
+
+def parse_query_codes(text: str) -> Tuple[List[str], bool]:
+    """
+    解析查询文本中的编码
+
+    Args:
+        text: 查询文本
+
+    Returns:
+        (编码列表, 是否整个查询都由编码组成)
+    """
+    # 去掉关键字与数字之间的空格，例如 "Chapter 85" -> "Chapter85"
+    normalized = re.sub(r"(?i)\b(chapter|section|ch|heading)\s+", r"\1", text.strip())
+    tokens = [t for t in re.split(r"[\s,，、;；/|]+", normalized) if t]
+
+    codes = []
+    pure = bool(tokens)
+    for token in tokens:
+        code = None
+        for kind, pattern in _QUERY_PATTERNS:
+            match = pattern.match(token)
+            if match:
+                code = _match_code(kind, match)
+                break
+        if code is None:
+            pure = False
+            for extracted in extract_codes(token):
+                if extracted not in codes:
+                    codes.append(extracted)
+        elif code not in codes:
+            codes.append(code)
+    return codes, pure and bool(codes)
+
+
+class CodeIndex:
+    """
+    基于 SQLite 的编码 -> chunk id 索引
+    """
+
+    def __init__(self, path: str, read_only: bool = False):
+        """
+        初始化编码索引
+
+        Args:
+            path: 索引数据库文件路径
+            read_only: 是否以只读方式打开已有的索引
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(path, read_only)
+        if not read_only:
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS codes ("
+                "  code TEXT NOT NULL,"
+                "  chunk_id TEXT NOT NULL,"
+                "  file_id TEXT NOT NULL,"
+                "  source INTEGER NOT NULL,"
+                "  chunk_index INTEGER NOT NULL,"
+                "  PRIMARY KEY (code, chunk_id)"
+                ");"
+                "CREATE INDEX IF NOT EXISTS codes_chunk ON codes (chunk_id);"
+            )
+            self._conn.commit()
+
+    def add(self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]]):
+        """
+        索引一批 chunk
+
+        Args:
+            ids: chunk id 列表
+            documents: chunk 文本列表
+            metadatas: chunk 元数据列表
+        """
+        rows = []
+        for chunk_id, document, metadata in zip(ids, documents, metadatas):
+            metadata = metadata or {}
+            chapter = str(metadata.get("chapter") or "")
+            sources = {}
+            for code in extract_codes(document or ""):
+                own = code[0] in "CH" and chapter and code[1:3] == chapter.zfill(2)
+                sources[code] = SOURCE_OWN_TEXT if own else SOURCE_TEXT
+            for code in metadata_codes(metadata):
+                sources[code] = SOURCE_METADATA
+            rows.extend(
+                (code, chunk_id, metadata.get("file_id", ""), source, metadata.get("chunk_index", 0))
+                for code, source in sources.items()
+            )
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO codes (code, chunk_id, file_id, source, chunk_index) "
+                "VALUES (?, ?, ?, ?, ?)", rows
+            )
+
+    def remove(self, ids: List[str]):
+        """
+        移除一批 chunk 的索引
+
+        Args:
+            ids: chunk id 列表
+        """
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM codes WHERE chunk_id = ?", [(chunk_id,) for chunk_id in ids])
+
+    def update_positions(self, ids: List[str], chunk_indexes: List[int]):
+        """
+        更新移动过的 chunk 在文件中的序号（用于结果排序）
+
+        Args:
+            ids: chunk id 列表
+            chunk_indexes: 对应的新序号
+        """
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE codes SET chunk_index = ? WHERE chunk_id = ?",
+                [(index, chunk_id) for chunk_id, index in zip(ids, chunk_indexes)]
+            )
+
+    def lookup(self, codes: List[str], limit: int, offset: int = 0) -> List[str]:
+        """
+        查找包含任一编码的 chunk
+
+        结果按查询中编码的顺序排列；同一编码下，元数据中带有该编码的 chunk 最前，
+        其次是所属章的文本中提及该编码的 chunk，再次是其他文本中提及的 chunk，最后按文件和 chunk 序号排列。
+
+        Args:
+            codes: 规范化编码列表
+            limit: 返回的最大数量
+            offset: 跳过的数量，用于分页
+
+        Returns:
+            chunk id 列表
+        """
+        if not codes:
+            return []
+        rank = "CASE code " + " ".join(f"WHEN ? THEN {i}" for i in range(len(codes))) + " END"
+        placeholders = ",".join("?" * len(codes))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT chunk_id FROM codes WHERE code IN ({placeholders}) GROUP BY chunk_id "
+                f"ORDER BY MIN({rank} * 3 + source), file_id, chunk_index LIMIT ? OFFSET ?",
+                [*codes, *codes, limit, offset]
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def clear(self):
+        """清空索引"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM codes")
+
+    def stats(self) -> Dict[str, int]:
+        """
+        获取索引的统计信息
+
+        Returns:
+            包含 codes（不同编码数）和 entries（编码-chunk 对数）的字典
+        """
+        with self._lock:
+            codes, entries = self._conn.execute("SELECT COUNT(DISTINCT code), COUNT(*) FROM codes").fetchone()
+        return {"codes": codes, "entries": entries}
+
+    def close(self):
+        """关闭数据库连接"""
+        self._conn.close()
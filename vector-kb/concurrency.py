@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多进程共享知识库目录时使用的工具：跨进程写锁与只读 SQLite 连接
+
+同一目录下同一时间只允许一个进程写入，写入进程在每次修改期间持有 writer.lock 上的文件锁；
+只读进程不获取该锁，以只读方式打开各 SQLite 文件，可以与写入进程同时运行。
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+# 获取锁失败时的重试间隔（秒）
+POLL_INTERVAL = 0.05
+
+
+def connect_sqlite(path: str, read_only: bool = False) -> sqlite3.Connection:
+    """
+    打开 SQLite 数据库，连接可在多个线程间共用（调用方自行加锁）
+
+    Args:
+        path: 数据库文件路径
+        read_only: 是否以只读方式打开；只读时文件必须已存在
+
+    Returns:
+        数据库连接
+    """
+    if read_only:
+        return sqlite3.connect(Path(path).resolve().as_uri() + "?mode=ro", uri=True, check_same_thread=False)
+    return sqlite3.connect(path, check_same_thread=False)
+
+
+class FileLock:
+    """
+    可重入的跨进程排他文件锁
+
+    同一对象在同一进程内可以嵌套获取，最外层释放时才真正解锁；
+    不同进程（或同一进程中的不同 FileLock 对象）之间互斥。
+    """
+
+    def __init__(self, path: str):
+        """
+        初始化文件锁，锁文件在首次获取时创建
+
+        Args:
+            path: 锁文件路径
+        """
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def _try_lock(self) -> bool:
+        """尝试获取系统文件锁，不阻塞"""
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(self._fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def acquire(self, timeout: Optional[float] = None):
+        """
+        获取锁
+
+        Args:
+            timeout: 最长等待时间（秒），None 表示一直等待
+
+        Raises:
+            TimeoutError: 超时仍未获取到锁
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if not self._lock.acquire(timeout=-1 if timeout is None else max(0.0, timeout)):
+            raise TimeoutError(f"等待写锁超时: {self.path}")
+        if self._depth > 0:
+            self._depth += 1
+            return
+
+        try:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            while not self._try_lock():
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise TimeoutError(f"等待写锁超时，另一个进程正在写入: {self.path}")
+                time.sleep(POLL_INTERVAL)
+        except BaseException:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            self._lock.release()
+            raise
+        self._depth = 1
+
+    def release(self):
+        """释放锁"""
+        self._depth -= 1
+        if self._depth == 0:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+                else:
+                    msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+            finally:
+                os.close(self._fd)
+                self._fd = None
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+近似重复 chunk 检测：SimHash 指纹 + 分段（band）索引
+
+每个 chunk 以 lexical_index.tokenize 切出的检索词为特征计算 64 位 SimHash 指纹。
+汉明距离不超过 max_distance 的两个指纹，切成 max_distance + 1 段后至少有一段完全相同，
+因此只需按段值查找候选，再计算汉明距离确认。
+
+与已有 chunk（原始 chunk）近似重复的新 chunk 不写入向量，只作为引用记录其文本和完整元数据；
+只有 section、chapter 相同的 chunk 之间才会去重，按类/章过滤的查询结果不受影响。
+"""
+
+import json
+import hashlib
+import threading
+from typing import List, Dict, Any, Optional, Iterable, Tuple
+
+import numpy as np
+
+from lexical_index import tokenize
+from concurrency import connect_sqlite
+
+
+# 只在这些元数据字段都相同的 chunk 之间去重
+DEDUP_SCOPE = ("section", "chapter")
+
+# 检索词少于该数量的 chunk 指纹不稳定，不参与去重
+MIN_TOKENS = 16
+
+
+def simhash(text: str) -> Optional[int]:
+    """
+    计算文本的 64 位 SimHash 指纹
+
+    Args:
+        text: chunk 文本
+
+    Returns:
+        有符号 64 位整数形式的指纹（便于存入 SQLite）；检索词过少时为 None
+    """
+    tokens = tokenize(text)
+    if len(tokens) < MIN_TOKENS:
+        return None
+    counts = {}
+    for token in tokens:
+        counts[token] = counts.get(token, 0) + 1
+    hashes = np.frombuffer(
+        b"".join(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest() for token in counts),
+        dtype=">u8"
+    )
+    weights = np.fromiter(counts.values(), dtype=np.int64, count=len(counts))
+    # (特征数, 64) 的比特矩阵，最高位在前
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1).astype(np.int64)
+    votes = ((bits * 2 - 1) * weights[:, None]).sum(axis=0)
+    value = 0
+    for vote in votes:
+        value = (value << 1) | int(vote > 0)
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def match_where(metadata: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    """
+    判断一条元数据是否满足 Chroma 风格的过滤条件
+
+    支持 $and、$or 以及 $eq、$ne、$gt、$gte、$lt、$lte、$in、$nin 运算符
+
+    Args:
+        metadata: chunk 元数据
+        where: 过滤条件
+
+    Returns:
+        是否满足
+    """
+    for key, condition in (where or {}).items():
+        if key == "$and":
+            if not all(match_where(metadata, sub) for sub in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(match_where(metadata, sub) for sub in condition):
+                return False
+            continue
+
+        value = metadata.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op, expected in condition.items():
+            if op == "$eq":
+                ok = value == expected
+            elif op == "$ne":
+                ok = value != expected
+            elif op == "$in":
+                ok = value in expected
+            elif op == "$nin":
+                ok = value not in expected
+            elif op in ("$gt", "$gte", "$lt", "$lte"):
+                if not isinstance(value, (int, float)) or isinstance(value, bool):
+                    return False
+                ok = {"$gt": value > expected, "$gte": value >= expected,
+                      "$lt": value < expected, "$lte": value <= expected}[op]
+            else:
+                raise ValueError(f"不支持的过滤运算符: {op}")
+            if not ok:
+                return False
+    return True
+
+
+class DedupIndex:
+    """
+    基于 SQLite 的近似重复索引，记录原始 chunk 的指纹以及指向原始 chunk 的引用
+    """
+
+    def __init__(self, path: str, max_distance: int = 3, read_only: bool = False):
+        """
+        初始化去重索引
+
+        Args:
+            path: 索引数据库文件路径
+            max_distance: 判定为近似重复的最大汉明距离（64 位指纹）
+            read_only: 是否以只读方式打开已有的索引
+        """
+        self.path = path
+        self.max_distance = max_distance
+        n_bands = max_distance + 1
+        width = 64 // n_bands
+        # 每段的 (右移位数, 掩码)，最后一段包含剩余的全部高位
+        self._bands = []
+        for band in range(n_bands):
+            bits = width if band < n_bands - 1 else 64 - width * (n_bands - 1)
+            self._bands.append((band * width, (1 << bits) - 1))
+
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(path, read_only)
+        if not read_only:
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS fingerprints ("
+                "  chunk_id TEXT PRIMARY KEY,"
+                "  fingerprint INTEGER NOT NULL,"
+                "  scope TEXT NOT NULL"
+                ");"
+                "CREATE TABLE IF NOT EXISTS bands ("
+                "  band INTEGER NOT NULL,"
+                "  value INTEGER NOT NULL,"
+                "  chunk_id TEXT NOT NULL,"
+                "  PRIMARY KEY (band, value, chunk_id)"
+                ") WITHOUT ROWID;"
+                "CREATE INDEX IF NOT EXISTS bands_chunk ON bands (chunk_id);"
+                "CREATE TABLE IF NOT EXISTS refs ("
+                "  ref_id TEXT PRIMARY KEY,"
+                "  canonical_id TEXT NOT NULL,"
+                "  file_id TEXT NOT NULL,"
+                "  document TEXT NOT NULL,"
+                "  metadata TEXT NOT NULL"
+                ");"
+                "CREATE INDEX IF NOT EXISTS refs_canonical ON refs (canonical_id);"
+                "CREATE INDEX IF NOT EXISTS refs_file ON refs (file_id);"
+                + "".join(f"CREATE INDEX IF NOT EXISTS refs_{key} ON refs ({self._json_column(key)});"
+                          for key in DEDUP_SCOPE)
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def scope(metadata: Dict[str, Any]) -> str:
+        """
+        去重范围键：只有范围键相同的 chunk 之间才会去重
+
+        Args:
+            metadata: chunk 元数据
+
+        Returns:
+            由 DEDUP_SCOPE 中各字段组成的字符串
+        """
+        return json.dumps([str(metadata.get(key) or "") for key in DEDUP_SCOPE])
+
+    def _band_values(self, fingerprint: int) -> List[tuple]:
+        """指纹各段的 (段号, 段值)"""
+        unsigned = fingerprint & ((1 << 64) - 1)
+        values = []
+        for band, (shift, mask) in enumerate(self._bands):
+            value = (unsigned >> shift) & mask
+            # 超出 SQLite 有符号整数范围的段值（只有一段时）转换为有符号数
+            values.append((band, value - (1 << 64) if value >= (1 << 63) else value))
+        return values
+
+    def _register(self, chunk_id: str, fingerprint: int, scope: str):
+        """登记原始 chunk 的指纹，调用方需持有锁并处于事务中"""
+        self._conn.execute("INSERT OR REPLACE INTO fingerprints (chunk_id, fingerprint, scope) VALUES (?, ?, ?)",
+                           (chunk_id, fingerprint, scope))
+        self._conn.execute("DELETE FROM bands WHERE chunk_id = ?", (chunk_id,))
+        self._conn.executemany("INSERT INTO bands (band, value, chunk_id) VALUES (?, ?, ?)",
+                               [(band, value, chunk_id) for band, value in self._band_values(fingerprint)])
+
+    def _find(self, fingerprint: int, scope: str) -> Optional[str]:
+        """查找同一范围内汉明距离最小且不超过阈值的原始 chunk，调用方需持有锁"""
+        bands = self._band_values(fingerprint)
+        condition = " OR ".join("(b.band = ? AND b.value = ?)" for _ in bands)
+        rows = self._conn.execute(
+            f"SELECT DISTINCT f.chunk_id, f.fingerprint FROM bands b JOIN fingerprints f ON f.chunk_id = b.chunk_id "
+            f"WHERE ({condition}) AND f.scope = ?",
+            [v for pair in bands for v in pair] + [scope]
+        ).fetchall()
+        best = None
+        for chunk_id, candidate in rows:
+            distance = bin((fingerprint ^ candidate) & ((1 << 64) - 1)).count("1")
+            if distance <= self.max_distance and (best is None or distance < best[1]):
+                best = (chunk_id, distance)
+        return best[0] if best else None
+
+    def assign(self, chunk_id: str, document: str, metadata: Dict[str, Any]) -> Optional[str]:
+        """
+        为新 chunk 判定是否近似重复
+
+        近似重复时记录为引用并返回原始 chunk 的 id；否则登记为原始 chunk 并返回 None，
+        调用方随后需要向量化并写入该 chunk。
+
+        Args:
+            chunk_id: 新 chunk 的 id
+            document: chunk 文本
+            metadata: chunk 元数据
+
+        Returns:
+            原始 chunk 的 id，或 None
+        """
+        fingerprint = simhash(document)
+        if fingerprint is None:
+            return None
+        scope = self.scope(metadata)
+        with self._lock, self._conn:
+            canonical_id = self._find(fingerprint, scope)
+            if canonical_id is None:
+                self._register(chunk_id, fingerprint, scope)
+                return None
+            self._conn.execute(
+                "INSERT OR REPLACE INTO refs (ref_id, canonical_id, file_id, document, metadata) VALUES (?, ?, ?, ?, ?)",
+                (chunk_id, canonical_id, metadata.get("file_id", ""), document,
+                 json.dumps(metadata, ensure_ascii=False))
+            )
+            return canonical_id
+
+    def register(self, chunk_id: str, document: str, metadata: Dict[str, Any]):
+        """
+        将一个已写入 collection 的 chunk 登记为原始 chunk（例如被提升的引用）
+
+        Args:
+            chunk_id: chunk id
+            document: chunk 文本
+            metadata: chunk 元数据
+        """
+        fingerprint = simhash(document)
+        if fingerprint is None:
+            return
+        with self._lock, self._conn:
+            self._register(chunk_id, fingerprint, self.scope(metadata))
+
+    @staticmethod
+    def _row(row) -> Dict[str, Any]:
+        ref_id, canonical_id, document, metadata = row
+        return {"id": ref_id, "canonical_id": canonical_id, "document": document, "metadata": json.loads(metadata)}
+
+    def _select(self, condition: str, params: list) -> List[Dict[str, Any]]:
+        """按条件读取引用，调用方需持有锁"""
+        rows = self._conn.execute(
+            f"SELECT ref_id, canonical_id, document, metadata FROM refs WHERE {condition} ORDER BY ref_id", params
+        ).fetchall()
+        return [self._row(row) for row in rows]
+
+    def references(self, canonical_ids: Iterable[str]) -> List[Dict[str, Any]]:
+        """
+        获取指向一组原始 chunk 的引用
+
+        Args:
+            canonical_ids: 原始 chunk id
+
+        Returns:
+            引用列表，每个元素包含 id、canonical_id、document、metadata
+        """
+        canonical_ids = list(canonical_ids)
+        if not canonical_ids:
+            return []
+        with self._lock:
+            return self._select(f"canonical_id IN ({','.join('?' * len(canonical_ids))})", canonical_ids)
+
+    def get(self, ref_ids: Iterable[str]) -> List[Dict[str, Any]]:
+        """
+        按 id 获取引用，不是引用的 id 被忽略
+
+        Args:
+            ref_ids: chunk id
+
+        Returns:
+            引用列表
+        """
+        ref_ids = list(ref_ids)
+        if not ref_ids:
+            return []
+        with self._lock:
+            return self._select(f"ref_id IN ({','.join('?' * len(ref_ids))})", ref_ids)
+
+    @staticmethod
+    def _json_column(key: str) -> str:
+        """DEDUP_SCOPE 中字段在 SQL 中的表达式，与其表达式索引的写法一致"""
+        return f"json_extract(metadata, '$.{key}')"
+
+    @classmethod
+    def _where_sql(cls, where: Optional[Dict[str, Any]]) -> Tuple[List[str], list]:
+        """
+        将过滤条件中顶层及 $and 内的相等和 $in 条件转换为 SQL 条件，其余条件留给 match_where 在读取后判断
+
+        file_id 使用 refs_file 索引，DEDUP_SCOPE 中的字段使用表达式索引，其他字段用 json_extract 过滤。
+
+        Returns:
+            (SQL 条件列表, 参数列表)
+        """
+        conditions, params = [], []
+        for key, condition in (where or {}).items():
+            if key == "$and":
+                for sub in condition:
+                    sub_conditions, sub_params = cls._where_sql(sub)
+                    conditions.extend(sub_conditions)
+                    params.extend(sub_params)
+                continue
+            if key.startswith("$"):
+                continue
+
+            if key == "file_id":
+                column, column_params = "file_id", []
+            elif key in DEDUP_SCOPE:
+                column, column_params = cls._json_column(key), []
+            else:
+                column, column_params = "json_extract(metadata, ?)", ['$."' + key.replace('"', '\\"') + '"']
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for op, expected in condition.items():
+                if op == "$eq" and isinstance(expected, (str, int, float)):
+                    conditions.append(f"{column} = ?")
+                    params.extend(column_params + [expected])
+                elif op == "$in" and all(isinstance(value, (str, int, float)) for value in expected):
+                    if not expected:
+                        conditions.append("0")
+                        continue
+                    conditions.append(f"{column} IN ({','.join('?' * len(expected))})")
+                    params.extend(column_params + list(expected))
+        return conditions, params
+
+    def matching(self, where: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        获取元数据满足过滤条件的全部引用
+
+        相等和 $in 条件由 SQLite 按索引过滤（见 _where_sql），其余条件对过滤后的引用逐条判断。
+
+        Args:
+            where: Chroma 风格的过滤条件
+
+        Returns:
+            引用列表
+        """
+        conditions, params = self._where_sql(where)
+        with self._lock:
+            rows = self._select(" AND ".join(conditions) or "1", params)
+        return [row for row in rows if match_where(row["metadata"], where)]
+
+    def repoint(self, canonical_id: str, new_canonical_id: str):
+        """
+        将指向某个原始 chunk 的引用改为指向另一个 chunk
+
+        Args:
+            canonical_id: 原来的原始 chunk id
+            new_canonical_id: 新的原始 chunk id
+        """
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE refs SET canonical_id = ? WHERE canonical_id = ?",
+                               (new_canonical_id, canonical_id))
+
+    def update_references(self, ids: List[str], metadatas: List[Dict[str, Any]]) -> List[str]:
+        """
+        更新引用的元数据，不是引用的 id 被忽略
+
+        Args:
+            ids: chunk id 列表
+            metadatas: 对应的新元数据
+
+        Returns:
+            确实是引用并已更新的 id 列表
+        """
+        updated = []
+        with self._lock, self._conn:
+            for chunk_id, metadata in zip(ids, metadatas):
+                cursor = self._conn.execute("UPDATE refs SET metadata = ?, file_id = ? WHERE ref_id = ?",
+                                            (json.dumps(metadata, ensure_ascii=False),
+                                             metadata.get("file_id", ""), chunk_id))
+                if cursor.rowcount:
+                    updated.append(chunk_id)
+        return updated
+
+    def discard(self, ids: Iterable[str]) -> List[str]:
+        """
+        移除一组 chunk：删除其指纹和引用记录，以及仍指向它们的引用
+
+        Args:
+            ids: chunk id（原始 chunk 或引用均可）
+
+        Returns:
+            因原始 chunk 被移除而一并删除的引用 id 列表
+        """
+        ids = list(ids)
+        orphans = []
+        with self._lock, self._conn:
+            for chunk_id in ids:
+                self._conn.execute("DELETE FROM refs WHERE ref_id = ?", (chunk_id,))
+                orphans.extend(row[0] for row in self._conn.execute(
+                    "SELECT ref_id FROM refs WHERE canonical_id = ?", (chunk_id,)))
+                self._conn.execute("DELETE FROM refs WHERE canonical_id = ?", (chunk_id,))
+                self._conn.execute("DELETE FROM fingerprints WHERE chunk_id = ?", (chunk_id,))
+                self._conn.execute("DELETE FROM bands WHERE chunk_id = ?", (chunk_id,))
+        return orphans
+
+    def clear(self):
+        """清空索引"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM fingerprints")
+            self._conn.execute("DELETE FROM bands")
+            self._conn.execute("DELETE FROM refs")
+
+    def stats(self) -> Dict[str, int]:
+        """
+        获取去重索引的统计信息
+
+        Returns:
+            包含 canonical（登记了指纹的原始 chunk 数）和 references（引用数）的字典
+        """
+        with self._lock:
+            canonical = self._conn.execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0]
+            references = self._conn.execute("SELECT COUNT(*) FROM refs").fetchone()[0]
+        return {"canonical": canonical, "references": references}
+
+    def close(self):
+        """关闭数据库连接"""
+        self._conn.close()
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+可插拔的 embedding 后端
+
+- torch: 直接使用 SentenceTransformer（默认）
+- onnx: 将同一模型导出为 ONNX，由 ONNX Runtime 在 CPU 上推理，可选动态 int8 量化
+
+后端由 properties.json 中的 embedding_backend 选择。ONNX 后端首次使用时导出模型，
+并与 PyTorch 后端的输出比对，误差超出容差时回退到 PyTorch 后端。
+
+ONNX 后端需要额外安装: pip install onnxruntime onnx
+"""
+
+import os
+import re
+import json
+from typing import List, Dict, Any, Optional, Tuple
+
+
+# 校验 ONNX 后端时使用的样例文本
+VERIFY_TEXTS = [
+    "维生素E原料药",
+    "针织或钩编的棉制男式衬衫",
+    "非针织或非钩编的女式大衣、短大衣、斗篷",
+    "自动数据处理设备及其部件；磁性或光学阅读机",
+    "第十一类 纺织原料及纺织制品",
+    "Portable automatic data processing machines, weighing not more than 10 kg",
+    "鲜、冷、冻牛肉",
+    "本章不包括：用作颜料的物质；税目28.43至28.46的化合物",
+]
+
+
+class SentenceTransformerBackend:
+    """
+    基于 SentenceTransformer（PyTorch）的 embedding 后端
+    """
+
+    name = "torch"
+
+    def __init__(self, model_name: str):
+        """
+        加载模型
+
+        Args:
+            model_name: 模型名称或本地路径
+        """
+        # 延迟导入，避免仅管理文件时也加载 torch
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> List[List[float]]:
+        """
+        对文本列表进行向量化，输出已归一化
+
+        Args:
+            texts: 文本列表
+            batch_size: 每次推理的文本数量
+
+        Returns:
+            对应的向量数组
+        """
+        return self.model.encode(texts, batch_size=batch_size, normalize_embeddings=True).tolist()
+
+    def memory_bytes(self) -> int:
+        """
+        估算模型占用的内存
+
+        Returns:
+            模型参数和缓冲区的总字节数
+        """
+        tensors = list(self.model.parameters()) + list(self.model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class OnnxBackend:
+    """
+    基于 ONNX Runtime 的 CPU embedding 后端
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_dir: str, quantize: bool = False, threads: int = 0):
+        """
+        加载已导出的 ONNX 模型
+
+        Args:
+            model_dir: export_onnx 导出的模型目录
+            quantize: 是否使用动态 int8 量化后的模型
+            threads: 推理线程数，0 表示由 ONNX Runtime 自行决定
+        """
+        import numpy as np
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self._np = np
+        self.model_dir = model_dir
+        self.quantize = quantize
+
+        with open(os.path.join(model_dir, "backend.json"), 'r', encoding='utf-8') as f:
+            self.config = json.load(f)
+
+        model_file = "model.int8.onnx" if quantize else "model.onnx"
+        self.model_path = os.path.join(model_dir, model_file)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            self.model_path, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> List[List[float]]:
+        """
+        对文本列表进行向量化，池化方式与原 SentenceTransformer 模型一致，输出已归一化
+
+        Args:
+            texts: 文本列表
+            batch_size: 每次推理的文本数量
+
+        Returns:
+            对应的向量数组
+        """
+        np = self._np
+        # 按长度排序后分批推理，减少 padding
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        results = [None] * len(texts)
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            encoded = self.tokenizer(
+                [texts[i] for i in batch], padding=True, truncation=True,
+                max_length=self.config['max_length'], return_tensors="np"
+            )
+            inputs = {k: v.astype(np.int64) for k, v in encoded.items() if k in self.input_names}
+            hidden = self.session.run(None, inputs)[0]
+
+            if self.config['pooling'] == "cls":
+                pooled = hidden[:, 0]
+            else:
+                mask = encoded['attention_mask'][..., None].astype(hidden.dtype)
+                pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            for i, vector in zip(batch, pooled):
+                results[i] = vector.tolist()
+
+        return results
+
+    def memory_bytes(self) -> int:
+        """
+        估算模型占用的内存
+
+        Returns:
+            ONNX 模型文件的字节数（权重在推理会话中常驻内存）
+        """
+        return os.path.getsize(self.model_path)
+
+
+def _model_dir_name(model_name: str) -> str:
+    """将模型名称或路径转换为可用作目录名的字符串"""
+    name = os.path.basename(os.path.normpath(model_name)) or model_name
+    return re.sub(r'[^0-9A-Za-z._-]', '_', name)
+
+
+def _user_cache_dir() -> str:
+    """只读打开的知识库导出 ONNX 模型时使用的用户缓存目录"""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "vector-kb", "onnx")
+
+
+def _onnx_ready(model_dir: str, quantize: bool, verify_key: str, tolerance: float) -> bool:
+    """model_dir 中是否已有导出完成、并按相同容差校验过的模型，加载时无需写入"""
+    model_file = "model.int8.onnx" if quantize else "model.onnx"
+    config_path = os.path.join(model_dir, "backend.json")
+    if not (os.path.exists(os.path.join(model_dir, model_file)) and os.path.exists(config_path)):
+        return False
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            verified = json.load(f).get(verify_key)
+    except (OSError, ValueError):
+        return False
+    return verified is not None and verified.get('tolerance') == tolerance
+
+
+def export_onnx(model_name: str, output_dir: str, quantize: bool = False):
+    """
+    将 SentenceTransformer 模型导出为 ONNX，并可选生成动态 int8 量化版本；已导出的文件不会重复生成
+
+    Args:
+        model_name: 模型名称或本地路径
+        output_dir: 输出目录
+        quantize: 是否同时生成 int8 量化模型
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    onnx_path = os.path.join(output_dir, "model.onnx")
+    int8_path = os.path.join(output_dir, "model.int8.onnx")
+    config_path = os.path.join(output_dir, "backend.json")
+
+    if not (os.path.exists(onnx_path) and os.path.exists(config_path)):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        st_model = SentenceTransformer(model_name, device="cpu")
+        transformer = st_model[0]
+        hf_model = transformer.auto_model.eval()
+        tokenizer = transformer.tokenizer
+
+        # 与原模型保持一致的池化方式
+        pooling = "mean"
+        if len(st_model) > 1 and getattr(st_model[1], "pooling_mode_cls_token", False):
+            pooling = "cls"
+
+        sample = tokenizer(["样例文本"], return_tensors="pt")
+        input_names = list(sample.keys())
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+        dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+        class _Wrapper(torch.nn.Module):
+            """只输出 last_hidden_state，便于导出"""
+
+            def __init__(self, model):
+                super().__init__()
+                self.model = model
+
+            def forward(self, *args):
+                return self.model(**dict(zip(input_names, args))).last_hidden_state
+
+        with torch.no_grad():
+            torch.onnx.export(
+                _Wrapper(hf_model), tuple(sample[name] for name in input_names), onnx_path,
+                input_names=input_names, output_names=["last_hidden_state"],
+                dynamic_axes=dynamic_axes, opset_version=14
+            )
+        tokenizer.save_pretrained(output_dir)
+
+        config = {"model": model_name, "pooling": pooling, "max_length": st_model.max_seq_length}
+        with open(config_path, 'w', encoding='utf-8') as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+
+    if quantize and not os.path.exists(int8_path):
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QInt8)
+
+
+def compare_backends(reference, candidate, texts: Optional[List[str]] = None) -> Dict[str, float]:
+    """
+    比较两个后端在同一批文本上的输出
+
+    Args:
+        reference: 参考后端（通常为 PyTorch 后端）
+        candidate: 待校验的后端
+        texts: 用于比较的文本，默认为 VERIFY_TEXTS
+
+    Returns:
+        包含 min_cosine（最小余弦相似度）和 max_abs_diff（最大逐元素误差）的字典
+    """
+    texts = texts or VERIFY_TEXTS
+    ref = reference.encode(texts)
+    cand = candidate.encode(texts)
+    min_cosine = 1.0
+    max_abs_diff = 0.0
+    for a, b in zip(ref, cand):
+        min_cosine = min(min_cosine, sum(x * y for x, y in zip(a, b)))
+        max_abs_diff = max(max_abs_diff, max(abs(x - y) for x, y in zip(a, b)))
+    return {"min_cosine": min_cosine, "max_abs_diff": max_abs_diff}
+
+
+def backend_key(properties: Dict[str, Any], kb_path: str) -> Tuple:
+    """
+    生成与 create_backend 配置对应的键，键相同的知识库可以共用同一个已加载的后端
+
+    ONNX 模型导出在各知识库自己的目录下，因此只有同一目录下的实例共用。
+
+    Args:
+        properties: 知识库配置
+        kb_path: 知识库路径
+
+    Returns:
+        可哈希的键
+    """
+    model_name = properties['model']
+    backend = properties.get('embedding_backend', 'torch')
+    if backend != 'onnx':
+        return (backend, model_name)
+    return (backend, model_name, os.path.abspath(kb_path), properties.get('onnx_quantize', False),
+            properties.get('onnx_tolerance', 0.02), properties.get('onnx_threads', 0))
+
+
+def backend_variant(properties: Dict[str, Any]) -> str:
+    """
+    生成描述后端与推理精度的标识，不同标识的后端输出的向量不完全相同
+
+    Args:
+        properties: 知识库配置
+
+    Returns:
+        "torch"、"onnx" 或 "onnx-int8"
+    """
+    backend = properties.get('embedding_backend', 'torch')
+    if backend == 'onnx' and properties.get('onnx_quantize', False):
+        return "onnx-int8"
+    return backend
+
+
+def create_backend(properties: Dict[str, Any], kb_path: str, read_only: bool = False):
+    """
+    根据 properties.json 中的配置创建 embedding 后端
+
+    相关配置:
+        model: 模型名称或本地路径
+        embedding_backend: "torch"（默认）或 "onnx"
+        onnx_quantize: 是否使用动态 int8 量化，默认 False
+        onnx_tolerance: 与 PyTorch 后端输出的最大允许偏差（1 - 最小余弦相似度），默认 0.02
+        onnx_threads: ONNX Runtime 推理线程数，默认 0（自动）
+
+    Args:
+        properties: 知识库配置
+        kb_path: 知识库路径，导出的 ONNX 模型保存在其下的 onnx 目录中
+        read_only: 知识库是否以只读模式打开；此时不写入知识库目录，知识库目录中没有已校验的模型时
+                   在用户缓存目录（$XDG_CACHE_HOME 或 ~/.cache 下的 vector-kb/onnx）中导出和校验
+
+    Returns:
+        具有 encode(texts) 方法的后端实例
+    """
+    model_name = properties['model']
+    backend = properties.get('embedding_backend', 'torch')
+
+    if backend == 'torch':
+        return SentenceTransformerBackend(model_name)
+    if backend != 'onnx':
+        raise ValueError(f"不支持的 embedding 后端: {backend}")
+
+    quantize = properties.get('onnx_quantize', False)
+    tolerance = properties.get('onnx_tolerance', 0.02)
+    model_dir = os.path.join(kb_path, "onnx", _model_dir_name(model_name))
+    verify_key = "verified_int8" if quantize else "verified"
+    if read_only and not _onnx_ready(model_dir, quantize, verify_key, tolerance):
+        model_dir = os.path.join(_user_cache_dir(), _model_dir_name(model_name))
+
+    try:
+        export_onnx(model_name, model_dir, quantize=quantize)
+        onnx_backend = OnnxBackend(model_dir, quantize=quantize, threads=properties.get('onnx_threads', 0))
+    except Exception as e:
+        print(f"加载 ONNX 后端时出错，回退到 PyTorch 后端: {str(e)}")
+        return SentenceTransformerBackend(model_name)
+
+    # 首次使用时与 PyTorch 后端比对，结果记录在 backend.json 中
+    verified = onnx_backend.config.get(verify_key)
+    if verified is None or verified.get('tolerance') != tolerance:
+        reference = SentenceTransformerBackend(model_name)
+        verified = compare_backends(reference, onnx_backend)
+        verified['tolerance'] = tolerance
+        verified['passed'] = verified['min_cosine'] >= 1 - tolerance
+        onnx_backend.config[verify_key] = verified
+        with open(os.path.join(model_dir, "backend.json"), 'w', encoding='utf-8') as f:
+            json.dump(onnx_backend.config, f, ensure_ascii=False, indent=2)
+        if not verified['passed']:
+            print(f"ONNX 后端输出与 PyTorch 后端偏差过大 (最小余弦相似度 {verified['min_cosine']:.4f})，"
+                  f"回退到 PyTorch 后端")
+            return reference
+
+    if not verified['passed']:
+        print("ONNX 后端未通过精度校验，使用 PyTorch 后端")
+        return SentenceTransformerBackend(model_name)
+
+    return onnx_backend
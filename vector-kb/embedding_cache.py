@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基于 SQLite 的持久化 embedding 缓存
+"""
+
+import re
+import hashlib
+import threading
+import unicodedata
+from array import array
+from typing import List, Optional
+
+from concurrency import connect_sqlite
+
+
+def normalize_text(text: str) -> str:
+    """
+    规范化文本：统一全角/半角字符，合并连续空白并去除首尾空白
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        规范化后的文本
+    """
+    text = unicodedata.normalize('NFKC', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+class EmbeddingCache:
+    """
+    持久化的 embedding 缓存
+
+    以 (模型名称, 后端与精度, 规范化文本) 的哈希为键保存向量，超过容量上限时按最近使用时间淘汰。
+    """
+
+    def __init__(self, path: str, model: str, max_entries: int = 200000, read_only: bool = False,
+                 variant: str = "torch"):
+        """
+        初始化缓存
+
+        Args:
+            path: 缓存数据库文件路径
+            model: 模型名称，作为键的一部分，更换模型后旧缓存自然失效
+            max_entries: 最多缓存的向量数量
+            read_only: 是否以只读方式打开已有的缓存，只读时只查询、不写入也不更新使用时间
+            variant: 后端与推理精度（见 embedding_backends.backend_variant），作为键的一部分，
+                     PyTorch 与 ONNX / int8 量化的向量互不混用
+        """
+        self.path = path
+        self.model = model
+        self.variant = variant
+        self.max_entries = max_entries
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+        self._tick = 0
+        self._lock = threading.Lock()
+
+        self._conn = connect_sqlite(path, read_only)
+        if not read_only:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used INTEGER NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+            self._conn.commit()
+
+        row = self._conn.execute("SELECT COUNT(*), MAX(last_used) FROM embeddings").fetchone()
+        self._count = row[0]
+        self._tick = row[1] or 0
+
+    def _key(self, text: str) -> str:
+        """计算文本对应的缓存键"""
+        raw = self.model + "\x00" + self.variant + "\x00" + normalize_text(text)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        批量读取缓存
+
+        Args:
+            texts: 文本列表
+
+        Returns:
+            与 texts 一一对应的向量列表，未命中的位置为 None
+        """
+        keys = [self._key(text) for text in texts]
+        found = {}
+        unique_keys = list(set(keys))
+        with self._lock:
+            # SQLite 对参数数量有限制，分批查询
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array('f')
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+
+            if found and not self.read_only:
+                self._tick += 1
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(self._tick, key) for key in found]
+                )
+                self._conn.commit()
+
+            results = [found.get(key) for key in keys]
+            hit_count = sum(1 for r in results if r is not None)
+            self.hits += hit_count
+            self.misses += len(results) - hit_count
+        return results
+
+    def put_many(self, texts: List[str], embeddings: List[List[float]]):
+        """
+        批量写入缓存，超过容量上限时淘汰最久未使用的条目
+
+        Args:
+            texts: 文本列表
+            embeddings: 与 texts 一一对应的向量列表
+        """
+        if self.max_entries <= 0 or self.read_only or not texts:
+            return
+
+        rows = {}
+        for text, embedding in zip(texts, embeddings):
+            rows[self._key(text)] = array('f', embedding).tobytes()
+
+        with self._lock:
+            self._put_rows(rows)
+
+    def _put_rows(self, rows: dict):
+        """写入已序列化的缓存条目，调用方需持有锁"""
+        self._tick += 1
+        before = self._conn.total_changes
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+            [(key, blob, self._tick) for key, blob in rows.items()]
+        )
+        self._count += self._conn.total_changes - before
+
+        if self._count > self.max_entries:
+            # 一次多淘汰 10%，避免每次写入都触发淘汰
+            excess = self._count - int(self.max_entries * 0.9)
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (excess,)
+            )
+            self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+        self._conn.commit()
+
+    def stats(self) -> dict:
+        """
+        获取缓存统计信息
+
+        Returns:
+            包含 hits、misses、hit_rate、entries、max_entries 的字典
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": self._count,
+            "max_entries": self.max_entries,
+        }
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._count = 0
+
+    def close(self):
+        """关闭数据库连接"""
+        self._conn.close()
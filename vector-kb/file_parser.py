@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式文件解析：逐页（PDF）、逐段落（DOCX）或逐块（文本）读取文件并切分为 chunk
+
+PyPDF2 和 python-docx 仅在解析对应类型的文件时才导入。
+"""
+
+import os
+import codecs
+from typing import Iterator, List, Optional, Tuple
+
+
+# 文本文件每次读取的字符数
+TEXT_BLOCK_SIZE = 1 << 16
+
+
+def _detect_encoding(filepath: str) -> Optional[str]:
+    """
+    依次尝试 UTF-8 和 GBK 解码整个文件（流式，不保留内容）
+
+    Args:
+        filepath: 文件路径
+
+    Returns:
+        可以完整解码的编码名称，都失败时返回 None
+    """
+    for encoding in ('utf-8', 'gbk'):
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            with open(filepath, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    decoder.decode(block)
+                decoder.decode(b'', final=True)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return None
+
+
+def _iter_binary(filepath: str) -> Iterator[Tuple[str, Optional[int]]]:
+    """以二进制方式读取文件并忽略无法解码的字节"""
+    with open(filepath, 'r', encoding='utf-8', errors='ignore', newline='') as f:
+        for block in iter(lambda: f.read(TEXT_BLOCK_SIZE), ''):
+            yield block, None
+
+
+def _iter_text(filepath: str) -> Iterator[Tuple[str, Optional[int]]]:
+    """按块读取文本文件，UTF-8 解码失败时尝试 GBK，仍失败则忽略无法解码的字节"""
+    encoding = _detect_encoding(filepath)
+    if encoding is None:
+        yield from _iter_binary(filepath)
+        return
+
+    with open(filepath, 'r', encoding=encoding) as f:
+        for block in iter(lambda: f.read(TEXT_BLOCK_SIZE), ''):
+            yield block, None
+
+
+def iter_segments(filepath: str) -> Iterator[Tuple[str, Optional[int]]]:
+    """
+    逐段读取文件内容
+
+    Args:
+        filepath: 文件路径
+
+    Returns:
+        (文本片段, 页码) 的迭代器；页码从 1 开始，仅 PDF 文件有页码，其余为 None
+    """
+    # 获取文件扩展名
+    _, ext = os.path.splitext(filepath)
+    ext = ext.lower()
+
+    if ext == '.pdf':
+        import PyPDF2
+
+        with open(filepath, 'rb') as f:
+            try:
+                pdf_reader = PyPDF2.PdfReader(f)
+            except Exception as e:
+                print(f"读取文件 {filepath} 时出现错误: {str(e)}")
+                pdf_reader = None
+            if pdf_reader is not None:
+                for page_number, page in enumerate(pdf_reader.pages, 1):
+                    try:
+                        text = page.extract_text() or ""
+                    except Exception as e:
+                        # 单页解析失败时跳过该页，继续读取后续页面
+                        print(f"读取文件 {filepath} 第 {page_number} 页时出现错误: {str(e)}")
+                        continue
+                    yield text, page_number
+                return
+        # 尝试以二进制方式读取并忽略错误
+        yield from _iter_binary(filepath)
+    elif ext == '.docx':
+        from docx import Document
+
+        try:
+            doc = Document(filepath)
+        except Exception as e:
+            print(f"读取文件 {filepath} 时出现错误: {str(e)}")
+            yield from _iter_binary(filepath)
+            return
+        for paragraph in doc.paragraphs:
+            yield paragraph.text + "\n", None
+    else:
+        # .txt 以及其他类型的文件都尝试以文本文件方式读取
+        yield from _iter_text(filepath)
+
+
+def iter_chunks(filepath: str, chunk_size: int) -> Iterator[Tuple[str, Optional[int]]]:
+    """
+    流式读取文件并按固定字数切分为 chunk，内存占用与文件大小无关
+
+    切分结果与将整个文件拼接后再按 chunk_size 切片完全一致。
+
+    Args:
+        filepath: 文件路径
+        chunk_size: 每个文本分块的字数
+
+    Returns:
+        (chunk 文本, 起始页码) 的迭代器，空白 chunk 会被跳过
+    """
+    buffer = ""
+    buffer_page = None  # buffer 起始位置所在的页码
+
+    for text, page in iter_segments(filepath):
+        if not text:
+            continue
+
+        carry = len(buffer)
+        buffer += text
+        pos = 0
+        while len(buffer) - pos >= chunk_size:
+            chunk = buffer[pos:pos + chunk_size].strip()
+            if chunk:  # 只添加非空块
+                yield chunk, buffer_page if pos < carry else page
+            pos += chunk_size
+
+        buffer = buffer[pos:]
+        if pos >= carry:
+            buffer_page = page
+
+    chunk = buffer.strip()
+    if chunk:
+        yield chunk, buffer_page
+
+
+def parse_file(filepath: str, chunk_size: int) -> List[Tuple[str, Optional[int]]]:
+    """
+    读取文件并切分为 chunk 列表
+
+    Args:
+        filepath: 文件路径
+        chunk_size: 每个文本分块的字数
+
+    Returns:
+        (chunk 文本, 起始页码) 列表
+    """
+    return list(iter_chunks(filepath, chunk_size))
@@ -1,62 +1,372 @@
 import os
 import json
+import shutil
 import uuid
-from typing import List, Dict, Any, Optional
-import chromadb
-from chromadb.config import Settings
-from sentence_transformers import SentenceTransformer
-import PyPDF2
-from docx import Document
+import atexit
+import hashlib
+import queue
+import asyncio
+import functools
+import weakref
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from typing import List, Dict, Any, Optional, Iterator, Tuple
 
+from embedding_cache import EmbeddingCache
+from manifest import Manifest
+from file_parser import iter_chunks, parse_file
+from query_cache import QueryCache
+from embedding_backends import create_backend, backend_key, backend_variant
+from model_registry import get_registry
+from route_index import RouteIndex
+from code_index import CodeIndex, parse_query_codes
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from dedup_index import DedupIndex
+from concurrency import FileLock
 
-class kb:
+
+# query 的 include 参数可选字段 -> 结果中的键名
+QUERY_FIELDS = {"ids": "id", "scores": "score", "metadata": "metadata", "text": "text"}
+QUERY_INCLUDE_DEFAULT = ("text", "metadata")
+
+# 各检索方式的得分含义（均为越大越相关）
+SCORE_KINDS = {
+    "vector": "余弦相似度，1 - 平方 L2 距离 / 2",
+    "routed": "余弦相似度，同 vector",
+    "lexical": "BM25 分数",
+    "hybrid": "倒数排名融合分数，各路 1 / (60 + 排名) 之和",
+    "exact": "HS 编码精确匹配，固定为 1.0",
+}
+
+
+def _writes(method):
     """
-    基于 Chroma 的持久化向量知识库存储系统
+    修饰修改知识库的方法：只读模式下拒绝调用，否则持有进程内写锁和跨进程写锁执行
     """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._writing():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class kb:
     """
     基于 Chroma 的持久化向量知识库存储系统
+
+    chromadb、sentence_transformers 等重量级依赖在首次使用时才导入：
+    Chroma 客户端在首次访问 client/collection 时创建，模型在首次向量化时加载。
+
+    同一实例可以在多个线程间共用：延迟初始化由锁保护，只执行一次；查询可以并发执行，
+    修改知识库的方法（create、addItem、addItems、delItem、delItems、delWhere、rebuild_*、compact_section）依次执行。
+    修改期间同时持有目录下 writer.lock 的文件锁，同一目录同一时间只有一个进程在写入。
+    以 read_only=True 打开时不获取写锁，可以在多个进程中与一个写入进程同时使用。
     """
     
-    def __init__(self, path: str):
+    def __init__(self, path: str, query_cache_size: int = 1024, query_cache_ttl: Optional[float] = None,
+                 persist_query_cache: bool = False, preload: bool = False, async_workers: int = 4,
+                 read_only: bool = False, lock_timeout: Optional[float] = None):
         """
         初始化知识库
         
         Args:
             path: 知识库存储路径
+            query_cache_size: 查询结果缓存的条目数，0 表示禁用
+            query_cache_ttl: 查询结果缓存的有效期（秒），None 表示不过期
+            persist_query_cache: 是否将查询结果缓存保存到 query_cache.json，重启后继续使用
+            preload: 是否在后台线程中预加载模型并预热（见 warmup），首个请求只需等待预热完成
+            async_workers: 异步接口（aquery 等）执行查询的线程数
+            read_only: 只读模式：不修改目录下的任何文件，不获取写锁，修改知识库的方法抛出 PermissionError；
+                       其他进程写入后，下一次查询时自动重新打开 collection
+            lock_timeout: 写入时等待其他进程释放写锁的最长时间（秒），None 表示一直等待，超时抛出 TimeoutError
         """
         self.path = path
         self.is_new = not os.path.exists(path)
+        self.read_only = read_only
+        if read_only and self.is_new:
+            raise ValueError(f"路径 '{path}' 下没有知识库")
         
         # 创建路径如果不存在
         if self.is_new:
             os.makedirs(path, exist_ok=True)
             
-        # 初始化 Chroma 客户端
-        chroma_path = os.path.join(path, "chroma")
-        self.client = chromadb.PersistentClient(
-            path=chroma_path,
-            settings=Settings(anonymized_telemetry=False)
-        )
-        
-        # 初始化属性
+        # 初始化属性，Chroma 客户端和 collection 在首次访问时创建
         self.properties = {}
-        self._model = None
-        self.collection = None
+        self._client = None
+        self._collection = None
+        self._model_key = None
+        self._model_release = None
+        self._model_lock = threading.Lock()
+        self._preload = preload
+        self._warmup_thread = None
+        self._warmup_done = threading.Event()
+        self._embedding_cache = None
+        self._manifest = None
+        self._route_index = None
+        self._code_index = None
+        self._lexical_index = None
+        self._dedup_index = None
+        self._query_cache = QueryCache(query_cache_size, query_cache_ttl)
+        self._query_cache_path = os.path.join(path, "query_cache.json") if persist_query_cache else None
+        self._async_workers = max(1, async_workers)
+        self._executor = None
+        self._write_executor = None
+        self._executor_lock = threading.Lock()
+        # 延迟初始化锁只保护对象的创建，持有期间不获取写锁；写锁期间还持有跨进程的文件锁
+        self._init_lock = threading.RLock()
+        self._write_lock = threading.RLock()
+        self._writer_lock = None if read_only else FileLock(os.path.join(path, "writer.lock"))
+        self._lock_timeout = lock_timeout
+        self._opened_generation = None
         
         # 如果不是新知识库，尝试加载配置
         properties_path = os.path.join(path, "properties.json")
         if not self.is_new and os.path.exists(properties_path):
             with open(properties_path, 'r', encoding='utf-8') as f:
                 self.properties = json.load(f)
-            # 获取已存在的 collection
-            if 'name' in self.properties:
+        
+        # 加载持久化的查询缓存，并在进程退出时保存（只读模式下只加载）
+        if self._query_cache_path is not None:
+            self._query_cache.load(self._query_cache_path, self.generation)
+            if not read_only:
+                atexit.register(self.save_query_cache)
+        
+        if preload and 'model' in self.properties:
+            self._start_warmup()
+    
+    @property
+    def client(self):
+        """
+        Chroma 客户端，首次访问时导入 chromadb 并创建
+        """
+        if self._client is not None:
+            return self._client
+        with self._init_lock:
+            if self._client is None:
+                import chromadb
+                from chromadb.config import Settings
+
+                # 初始化 Chroma 客户端
+                chroma_path = os.path.join(self.path, "chroma")
+                self._client = chromadb.PersistentClient(
+                    path=chroma_path,
+                    settings=Settings(anonymized_telemetry=False)
+                )
+        return self._client
+
+    @property
+    def collection(self):
+        """
+        知识库使用的 Chroma collection，首次访问时按 properties.json 中的名称获取
+        """
+        if self._collection is not None or 'name' not in self.properties:
+            return self._collection
+        with self._init_lock:
+            if self._collection is None:
+                # 获取已存在的 collection
                 try:
-                    self.collection = self.client.get_collection(name=self.properties['name'])
+                    self._collection = self._open_collection(create=False)
                 except Exception:
                     # 如果获取失败，将在 create 方法中创建
                     pass
-    
-    def create(self, chunk_size: int, model: str, name: str = 'default_collection'):
+        return self._collection
+
+    @collection.setter
+    def collection(self, value):
+        self._collection = value
+
+    def _open_collection(self, create: bool = False):
+        """
+        按 properties.json 中的 index_backend 打开 collection，按类分片时打开由各分片组成的 ShardedCollection
+
+        Args:
+            create: collection 不存在时是否创建
+
+        Returns:
+            Chroma collection，或接口相同的 NumpyCollection / ShardedCollection
+        """
+        name = self.properties['name']
+        if not self.properties.get('sharded', False):
+            return self._open_index(name, create)
+
+        from sharded_collection import ShardedCollection
+
+        prefix = f"{name}-section-"
+        keys = [index_name[len(prefix):] for index_name in self._list_indexes() if index_name.startswith(prefix)]
+        return ShardedCollection(
+            name, lambda key, create_shard: self._open_index(prefix + key, create_shard), keys,
+            backend=self.properties.get('index_backend', 'chroma')
+        )
+
+    def _list_indexes(self) -> List[str]:
+        """
+        列出知识库目录下已有的 collection 名称
+        """
+        if self.properties.get('index_backend', 'chroma') == 'numpy':
+            numpy_dir = os.path.join(self.path, "numpy")
+            return sorted(os.listdir(numpy_dir)) if os.path.isdir(numpy_dir) else []
+        # 新版 chromadb 的 list_collections 直接返回名称
+        return sorted(getattr(collection, 'name', collection) for collection in self.client.list_collections())
+
+    def _drop_index(self, name: str):
+        """
+        删除一个 collection，不存在时忽略
+
+        Args:
+            name: collection 名称
+        """
+        if name not in self._list_indexes():
+            return
+        if self.properties.get('index_backend', 'chroma') == 'numpy':
+            shutil.rmtree(os.path.join(self.path, "numpy", name))
+        else:
+            self.client.delete_collection(name=name)
+
+    def _rename_index(self, collection, name: str):
+        """
+        将 collection 改名为 name（name 须不存在）并重新打开
+
+        Args:
+            collection: 由 _open_index 打开的 collection
+            name: 新名称
+
+        Returns:
+            以新名称打开的 collection
+        """
+        if self.properties.get('index_backend', 'chroma') == 'numpy':
+            os.replace(collection.path, os.path.join(self.path, "numpy", name))
+        else:
+            collection.modify(name=name)
+        return self._open_index(name, create=False)
+
+    def _open_index(self, name: str, create: bool = False):
+        """
+        按 properties.json 中的 index_backend 打开单个 collection
+
+        Args:
+            name: collection 名称
+            create: collection 不存在时是否创建
+
+        Returns:
+            Chroma collection 或 NumpyCollection
+        """
+        if self.properties.get('index_backend', 'chroma') == 'numpy':
+            from numpy_index import NumpyCollection
+
+            numpy_path = os.path.join(self.path, "numpy", name)
+            if not create and not os.path.exists(numpy_path):
+                raise ValueError(f"collection {name} 不存在")
+            return NumpyCollection(
+                numpy_path, name,
+                dtype=self.properties.get('index_dtype', 'float32'),
+                compression=self.properties.get('index_compression'),
+                pq_m=self.properties.get('pq_m', 64),
+                rerank_factor=self.properties.get('rerank_factor', 4),
+                read_only=self.read_only
+            )
+
+        if create:
+            return self.client.get_or_create_collection(name=name)
+        return self.client.get_collection(name=name)
+
+    @contextlib.contextmanager
+    def _writing(self):
+        """
+        持有进程内写锁和跨进程写锁，可重入
+        """
+        if self.read_only:
+            raise PermissionError("知识库以只读模式打开，不能修改")
+        with self._write_lock:
+            self._writer_lock.acquire(self._lock_timeout)
+            try:
+                yield
+            finally:
+                self._writer_lock.release()
+
+    @contextlib.contextmanager
+    def _try_writing(self):
+        """
+        不等待地尝试持有写锁，返回是否成功；用于查询路径上可以推迟的维护工作，
+        其他线程或进程正在写入时直接跳过，不阻塞查询
+        """
+        if self.read_only or not self._write_lock.acquire(blocking=False):
+            yield False
+            return
+        try:
+            try:
+                self._writer_lock.acquire(0)
+            except TimeoutError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                self._writer_lock.release()
+        finally:
+            self._write_lock.release()
+
+    def _refresh(self, generation: int):
+        """
+        只读模式下，发现其他进程修改了知识库（代数变化）时重新打开 collection 和路由索引
+
+        Chroma 和 NumPy 索引都在打开时把向量载入内存，之后其他进程写入的向量不可见；
+        SQLite 中的清单、编码索引、倒排索引等每次查询都直接读取，无需重新打开。
+
+        Args:
+            generation: 当前代数
+        """
+        if self._opened_generation == generation:
+            return
+        with self._init_lock:
+            if self._opened_generation == generation:
+                return
+            if self._opened_generation is not None:
+                if self._client is not None:
+                    # 只丢弃本知识库路径对应的共享 Chroma 系统实例，新客户端从磁盘重新加载索引；
+                    # 进程中其他路径的客户端不受影响，已创建的客户端持有原系统实例，仍可继续使用
+                    from chromadb.api.client import SharedSystemClient
+                    for attr in ("_identifer_to_system", "_identifier_to_system"):
+                        getattr(SharedSystemClient, attr, {}).pop(self._client._identifier, None)
+                    self._client = None
+                self._collection = None
+                if self._route_index is not None:
+                    # 路由只读取内存中的质心，关闭连接不影响正在进行的查询
+                    self._route_index.close()
+                    self._route_index = None
+            self._opened_generation = generation
+
+    def _sync_generation(self) -> int:
+        """
+        读取当前代数，只读模式下必要时重新打开 collection
+
+        Returns:
+            当前代数
+        """
+        generation = self.generation
+        if self.read_only:
+            self._refresh(generation)
+        return generation
+
+    def _sidecar_path(self, filename: str) -> str:
+        """
+        知识库目录下的索引文件路径；只读模式下文件必须已经存在
+
+        Args:
+            filename: 文件名
+        """
+        path = os.path.join(self.path, filename)
+        if self.read_only and not os.path.exists(path):
+            raise ValueError(f"只读模式下找不到 {filename}，请先以写入模式打开知识库完成构建")
+        return path
+
+    @_writes
+    def create(self, chunk_size: int, model: str, name: str = 'default_collection',
+               embedding_backend: str = 'torch', onnx_quantize: bool = False,
+               index_backend: str = 'chroma', index_dtype: str = 'float32',
+               index_compression: Optional[str] = None, pq_m: int = 64, rerank_factor: int = 4,
+               dedup: bool = False, dedup_distance: int = 3, sharded: bool = False):
         """
         仅在新建知识库时调用
         
@@ -64,6 +374,17 @@ class kb:
             chunk_size: 每个文本分块的字数
             model: 使用的 embedding 模型名称
             name: collection 名称
+            embedding_backend: embedding 后端，"torch"（SentenceTransformer）或 "onnx"（ONNX Runtime）
+            onnx_quantize: 使用 onnx 后端时是否启用动态 int8 量化
+            index_backend: 向量索引后端，"chroma"（默认）或 "numpy"（内存映射矩阵上的精确检索，适合小型知识库）
+            index_dtype: numpy 后端的向量存储精度，"float32" 或 "float16"
+            index_compression: numpy 后端生成候选集时使用的压缩编码，None（精确检索）、"int8" 或 "pq"
+            pq_m: 乘积量化的子空间个数，即每个向量的编码字节数，需能整除向量维度
+            rerank_factor: 压缩模式下精确重排的候选数为 top_k 的倍数
+            dedup: 导入时是否检测近似重复的 chunk，近似重复的 chunk 只记录为指向原始 chunk 的引用，不写入向量
+            dedup_distance: 判定为近似重复的 SimHash 最大汉明距离（64 位）
+            sharded: 是否按类（metadata 中的 section）分片，每个类使用单独的 collection；
+                     按类过滤的查询只检索相关分片，单个类可以用 rebuild_section 单独重建、compact_section 单独压缩
         """
         if not self.is_new:
             print("已存在知识库，跳过初始化")
@@ -73,7 +394,17 @@ class kb:
         self.properties = {
             "name": name,
             "chunk_size": chunk_size,
-            "model": model
+            "model": model,
+            "embedding_backend": embedding_backend,
+            "onnx_quantize": onnx_quantize,
+            "index_backend": index_backend,
+            "index_dtype": index_dtype,
+            "index_compression": index_compression,
+            "pq_m": pq_m,
+            "rerank_factor": rerank_factor,
+            "dedup": dedup,
+            "dedup_distance": dedup_distance,
+            "sharded": sharded
         }
         
         properties_path = os.path.join(self.path, "properties.json")
@@ -81,25 +412,139 @@ class kb:
             json.dump(self.properties, f, ensure_ascii=False, indent=2)
         
         # 创建新的 collection
-        self.collection = self.client.get_or_create_collection(name=name)
+        self.collection = self._open_collection(create=True)
+        manifest = self._get_manifest()
+        manifest.mark_catalog_ready()
+        manifest.mark_backfilled()
+        
+        if self._preload:
+            self._start_warmup()
     
     def _load_embedding_model(self):
         """
-        从 properties.json 中读取模型名称并加载模型
+        从 properties.json 中读取模型名称和 embedding 后端配置并加载模型
+
+        模型由进程内的模型注册表（见 model_registry）管理，配置相同的知识库实例共用同一个已加载的模型。
         """
-        if self._model is not None:
-            return self._model
-            
-        if 'model' not in self.properties:
-            raise ValueError("模型信息未在 properties.json 中找到")
-            
-        model_name = self.properties['model']
-        self._model = SentenceTransformer(model_name)
-        return self._model
+        # 加锁保证并发调用时只获取一次引用，模型本身由注册表保证只加载一次
+        if self._model_key is None:
+            with self._model_lock:
+                if self._model_key is None:
+                    if 'model' not in self.properties:
+                        raise ValueError("模型信息未在 properties.json 中找到")
+
+                    # 后端内部延迟导入 torch / onnxruntime，避免仅管理文件时也加载；
+                    # 加载函数不引用 self，实例被回收时由 finalize 归还引用
+                    key = backend_key(self.properties, self.path)
+                    registry = get_registry()
+                    registry.acquire(key, functools.partial(create_backend, dict(self.properties), self.path,
+                                                            read_only=self.read_only))
+                    self._model_release = weakref.finalize(self, registry.release, key)
+                    self._model_key = key
+        return get_registry().get(self._model_key)
+
+    def model_stats(self) -> Optional[Dict[str, Any]]:
+        """
+        获取本实例所用模型在进程内模型注册表中的统计信息
+
+        Returns:
+            包含 backend、model、refs（引用该模型的知识库实例数）、loaded、memory_bytes、loads、unloads、
+            encode_calls、encoded_texts、encode_seconds、idle_seconds 等字段的字典，尚未加载过模型时为 None
+        """
+        if self._model_key is None:
+            return None
+        return get_registry().model_stats(self._model_key)
+
+    def warmup(self):
+        """
+        加载模型并执行一次推理，同时预先载入向量索引
+
+        首次推理的内存分配等开销在此完成，之后的请求延迟与稳定状态一致。
+        """
+        self._load_embedding_model()
+        embedding = self._encode_direct(["预热"])[0]
+
+        # 执行一次查询，使 Chroma 将向量索引载入内存
+        try:
+            collection = self.collection
+            if collection is not None and collection.count() > 0:
+                collection.query(query_embeddings=[embedding], n_results=1)
+        except Exception as e:
+            print(f"预热向量索引时出错: {str(e)}")
+
+    def _start_warmup(self):
+        """在后台线程中执行 warmup"""
+        if self._warmup_thread is not None:
+            return
+
+        def run():
+            try:
+                self.warmup()
+            except Exception as e:
+                print(f"后台预加载模型时出错: {str(e)}")
+            finally:
+                self._warmup_done.set()
+
+        self._warmup_thread = threading.Thread(target=run, name="kb-warmup", daemon=True)
+        self._warmup_thread.start()
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待后台预热完成，未启用预加载时立即返回
+
+        Args:
+            timeout: 最长等待时间（秒），None 表示一直等待
+
+        Returns:
+            预热是否已完成
+        """
+        if self._warmup_thread is None:
+            return True
+        return self._warmup_done.wait(timeout)
     
+    def _get_embedding_cache(self) -> Optional[EmbeddingCache]:
+        """
+        获取 embedding 缓存，缓存文件与 properties.json 存放在同一目录
+
+        properties.json 中的 embedding_cache_size 控制缓存容量，设为 0 时禁用缓存
+        """
+        if self._embedding_cache is not None:
+            return self._embedding_cache
+
+        max_entries = self.properties.get('embedding_cache_size', 200000)
+        if max_entries <= 0 or 'model' not in self.properties:
+            return None
+
+        # 只读模式下只使用已有的缓存，命中时不更新使用时间，未命中的结果不写入
+        cache_path = os.path.join(self.path, "embedding_cache.sqlite3")
+        if self.read_only and not os.path.exists(cache_path):
+            return None
+        with self._init_lock:
+            if self._embedding_cache is None:
+                self._embedding_cache = EmbeddingCache(cache_path, self.properties['model'], max_entries,
+                                                       read_only=self.read_only,
+                                                       variant=backend_variant(self.properties))
+        return self._embedding_cache
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        """
+        调用模型对文本列表进行向量化，不经过缓存；后台预热进行中时先等待其完成
+        """
+        self.wait_until_ready()
+        return self._encode_direct(texts)
+
+    def _encode_direct(self, texts: List[str]) -> List[List[float]]:
+        """
+        直接调用模型对文本列表进行向量化
+        """
+        if self._model_key is None:
+            self._load_embedding_model()
+
+        return get_registry().encode(self._model_key, texts)
+
     def _embedding(self, texts: List[str]) -> List[List[float]]:
         """
-        使用模型对文本列表进行向量化
+        对导入的 chunk 进行向量化，仅将缓存未命中的文本送入模型；查询文本直接调用 _encode
         
         Args:
             texts: 文本列表
@@ -107,11 +552,45 @@ class kb:
         Returns:
             对应的向量数组
         """
-        if self._model is None:
-            self._load_embedding_model()
-            
-        return self._model.encode(texts, normalize_embeddings=True).tolist()
+        cache = self._get_embedding_cache()
+        if cache is None:
+            return self._encode(texts)
+
+        embeddings = cache.get_many(texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            missing_embeddings = self._encode(missing_texts)
+            for i, embedding in zip(missing, missing_embeddings):
+                embeddings[i] = embedding
+            cache.put_many(missing_texts, missing_embeddings)
+
+        return embeddings
+
+    def embedding_cache_stats(self) -> Dict[str, Any]:
+        """
+        获取 embedding 缓存的命中统计
+
+        Returns:
+            包含 hits、misses、hit_rate、entries、max_entries 的字典，未启用缓存时返回空字典
+        """
+        cache = self._get_embedding_cache()
+        return cache.stats() if cache is not None else {}
     
+    def _iter_chunks(self, filepath: str) -> Iterator[Tuple[str, Optional[int]]]:
+        """
+        流式读取文件内容并切分为 chunk，PDF 逐页读取、DOCX 逐段落读取
+
+        Args:
+            filepath: 文件路径
+
+        Returns:
+            (chunk 文本, 起始页码) 的迭代器，非 PDF 文件的页码为 None
+        """
+        # 获取分块大小
+        chunk_size = self.properties.get('chunk_size', 500)
+        return iter_chunks(filepath, chunk_size)
+
     def _parser(self, filepath: str) -> List[str]:
         """
         负责读取文件内容并切分为多个 chunk
@@ -122,202 +601,1814 @@ class kb:
         Returns:
             字符串列表，每个元素是一个文本块
         """
-        # 获取文件扩展名
-        _, ext = os.path.splitext(filepath)
-        ext = ext.lower()
-        
-        # 读取文件内容
-        content = ""
-        try:
-            if ext == '.txt':
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    content = f.read()
-            elif ext == '.pdf':
-                with open(filepath, 'rb') as f:
-                    pdf_reader = PyPDF2.PdfReader(f)
-                    content = ""
-                    for page in pdf_reader.pages:
-                        content += page.extract_text()
-            elif ext == '.docx':
-                doc = Document(filepath)
-                content = ""
-                for paragraph in doc.paragraphs:
-                    content += paragraph.text + "\n"
-            else:
-                # 尝试以文本文件方式读取所有其他类型的文件
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    content = f.read()
-        except UnicodeDecodeError:
-            # 如果UTF-8解码失败，尝试使用其他编码或以二进制方式读取
-            try:
-                with open(filepath, 'r', encoding='gbk') as f:
-                    content = f.read()
-            except UnicodeDecodeError:
-                # 如果仍然失败，以二进制方式读取并尝试解码
-                with open(filepath, 'rb') as f:
-                    content = f.read().decode('utf-8', errors='ignore')
-        except Exception as e:
-            # 处理其他可能的异常
-            print(f"读取文件 {filepath} 时出现错误: {str(e)}")
-            # 尝试以二进制方式读取并忽略错误
-            with open(filepath, 'rb') as f:
-                content = f.read().decode('utf-8', errors='ignore')
-        
-        # 获取分块大小
-        chunk_size = self.properties.get('chunk_size', 500)
-        
-        # 分块处理
-        chunks = []
-        for i in range(0, len(content), chunk_size):
-            chunk = content[i:i + chunk_size].strip()
-            if chunk:  # 只添加非空块
-                chunks.append(chunk)
-                
-        return chunks
+        return [chunk for chunk, _ in self._iter_chunks(filepath)]
     
-    def addItem(self, filepath: str, metadata: Dict[str, Any]):
+    def _get_manifest(self) -> Manifest:
         """
-        用于添加单个文件内容到知识库
-        
+        获取导入清单，清单文件与 properties.json 存放在同一目录；
+        升级前创建的知识库在首次使用时从 collection 回填清单之外的文件
+        """
+        if self._manifest is not None:
+            return self._manifest
+        with self._init_lock:
+            if self._manifest is None:
+                manifest = Manifest(self._sidecar_path("manifest.sqlite3"), read_only=self.read_only)
+                if not self.read_only and not manifest.backfilled() and self.collection is not None:
+                    self._backfill_manifest(manifest)
+                self._manifest = manifest
+        return self._manifest
+
+    def _backfill_manifest(self, manifest: Manifest, batch_size: int = 1000):
+        """
+        为 collection 中没有清单记录的文件（升级前导入）回填清单，不获取写锁（首次使用时的自动回填可能发生在写入过程中）
+
+        按 chunk_index 顺序由已保存的文本重新计算各 chunk 的哈希，再次导入同一文件时只写入变化的部分，
+        不会重复写入全部 chunk。只为这些文件读取文本。
+
         Args:
-            filepath: 文件路径
-            metadata: 文件元数据
-                section: 两位数字（必须）
-                chapter: 两位数字（可选）
-                is_section_db: bool 值（可选）
-                is_chapter_db: bool 值（可选）
+            manifest: 导入清单
+            batch_size: 每次从 collection 读取的 chunk 数量
         """
-        
-        # 解析文件
-        chunks = self._parser(filepath)
-        
-        # 向量化
-        embeddings = self._embedding(chunks)
-        
-        # 准备数据
-        ids = []
-        metadatas = []
-        source_file = os.path.basename(filepath)
-        
-        # 为整个文件生成唯一标识符
-        file_id = str(uuid.uuid4())
-        
-        for i, chunk in enumerate(chunks):
-            # 为每个 chunk 生成唯一 id
-            chunk_id = f"{file_id}_{source_file}_{i}"
-            ids.append(chunk_id)
-            
-            # 构建元数据
-            chunk_metadata = metadata.copy()
-            chunk_metadata['source_file'] = source_file
-            chunk_metadata['chunk_index'] = i
-            chunk_metadata['file_id'] = file_id  # 添加文件唯一标识符
-            
-            metadatas.append(chunk_metadata)
-        
-        # 添加到 Chroma
-        self.collection.add(
-            ids=ids,
-            embeddings=embeddings,
-            documents=chunks,
-            metadatas=metadatas
-        )
-        
-        return file_id  # 返回文件ID，便于后续操作
-      
-    def delItem(self, file_id: str):
-          """
-          根据文件ID删除知识库中的文件内容
-          
-          Args:
-              file_id: 文件唯一标识符，由addItem方法返回
-          """
-          # 查询所有属于该文件的chunks
-          results = self.collection.get(
-              where={"file_id": file_id}
-          )
-          
-          # 如果找到了匹配的chunks，则删除它们
-          if results and results['ids']:
-              self.collection.delete(ids=results['ids'])
-              return len(results['ids'])  # 返回删除的chunk数量
-          else:
-              return 0  # 没有找到匹配的文件
-      
-    def list(self) -> List[Dict[str, Any]]:
+        known = manifest.file_ids()
+        files = {}  # 文件ID -> [源文件名, 文件元数据, [(chunk_index, chunk_id)]]
+        if self.collection.count() > 0:
+            for batch in self._iter_collection(["metadatas"], batch_size):
+                for chunk_id, metadata in zip(batch['ids'], batch['metadatas']):
+                    file_id = metadata.get('file_id')
+                    if not file_id or file_id in known:
+                        continue
+                    if file_id not in files:
+                        file_metadata = {key: value for key, value in metadata.items()
+                                         if key not in ('source_file', 'chunk_index', 'file_id', 'page')}
+                        files[file_id] = [metadata.get('source_file', ''), file_metadata, []]
+                    files[file_id][2].append((metadata.get('chunk_index', 0), chunk_id))
+
+        rows = []
+        for file_id, (source_file, file_metadata, chunks) in files.items():
+            chunks.sort()
+            ids = [chunk_id for _, chunk_id in chunks]
+            documents = {}
+            for start in range(0, len(ids), batch_size):
+                found = self.collection.get(ids=ids[start:start + batch_size], include=["documents"])
+                documents.update(zip(found['ids'], found['documents']))
+            seen = {}
+            chunk_rows = [(self._chunk_key(documents.get(chunk_id) or "", seen), chunk_id, index)
+                          for index, chunk_id in chunks]
+            rows.append((file_id, source_file, json.dumps(file_metadata, ensure_ascii=False, sort_keys=True),
+                         chunk_rows))
+        manifest.backfill_files(rows)
+
+    def _get_route_index(self) -> RouteIndex:
         """
-        列出知识库中的所有文件及其 chunk 数量
-        
-        Returns:
-            包含文件信息的列表，每个元素包含：
-                - file_id: 文件唯一标识符
-                - source_file: 源文件名
-                - chunk_count: 该文件的 chunk 数量
+        获取类/章路由索引，索引文件与 properties.json 存放在同一目录
         """
-        # 获取所有文档的元数据
-        results = self.collection.get(include=['metadatas'])
-        
-        # 如果没有文档，返回空列表
-        if not results or not results['ids']:
-            return []
-        
-        # 统计每个文件的 chunk 数量
-        file_stats = {}
-        
-        # 遍历所有文档的元数据
-        for metadata in results['metadatas']:
-            file_id = metadata.get('file_id')
-            source_file = metadata.get('source_file')
-            
-            # 如果这是第一次遇到这个文件，初始化统计数据
-            if file_id not in file_stats:
-                file_stats[file_id] = {
-                    'file_id': file_id,
-                    'source_file': source_file,
-                    'chunk_count': 0
-                }
-            
-            # 增加该文件的 chunk 计数
-            file_stats[file_id]['chunk_count'] += 1
-        
-        # 将统计结果转换为列表并返回
-        return list(file_stats.values())
-    
-    def query(self, text: str, top_k: int = 5, where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        if self._route_index is not None:
+            return self._route_index
+        with self._init_lock:
+            if self._route_index is None:
+                self._route_index = RouteIndex(self._sidecar_path("routes.sqlite3"), read_only=self.read_only)
+        return self._route_index
+
+    def _get_code_index(self) -> CodeIndex:
         """
-        输入自然语言查询字符串
-        
+        获取 HS 编码精确索引，索引文件与 properties.json 存放在同一目录；
+        升级前创建的知识库在首次使用时从 collection 构建索引
+        """
+        if self._code_index is not None:
+            return self._code_index
+        with self._init_lock:
+            if self._code_index is None:
+                code_index_path = self._sidecar_path("codes.sqlite3")
+                is_new = not os.path.exists(code_index_path)
+                code_index = CodeIndex(code_index_path, read_only=self.read_only)
+                if is_new and self.collection is not None and self.collection.count() > 0:
+                    self._fill_code_index(code_index)
+                self._code_index = code_index
+        return self._code_index
+
+    def _get_lexical_index(self) -> LexicalIndex:
+        """
+        获取字符二元组倒排索引，索引文件与 properties.json 存放在同一目录；
+        升级前创建的知识库在首次使用时从 collection 构建索引
+        """
+        if self._lexical_index is not None:
+            return self._lexical_index
+        with self._init_lock:
+            if self._lexical_index is None:
+                lexical_index_path = self._sidecar_path("lexical.sqlite3")
+                is_new = not os.path.exists(lexical_index_path)
+                lexical_index = LexicalIndex(lexical_index_path, read_only=self.read_only)
+                if is_new and self.collection is not None and self.collection.count() > 0:
+                    self._fill_lexical_index(lexical_index)
+                self._lexical_index = lexical_index
+        return self._lexical_index
+
+    def _get_dedup_index(self) -> Optional[DedupIndex]:
+        """
+        获取近似重复索引，索引文件与 properties.json 存放在同一目录；创建知识库时未启用 dedup 则为 None
+        """
+        if self._dedup_index is not None or not self.properties.get('dedup'):
+            return self._dedup_index
+        with self._init_lock:
+            if self._dedup_index is None:
+                self._dedup_index = DedupIndex(self._sidecar_path("dedup.sqlite3"),
+                                               self.properties.get('dedup_distance', 3),
+                                               read_only=self.read_only)
+        return self._dedup_index
+
+    def _materialize_references(self, references: List[Dict[str, Any]]):
+        """
+        将引用转为正式的 chunk 写入 collection，向量沿用其原始 chunk 的向量（两者文本近似相同）
+
         Args:
-            text: 查询文本
-            top_k: 返回结果数量
-            where: metadata 过滤条件，例如 {"section": "11"} 或 {"chapter": "45"}
-            
+            references: DedupIndex 返回的引用列表，原始 chunk 必须仍在 collection 中
+        """
+        if not references:
+            return
+        dedup_index = self._get_dedup_index()
+        canonical_ids = list(dict.fromkeys(ref['canonical_id'] for ref in references))
+        found = self.collection.get(ids=canonical_ids, include=["embeddings"])
+        embeddings = dict(zip(found['ids'], found['embeddings']))
+        references = [ref for ref in references if ref['canonical_id'] in embeddings]
+        if not references:
+            return
+
+        ids = [ref['id'] for ref in references]
+        vectors = [embeddings[ref['canonical_id']] for ref in references]
+        documents = [ref['document'] for ref in references]
+        metadatas = [ref['metadata'] for ref in references]
+        self.collection.upsert(ids=ids, embeddings=vectors, documents=documents, metadatas=metadatas)
+        self._add_indexed(ids, vectors, documents, metadatas)
+        dedup_index.discard(ids)
+        for ref in references:
+            dedup_index.register(ref['id'], ref['document'], ref['metadata'])
+
+    def _promote_references(self, ids: List[str]):
+        """
+        在删除原始 chunk 之前，将指向它的第一个引用提升为新的原始 chunk，其余引用改为指向新的原始 chunk
+
+        Args:
+            ids: 即将删除的 chunk id 列表（不含引用）
+        """
+        dedup_index = self._get_dedup_index()
+        if dedup_index is None or not ids:
+            return
+        groups = {}
+        for ref in dedup_index.references(ids):
+            groups.setdefault(ref['canonical_id'], []).append(ref)
+        if not groups:
+            return
+        self._materialize_references([refs[0] for refs in groups.values()])
+        for canonical_id, refs in groups.items():
+            dedup_index.repoint(canonical_id, refs[0]['id'])
+
+    def _delete_chunks(self, ids: List[str]):
+        """
+        删除一组 chunk 并同步更新各索引；ids 中的引用只删除引用记录，
+        被删除的原始 chunk 如有引用则先提升其中一个
+
+        Args:
+            ids: chunk id 列表
+        """
+        dedup_index = self._get_dedup_index()
+        if dedup_index is not None:
+            references = {ref['id'] for ref in dedup_index.get(ids)}
+            dedup_index.discard(references)
+            ids = [chunk_id for chunk_id in ids if chunk_id not in references]
+            self._promote_references(ids)
+        if ids:
+            self._remove_indexed(ids)
+            self.collection.delete(ids=ids)
+            if dedup_index is not None:
+                dedup_index.discard(ids)
+
+    def _update_references(self, ids: List[str],
+                           metadatas: List[Dict[str, Any]]) -> Tuple[List[str], List[Dict[str, Any]]]:
+        """
+        更新引用的元数据；类/章发生变化的引用不再与原始 chunk 属于同一去重范围，转为正式 chunk
+
+        Args:
+            ids: 需要更新元数据的 chunk id 列表
+            metadatas: 对应的新元数据
+
         Returns:
-            结构化结果列表
+            不是引用、仍需在 collection 中更新的 (id 列表, 元数据列表)
         """
-        # 向量化查询文本
-        query_embedding = self._embedding([text])[0]
-        
-        # 构建查询参数
-        query_params = {
-            "query_embeddings": [query_embedding],
-            "n_results": top_k
+        dedup_index = self._get_dedup_index()
+        if dedup_index is None:
+            return ids, metadatas
+        references = {ref['id']: ref for ref in dedup_index.get(ids)}
+        if not references:
+            return ids, metadatas
+
+        rest_ids, rest_metadatas, moved = [], [], []
+        for chunk_id, metadata in zip(ids, metadatas):
+            ref = references.get(chunk_id)
+            if ref is None:
+                rest_ids.append(chunk_id)
+                rest_metadatas.append(metadata)
+            elif DedupIndex.scope(ref['metadata']) != DedupIndex.scope(metadata):
+                ref['metadata'] = metadata
+                moved.append(ref)
+            else:
+                dedup_index.update_references([chunk_id], [metadata])
+        self._materialize_references(moved)
+        return rest_ids, rest_metadatas
+
+    def dedup_stats(self) -> Dict[str, Any]:
+        """
+        获取近似重复消除的统计信息
+
+        Returns:
+            包含以下字段的字典（未启用 dedup 时只有 enabled）：
+                - enabled: 是否启用
+                - vectors: collection 中实际保存的向量数
+                - references: 以引用形式保存、没有写入向量的 chunk 数
+                - dedup_ratio: 引用占全部 chunk 的比例
+                - saved_bytes: 按每个向量的字节数估算节省的向量存储
+        """
+        dedup_index = self._get_dedup_index()
+        if dedup_index is None:
+            return {"enabled": False}
+        references = dedup_index.stats()['references']
+        index_stats = self.index_stats()
+        vectors = index_stats.get('count', 0)
+        total = vectors + references
+        return {
+            "enabled": True,
+            "vectors": vectors,
+            "references": references,
+            "dedup_ratio": references / total if total else 0.0,
+            "saved_bytes": references * index_stats.get('bytes_per_vector', 0),
         }
+
+    def _iter_collection(self, include: List[str], batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        """
+        分批读取 collection 中的全部 chunk
+
+        Args:
+            include: 需要读取的字段
+            batch_size: 每次读取的 chunk 数量
+
+        Returns:
+            collection.get 返回结果的迭代器
+        """
+        offset = 0
+        while True:
+            batch = self.collection.get(limit=batch_size, offset=offset, include=include)
+            if not batch['ids']:
+                break
+            yield batch
+            offset += len(batch['ids'])
+
+    def _remove_indexed(self, ids: List[str]):
+        """
+        在删除 chunk 之前，将其从路由索引的质心、编码索引和倒排索引中移除
+
+        Args:
+            ids: 即将删除的 chunk id 列表
+        """
+        if not ids:
+            return
+        old = self.collection.get(ids=ids, include=["embeddings", "metadatas"])
+        self._get_route_index().remove(old['embeddings'], old['metadatas'])
+        self._get_code_index().remove(ids)
+        self._get_lexical_index().remove(ids)
+
+    def _add_indexed(self, ids: List[str], embeddings: List[List[float]], documents: List[str],
+                     metadatas: List[Dict[str, Any]]):
+        """
+        将新写入的 chunk 计入路由索引、编码索引和倒排索引
+
+        Args:
+            ids: chunk id 列表
+            embeddings: chunk 向量列表
+            documents: chunk 文本列表
+            metadatas: chunk 元数据列表
+        """
+        self._get_route_index().add(embeddings, metadatas)
+        self._get_code_index().add(ids, documents, metadatas)
+        self._get_lexical_index().add(ids, documents)
+
+    @_writes
+    def rebuild_routes(self, batch_size: int = 1000):
+        """
+        从 collection 中重新计算所有类/章质心
+
+        路由索引在写入和删除时增量维护；升级前创建的知识库在首次路由查询时会自动调用本方法。
+        完成后代数加一，只读进程据此重新载入质心。
+
+        Args:
+            batch_size: 每次从 collection 读取的 chunk 数量
+        """
+        route_index = self._get_route_index()
+        route_index.clear()
+        for batch in self._iter_collection(["embeddings", "metadatas"], batch_size):
+            route_index.add(batch['embeddings'], batch['metadatas'])
+        self._get_manifest().bump_generation()
+
+    def _refresh_routes(self, batch_size: int = 1000):
+        """
+        重新计算批量删除后标记为待重算的类/章质心，只读取这些类/章下的 chunk；调用方需持有写锁
+
+        有质心被重新计算时代数加一，只读进程据此重新载入质心。
+
+        Args:
+            batch_size: 每次从 collection 读取的 chunk 数量
+        """
+        route_index = self._get_route_index()
+        stale = route_index.stale_keys()
+        for level, key in stale:
+            def batches(level=level, key=key):
+                offset = 0
+                while True:
+                    batch = self.collection.get(where={level: key}, limit=batch_size, offset=offset,
+                                                include=["embeddings", "metadatas"])
+                    if not batch['ids']:
+                        return
+                    yield batch['embeddings'], batch['metadatas']
+                    offset += len(batch['ids'])
+            route_index.recompute(level, key, batches())
+        if stale:
+            self._get_manifest().bump_generation()
+
+    @_writes
+    def rebuild_codes(self, batch_size: int = 1000):
+        """
+        从 collection 中重新构建 HS 编码精确索引
+
+        编码索引在写入和删除时增量维护；升级前创建的知识库在首次使用时会自动调用本方法。
+
+        Args:
+            batch_size: 每次从 collection 读取的 chunk 数量
+        """
+        self._fill_code_index(self._get_code_index(), batch_size)
+
+    def _fill_code_index(self, code_index: CodeIndex, batch_size: int = 1000):
+        """
+        清空编码索引并从 collection 重新填充，不获取写锁（首次使用时的自动构建可能发生在写入过程中）
+        """
+        code_index.clear()
+        for batch in self._iter_collection(["documents", "metadatas"], batch_size):
+            code_index.add(batch['ids'], batch['documents'], batch['metadatas'])
+
+    @_writes
+    def rebuild_lexical(self, batch_size: int = 1000):
+        """
+        从 collection 中重新构建字符二元组倒排索引
+
+        倒排索引在写入和删除时增量维护；升级前创建的知识库在首次使用时会自动调用本方法。
+
+        Args:
+            batch_size: 每次从 collection 读取的 chunk 数量
+        """
+        self._fill_lexical_index(self._get_lexical_index(), batch_size)
+
+    def _fill_lexical_index(self, lexical_index: LexicalIndex, batch_size: int = 1000):
+        """
+        清空倒排索引并从 collection 重新填充，不获取写锁（首次使用时的自动构建可能发生在写入过程中）
+        """
+        lexical_index.clear()
+        for batch in self._iter_collection(["documents"], batch_size):
+            lexical_index.add(batch['ids'], batch['documents'])
+
+    @_writes
+    def rebuild_section(self, section: str, batch_size: int = 1000, workers: int = 0) -> List[Dict[str, Any]]:
+        """
+        从源文件重新导入一个类，其他分片不受影响（仅适用于 sharded=True 的知识库）
+
+        按导入清单中记录的源文件路径找到该类的全部文件，删除该类的分片后重新解析、向量化并写入，
+        文件ID保持不变。任一文件没有记录源文件路径（升级前导入且尚未再次导入）或源文件已不存在时
+        不做任何修改并报错。
+
+        Args:
+            section: 类编号，例如 "11"
+            batch_size: 每批删除和写入的 chunk 数量
+            workers: 解析文件的进程数，见 addItems
+
+        Returns:
+            与 addItems 相同格式的结果列表，每个元素对应该类的一个文件
+        """
+        if not self.properties.get('sharded', False):
+            raise ValueError("知识库未按类分片，请在 create 时指定 sharded=True")
+
+        manifest = self._get_manifest()
+        files = manifest.files_in_section(section)
+        missing = [f['source_file'] for f in files if not f['source_path'] or not os.path.exists(f['source_path'])]
+        if missing:
+            raise ValueError(f"类 {section} 中以下文件的源文件不存在，无法重新导入: {', '.join(missing)}")
+
+        self.delWhere({"section": section}, batch_size)
+        # 保留文件记录但清空 chunk 和内容哈希，重新导入时沿用原文件ID
+        for f in files:
+            manifest.save_file(f['source_path'], f['file_id'], f['source_file'], "", f['metadata'], [])
+        return self.addItems([f['source_path'] for f in files], [json.loads(f['metadata']) for f in files],
+                             write_batch_size=batch_size, workers=workers)
+
+    @_writes
+    def compact_section(self, section: str, batch_size: int = 1000) -> int:
+        """
+        压缩一个类的分片，其他分片不受影响（仅适用于 sharded=True 的知识库）
+
+        把分片中的向量、文本和元数据复制到新建的 collection 后替换原分片：Chroma 后端重新构建 HNSW 图，
+        清除删除留下的空洞；NumPy 后端去除已删除的行，pq 压缩时用该类的全部向量重新训练聚类中心。
+        不重新解析源文件，向量不重新计算，路由、编码和倒排索引保持不变；需要从源文件重新导入时使用 rebuild_section。
+
+        Args:
+            section: 类编号，例如 "11"；空字符串表示没有 section 的 chunk
+            batch_size: 每次复制的 chunk 数量
+
+        Returns:
+            复制的 chunk 数量
+        """
+        if not self.properties.get('sharded', False):
+            raise ValueError("知识库未按类分片，请在 create 时指定 sharded=True")
+        from sharded_collection import shard_key
+
+        collection = self.collection
+        key = shard_key(section)
+        old = collection.shard(key)
+        if old is None:
+            raise ValueError(f"类 {section} 没有分片")
+
+        name = f"{self.properties['name']}-section-{key}"
+        temp_name = f"{self.properties['name']}-rebuild-{key}"
+        # 先写入临时 collection，复制完成后再替换，中途失败时原分片不受影响
+        self._drop_index(temp_name)
+        new = self._open_index(temp_name, create=True)
+        copied = 0
+        while True:
+            batch = old.get(limit=batch_size, offset=copied, include=["embeddings", "documents", "metadatas"])
+            if not batch['ids']:
+                break
+            new.add(ids=batch['ids'], embeddings=batch['embeddings'],
+                    documents=batch['documents'], metadatas=batch['metadatas'])
+            copied += len(batch['ids'])
+        if hasattr(new, 'train_quantizer'):
+            new.train_quantizer()
+
+        self._drop_index(name)
+        collection.set_shard(key, self._rename_index(new, name))
+        # 内容未变，但其他只读进程需要据此重新打开 collection
+        self._get_manifest().bump_generation()
+        return copied
+
+    def route_stats(self) -> Dict[str, int]:
+        """
+        获取类/章路由索引的统计信息
+
+        Returns:
+            包含 sections、chapters、chunks 的字典
+        """
+        return self._get_route_index().stats()
+
+    @staticmethod
+    def _file_hash(filepath: str) -> str:
+        """
+        分块读取文件并计算内容哈希
+
+        Args:
+            filepath: 文件路径
+
+        Returns:
+            文件内容的 sha256 十六进制字符串
+        """
+        digest = hashlib.sha256()
+        with open(filepath, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _plan_file(self, filepath: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        对比导入清单，判断文件是否需要重新导入
+
+        chunk 以内容哈希标识，文件内容变化时只有新增的 chunk 需要重新向量化，
+        位置变化的 chunk 只更新元数据，消失的 chunk 被删除（见 _diff_chunks）。
+
+        Args:
+            filepath: 文件路径
+            metadata: 文件元数据
+
+        Returns:
+            导入计划字典；文件内容和元数据都未变化时 unchanged 为 True
+        """
+        source_path = os.path.abspath(filepath)
+        source_file = os.path.basename(filepath)
+        content_hash = self._file_hash(filepath)
+        metadata_json = json.dumps(metadata, ensure_ascii=False, sort_keys=True)
+
+        manifest = self._get_manifest()
+        entry = manifest.get_by_path(source_path)
+        if entry is None:
+            # 升级前导入的文件只有回填的记录，按文件名认领，沿用其文件ID和 chunk
+            entry = manifest.get_unclaimed(source_file, metadata_json)
+        plan = {
+            "source_path": source_path,
+            "source_file": source_file,
+            "content_hash": content_hash,
+            "metadata": metadata_json,
+            "file_id": entry['file_id'] if entry else str(uuid.uuid4()),
+            "unchanged": False,
+            "chunk_rows": [],
+            "update_ids": [],
+            "update_metadatas": [],
+            "removed_ids": [],
+        }
+        if entry and entry['content_hash'] == content_hash and entry['metadata'] == metadata_json:
+            plan['unchanged'] = True
+            return plan
+
+        plan['old_chunks'] = entry['chunks'] if entry else {}
+        plan['metadata_changed'] = entry is not None and entry['metadata'] != metadata_json
+        return plan
+
+    @staticmethod
+    def _chunk_key(chunk: str, seen: Dict[str, int]) -> str:
+        """
+        计算 chunk 在清单中的哈希，同一文件中重复出现的 chunk 以序号区分
+
+        Args:
+            chunk: chunk 文本
+            seen: 同一文件中已出现的哈希 -> 次数，调用后更新
+
+        Returns:
+            chunk 哈希
+        """
+        digest = hashlib.sha256(chunk.encode('utf-8')).hexdigest()[:32]
+        occurrence = seen.get(digest, 0)
+        seen[digest] = occurrence + 1
+        return digest if occurrence == 0 else f"{digest}-{occurrence}"
+
+    def _diff_chunks(self, plan: Dict[str, Any], chunks: Iterator[Tuple[str, Optional[int]]],
+                     metadata: Dict[str, Any]) -> Iterator[Tuple[str, str, Dict[str, Any]]]:
+        """
+        逐个将解析出的 chunk 与清单中的 chunk 对比
+
+        位置或元数据变化的 chunk 记入 plan 的更新列表，解析结束后计算需要删除的 chunk。
+
+        Args:
+            plan: _plan_file 返回的导入计划
+            chunks: (chunk 文本, 起始页码) 的迭代器，通常来自 _iter_chunks
+            metadata: 文件元数据
+
+        Returns:
+            需要新增的 (chunk_id, chunk 文本, chunk 元数据) 的迭代器
+        """
+        old_chunks = plan['old_chunks']
+        file_id = plan['file_id']
+        source_file = plan['source_file']
+
+        seen = {}
+        for i, (chunk, page) in enumerate(chunks):
+            key = self._chunk_key(chunk, seen)
+
+            # 构建元数据
+            chunk_metadata = metadata.copy()
+            chunk_metadata['source_file'] = source_file
+            chunk_metadata['chunk_index'] = i
+            chunk_metadata['file_id'] = file_id  # 添加文件唯一标识符
+            if page is not None:
+                chunk_metadata['page'] = page
+
+            if key in old_chunks:
+                chunk_id, old_index = old_chunks[key]
+                if old_index != i or plan['metadata_changed']:
+                    plan['update_ids'].append(chunk_id)
+                    plan['update_metadatas'].append(chunk_metadata)
+            else:
+                chunk_id = f"{file_id}_{source_file}_{key}"
+                yield chunk_id, chunk, chunk_metadata
+
+            plan['chunk_rows'].append((key, chunk_id, i))
+
+        current_keys = {row[0] for row in plan['chunk_rows']}
+        plan['removed_ids'] = [chunk_id for key, (chunk_id, _) in old_chunks.items()
+                               if key not in current_keys]
+
+    def _apply_plan(self, plan: Dict[str, Any]):
+        """
+        在新增 chunk 写入成功后，更新移动过的 chunk、删除消失的 chunk 并保存清单
+
+        Args:
+            plan: _plan_file 返回的导入计划
+        """
+        # 近似重复的引用不在 collection 中，单独更新
+        update_ids, update_metadatas = self._update_references(plan['update_ids'], plan['update_metadatas'])
+        if update_ids:
+            if plan['metadata_changed']:
+                # 文件元数据变化可能改变 chunk 所属的类/章，先从旧质心和编码索引中移除
+                old = self.collection.get(ids=update_ids, include=["embeddings", "documents", "metadatas"])
+                self._get_route_index().remove(old['embeddings'], old['metadatas'])
+                self._get_code_index().remove(old['ids'])
+            self.collection.update(ids=update_ids, metadatas=update_metadatas)
+            if plan['metadata_changed']:
+                new_metadatas = dict(zip(update_ids, update_metadatas))
+                self._add_indexed(old['ids'], old['embeddings'], old['documents'],
+                                  [new_metadatas[i] for i in old['ids']])
+            else:
+                self._get_code_index().update_positions(
+                    update_ids, [metadata['chunk_index'] for metadata in update_metadatas]
+                )
+        if plan['removed_ids']:
+            self._delete_chunks(plan['removed_ids'])
+
+        self._get_manifest().save_file(
+            plan['source_path'], plan['file_id'], plan['source_file'],
+            plan['content_hash'], plan['metadata'], plan['chunk_rows']
+        )
+
+    @property
+    def generation(self) -> int:
+        """
+        知识库的代数，每次通过 addItem/addItems/delItem 修改内容后加一
+        """
+        return self._get_manifest().generation()
+
+    def index_stats(self) -> Dict[str, Any]:
+        """
+        获取向量索引的统计信息
+
+        Returns:
+            包含 backend、count、dim、bytes_per_vector 等字段的字典；numpy 后端另含压缩方式、
+            磁盘占用等字段（见 NumpyCollection.stats），collection 不存在时返回空字典
+        """
+        if self.collection is None:
+            return {}
+        if hasattr(self.collection, 'stats'):
+            return self.collection.stats()
+
+        # Chroma 以 float32 保存向量，HNSW 图的开销不计入
+        count = self.collection.count()
+        dim = 0
+        if count:
+            sample = self.collection.get(limit=1, include=["embeddings"])
+            dim = len(sample['embeddings'][0])
+        return {"backend": "chroma", "count": count, "dim": dim, "bytes_per_vector": dim * 4}
+
+    def query_cache_stats(self) -> Dict[str, Any]:
+        """
+        获取查询结果缓存的命中统计
+
+        Returns:
+            包含 hits、misses、hit_rate、entries、max_entries 的字典
+        """
+        return self._query_cache.stats()
+
+    def save_query_cache(self):
+        """
+        将查询结果缓存保存到 query_cache.json（仅在 persist_query_cache=True 时生效）
+        """
+        if self._query_cache_path is None or self.read_only:
+            return
+        try:
+            self._query_cache.save(self._query_cache_path)
+        except OSError as e:
+            print(f"保存查询缓存时出错: {str(e)}")
+
+    def close(self):
+        """
+        释放本实例占用的资源：等待后台预热结束，停止异步线程池，保存查询缓存，
+        归还共享模型的引用并关闭各 SQLite 文件
+
+        关闭后仍可继续使用，用到的资源会按需重新打开。
+        """
+        if self._warmup_thread is not None:
+            self._warmup_thread.join()
+        with self._executor_lock:
+            executors = [self._executor, self._write_executor]
+            self._executor = None
+            self._write_executor = None
+        for executor in executors:
+            if executor is not None:
+                executor.shutdown(wait=True)
+
+        with self._write_lock, self._init_lock:
+            self.save_query_cache()
+            with self._model_lock:
+                if self._model_release is not None:
+                    self._model_release()
+                self._model_release = None
+                self._model_key = None
+            if hasattr(self._collection, 'close'):
+                self._collection.close()
+            for name in ("_embedding_cache", "_manifest", "_route_index", "_code_index",
+                         "_lexical_index", "_dedup_index"):
+                index = getattr(self, name)
+                if index is not None:
+                    setattr(self, name, None)
+                    index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @_writes
+    def addItem(self, filepath: str, metadata: Dict[str, Any], batch_size: int = 256,
+                write_queue_size: int = 2):
+        """
+        用于添加单个文件内容到知识库
+
+        重复添加同一路径的文件是幂等的：内容未变化时不做任何操作，
+        内容变化时只写入变化的 chunk 并删除已消失的 chunk，文件ID保持不变。
+
+        向量化在当前线程进行，写入由独立的写线程完成，两者可以同时进行；
+        某一批写入失败不会中断整个文件，清单中只记录写入成功的 chunk，下次导入时补写失败的部分。
+        
+        Args:
+            filepath: 文件路径
+            metadata: 文件元数据
+                section: 两位数字（必须）
+                chapter: 两位数字（可选）
+                is_section_db: bool 值（可选）
+                is_chapter_db: bool 值（可选）
+            batch_size: 每解析出多少个 chunk 进行一次向量化
+            write_queue_size: 已向量化但尚未写入的批次数上限，写入跟不上时向量化暂停等待
+        """
         
-        # 如果提供了 where 条件，则添加到查询参数中
-        if where is not None:
-            query_params["where"] = where
+        # 对比导入清单，未变化的文件直接返回
+        plan = self._plan_file(filepath, metadata)
+        if plan['unchanged']:
+            return plan['file_id']
         
-        # 执行查询
-        results = self.collection.query(**query_params)
+        # 边解析边向量化写入，内存占用与文件大小无关
+        dedup_index = self._get_dedup_index()
+        new_ids = []
+        written = []
+
+        def batches():
+            ids, chunks, metadatas = [], [], []
+            for chunk_id, chunk, chunk_metadata in self._diff_chunks(plan, self._iter_chunks(filepath), metadata):
+                new_ids.append(chunk_id)
+                # 近似重复的 chunk 只记录为引用，不需要向量化
+                if dedup_index is not None and dedup_index.assign(chunk_id, chunk, chunk_metadata) is not None:
+                    continue
+                ids.append(chunk_id)
+                chunks.append(chunk)
+                metadatas.append(chunk_metadata)
+                if len(ids) >= batch_size:
+                    yield ids, chunks, metadatas
+                    ids, chunks, metadatas = [], [], []
+            if ids:
+                yield ids, chunks, metadatas
+
+        try:
+            failed = set(self._write_stream(batches(), write_queue_size, written))
+        except Exception:
+            # 解析中途出错时清单不会更新，回滚已写入的 chunk 和已记录的引用，避免留下清单之外的数据
+            try:
+                if dedup_index is not None:
+                    written_ids = set(written)
+                    dedup_index.discard([chunk_id for chunk_id in new_ids if chunk_id not in written_ids])
+                if written:
+                    self._delete_chunks(written)
+            except Exception as e:
+                print(f"回滚文件 {filepath} 时出错: {str(e)}")
+            raise
+        if failed and dedup_index is not None:
+            # 指向写入失败的 chunk 的引用同样视为失败
+            failed.update(dedup_index.discard(failed))
+        if failed:
+            # 清单只记录写入成功的 chunk，并清空内容哈希，使下次导入时重新比对并补写
+            print(f"文件 {filepath} 有 {len(failed)} 个 chunk 写入失败，下次导入时将重试")
+            plan['chunk_rows'] = [row for row in plan['chunk_rows'] if row[1] not in failed]
+            plan['content_hash'] = ""
         
-        # 构建返回结果
+        self._apply_plan(plan)
+        
+        return plan['file_id']  # 返回文件ID，便于后续操作
+
+    def _max_write_batch(self) -> int:
+        """
+        单次写入 collection 的最大 chunk 数：Chroma 受 client.max_batch_size 限制，NumpyCollection 不限
+        """
+        if self.properties.get('index_backend', 'chroma') == 'numpy':
+            return 1 << 30
+        return getattr(self.client, 'max_batch_size', None) or 5000
+
+    def _write_stream(self, batches: Iterator[Tuple[List[str], List[str], List[Dict[str, Any]]]],
+                      queue_size: int = 2, written: Optional[List[str]] = None,
+                      write_batch_size: int = 0) -> List[str]:
+        """
+        在当前线程中逐批向量化，经有界队列交给写线程写入 collection
+
+        写线程把向量化结果攒到 write_batch_size 个 chunk 再写入，并按 _max_write_batch 拆分过大的批次；
+        向量化或写入出错的批次被跳过，其余批次继续写入。
+
+        Args:
+            batches: (chunk id 列表, chunk 文本列表, chunk 元数据列表) 的迭代器，每一批向量化一次
+            queue_size: 已向量化但尚未写入的批次数上限
+            written: 传入时将写入成功的 chunk id 追加到其中；batches 抛出异常时，已入队的批次仍会写完
+            write_batch_size: 每次写入 collection 的 chunk 数量，0 表示每一批向量化结果单独写入
+
+        Returns:
+            向量化或写入失败的 chunk id 列表
+        """
+        max_batch = self._max_write_batch()
+        if write_batch_size > 0:
+            max_batch = min(max_batch, write_batch_size)
+        write_queue = queue.Queue(maxsize=max(queue_size, 1))
+        failed = []
+        done = object()
+
+        def flush(buffered, size):
+            # 写入缓冲区中的前 size 个 chunk 并将其移出缓冲区
+            ids, embeddings, chunks, metadatas = (column[:size] for column in buffered)
+            for column in buffered:
+                del column[:size]
+            for start in range(0, size, max_batch):
+                end = start + max_batch
+                try:
+                    self.collection.upsert(
+                        ids=ids[start:end],
+                        embeddings=embeddings[start:end],
+                        documents=chunks[start:end],
+                        metadatas=metadatas[start:end]
+                    )
+                    self._add_indexed(ids[start:end], embeddings[start:end],
+                                      chunks[start:end], metadatas[start:end])
+                except Exception as e:
+                    print(f"写入 chunk 时出错: {str(e)}")
+                    failed.extend(ids[start:end])
+                    continue
+                if written is not None:
+                    written.extend(ids[start:end])
+
+        def write():
+            buffered = ([], [], [], [])
+            while True:
+                item = write_queue.get()
+                if item is done:
+                    flush(buffered, len(buffered[0]))
+                    return
+                for column, values in zip(buffered, item):
+                    column.extend(values)
+                size = len(buffered[0])
+                if write_batch_size > 0:
+                    size -= size % write_batch_size
+                if size:
+                    flush(buffered, size)
+
+        writer = threading.Thread(target=write, daemon=True)
+        writer.start()
+        try:
+            for ids, chunks, metadatas in batches:
+                try:
+                    embeddings = self._embedding(chunks)
+                except Exception as e:
+                    print(f"向量化 chunk 时出错: {str(e)}")
+                    failed.extend(ids)
+                    continue
+                # 队列满时阻塞，避免向量化远快于写入时占用过多内存
+                write_queue.put((ids, embeddings, chunks, metadatas))
+        finally:
+            write_queue.put(done)
+            writer.join()
+        return failed
+
+    @_writes
+    def addItems(self, filepaths: List[str], metadatas: List[Dict[str, Any]],
+                 encode_batch_size: int = 256, write_batch_size: int = 1000,
+                 pool_size: int = 8192, workers: int = 0,
+                 queue_size: int = 64, write_queue_size: int = 2) -> List[Dict[str, Any]]:
+        """
+        批量添加多个文件到知识库
+
+        多个文件的 chunk 会被汇集起来，按长度排序后分成较大的批次送入模型，
+        再由独立的写线程按 write_batch_size 分批写入 Chroma，向量化与写入可以同时进行。
+        单个文件出错不会影响其他文件；与 addItem 一样，某一批写入失败时只跳过这一批，
+        清单中只记录写入成功的 chunk，下次导入时补写失败的部分。
+        未变化的文件会被跳过，变化的文件只写入差异部分。
+
+        workers 大于 0 时，文件解析在独立的进程池中进行，解析结果经有界队列
+        交给当前线程统一向量化，解析与向量化可以同时进行。
+
+        Args:
+            filepaths: 文件路径列表
+            metadatas: 与 filepaths 一一对应的文件元数据列表
+            encode_batch_size: 每次向量化的 chunk 数量
+            write_batch_size: 每次写入 Chroma 的 chunk 数量，超过 Chroma 客户端的 max_batch_size 时按后者写入
+            pool_size: 汇集的 chunk 数量达到该值后即进行一次向量化和写入
+            workers: 解析文件的进程数，0 表示在当前线程中顺序解析
+            queue_size: 已解析但尚未向量化的文件数上限
+            write_queue_size: 已向量化但尚未写入的批次数上限，写入跟不上时向量化暂停等待
+
+        Returns:
+            与 filepaths 一一对应的结果列表，每个元素包含：
+                - filepath: 文件路径
+                - file_id: 文件唯一标识符，失败时为 None
+                - error: 错误信息，成功时为 None
+                - failed_chunks: 写入失败、下次导入时重试的 chunk 数
+        """
+        if len(filepaths) != len(metadatas):
+            raise ValueError("filepaths 与 metadatas 的长度必须一致")
+
+        results = [{"filepath": fp, "file_id": None, "error": None, "failed_chunks": 0} for fp in filepaths]
+        write_batch_size = min(write_batch_size, self._max_write_batch())
+
+        # 当前汇集中的文件及其导入计划
+        pending = []  # (结果下标, plan)
+        pending_count = 0
+
+        if workers > 0:
+            parsed = self._iter_parsed_parallel(filepaths, metadatas, workers, queue_size)
+        else:
+            parsed = self._iter_parsed(filepaths, metadatas)
+
+        seen = set()
+        for idx, plan, chunks, error in parsed:
+            seen.add(idx)
+            if error is None and not plan['unchanged']:
+                try:
+                    new_chunks = list(self._diff_chunks(plan, chunks, metadatas[idx]))
+                except Exception as e:
+                    error = e
+            if error is not None:
+                results[idx]["error"] = str(error)
+                continue
+
+            results[idx]["file_id"] = plan['file_id']
+            if plan['unchanged']:
+                continue
+
+            dedup_index = self._get_dedup_index()
+            if dedup_index is not None:
+                # 近似重复的 chunk 只记录为引用，不参与向量化和写入
+                unique = [c for c in new_chunks if dedup_index.assign(*c) is None]
+                unique_ids = {chunk_id for chunk_id, _, _ in unique}
+                plan['ref_ids'] = [chunk_id for chunk_id, _, _ in new_chunks if chunk_id not in unique_ids]
+                new_chunks = unique
+
+            plan['new_ids'] = [chunk_id for chunk_id, _, _ in new_chunks]
+            plan['new_documents'] = [chunk for _, chunk, _ in new_chunks]
+            plan['new_metadatas'] = [chunk_metadata for _, _, chunk_metadata in new_chunks]
+
+            pending.append((idx, plan))
+            pending_count += len(plan['new_ids'])
+
+            if pending_count >= pool_size:
+                self._flush_pending(pending, results, encode_batch_size, write_batch_size, write_queue_size)
+                pending = []
+                pending_count = 0
+
+        if pending:
+            self._flush_pending(pending, results, encode_batch_size, write_batch_size, write_queue_size)
+
+        for idx in range(len(filepaths)):
+            if idx not in seen:
+                results[idx]["error"] = "文件未被解析"
+
+        return results
+
+    def _iter_parsed(self, filepaths: List[str], metadatas: List[Dict[str, Any]]):
+        """
+        在当前线程中依次为每个文件生成导入计划和 chunk 迭代器
+
+        Returns:
+            (结果下标, plan, chunk 迭代器, 错误) 的迭代器
+        """
+        for idx, (filepath, metadata) in enumerate(zip(filepaths, metadatas)):
+            try:
+                plan = self._plan_file(filepath, metadata)
+            except Exception as e:
+                yield idx, None, None, e
+                continue
+            chunks = None if plan['unchanged'] else self._iter_chunks(filepath)
+            yield idx, plan, chunks, None
+
+    def _iter_parsed_parallel(self, filepaths: List[str], metadatas: List[Dict[str, Any]],
+                              workers: int, queue_size: int):
+        """
+        在进程池中解析文件，经有界队列按文件顺序交付解析结果
+
+        后台线程负责计算导入计划并向进程池提交解析任务，队列满时暂停提交，
+        避免解析速度远快于向量化时占用过多内存。
+
+        Returns:
+            (结果下标, plan, chunk 列表, 错误) 的迭代器
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        chunk_size = self.properties.get('chunk_size', 500)
+        parsed_queue = queue.Queue(maxsize=queue_size)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            # 消费端提前退出时不再阻塞
+            while not stop.is_set():
+                try:
+                    parsed_queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    inflight = deque()
+
+                    def drain_one():
+                        idx, plan, future = inflight.popleft()
+                        try:
+                            return put((idx, plan, future.result(), None))
+                        except Exception as e:
+                            return put((idx, plan, None, e))
+
+                    for idx, (filepath, metadata) in enumerate(zip(filepaths, metadatas)):
+                        if stop.is_set():
+                            break
+                        try:
+                            plan = self._plan_file(filepath, metadata)
+                        except Exception as e:
+                            put((idx, None, None, e))
+                            continue
+                        if plan['unchanged']:
+                            put((idx, plan, None, None))
+                            continue
+
+                        inflight.append((idx, plan, pool.submit(parse_file, filepath, chunk_size)))
+                        # 每个进程最多积压两个任务
+                        while len(inflight) >= workers * 2:
+                            if not drain_one():
+                                break
+
+                    while inflight and not stop.is_set():
+                        drain_one()
+                    for _, _, future in inflight:
+                        future.cancel()
+            except Exception as e:
+                print(f"并行解析文件时出错: {str(e)}")
+            finally:
+                put(done)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = parsed_queue.get()
+                if item is done:
+                    break
+                yield item
+        finally:
+            stop.set()
+            producer.join()
+
+    def _flush_pending(self, pending, results, encode_batch_size: int, write_batch_size: int,
+                       write_queue_size: int = 2):
+        """
+        对汇集的 chunk 统一向量化并分批写入 Chroma，随后提交各文件的导入计划
+
+        与 addItem 一样经 _write_stream 边向量化边写入：某一批向量化或写入失败时只跳过这一批，
+        清单中只记录写入成功的 chunk，并清空内容哈希，下次导入时补写失败的部分。
+
+        Args:
+            pending: (结果下标, plan) 列表
+            results: addItems 的结果列表，出错的文件会在其中记录错误信息
+            encode_batch_size: 每次向量化的 chunk 数量
+            write_batch_size: 每次写入 Chroma 的 chunk 数量
+            write_queue_size: 已向量化但尚未写入的批次数上限
+        """
+        # 展平为 chunk 级别的列表，owners 记录每个 chunk 所属的文件
+        owners = []
+        all_ids = []
+        all_chunks = []
+        all_metadatas = []
+        for idx, plan in pending:
+            owners.extend([idx] * len(plan['new_ids']))
+            all_ids.extend(plan['new_ids'])
+            all_chunks.extend(plan['new_documents'])
+            all_metadatas.extend(plan['new_metadatas'])
+
+        def batches():
+            # 按长度排序后分批向量化，减少 padding 带来的浪费
+            order = sorted(range(len(all_chunks)), key=lambda i: len(all_chunks[i]))
+            for start in range(0, len(order), encode_batch_size):
+                batch = order[start:start + encode_batch_size]
+                yield ([all_ids[i] for i in batch], [all_chunks[i] for i in batch],
+                       [all_metadatas[i] for i in batch])
+
+        written_ids = []
+        try:
+            failed = set(self._write_stream(batches(), write_queue_size, written_ids, write_batch_size))
+        except Exception as e:
+            # 写入中途异常时所有文件都视为失败，下面统一回滚已写入的 chunk
+            failed = set()
+            for idx, _ in pending:
+                results[idx]["error"] = str(e)
+        owner_of = dict(zip(all_ids, owners))
+        written = {}  # 结果下标 -> 已写入的 chunk id 列表
+        for chunk_id in written_ids:
+            written.setdefault(owner_of[chunk_id], []).append(chunk_id)
+
+        dedup_index = self._get_dedup_index()
+        if failed and dedup_index is not None:
+            # 指向写入失败的 chunk 的引用同样视为失败
+            failed.update(dedup_index.discard(failed))
+        if failed:
+            for idx, plan in pending:
+                file_failed = [row for row in plan['chunk_rows'] if row[1] in failed]
+                if file_failed and results[idx]["error"] is None:
+                    # 清单只记录写入成功的 chunk，并清空内容哈希，使下次导入时重新比对并补写
+                    print(f"文件 {results[idx]['filepath']} 有 {len(file_failed)} 个 chunk 写入失败，下次导入时将重试")
+                    plan['chunk_rows'] = [row for row in plan['chunk_rows'] if row[1] not in failed]
+                    plan['content_hash'] = ""
+                    results[idx]["failed_chunks"] = len(file_failed)
+
+        for idx, plan in pending:
+            if results[idx]["error"] is None:
+                try:
+                    self._apply_plan(plan)
+                    continue
+                except Exception as e:
+                    results[idx]["error"] = str(e)
+
+            # 回滚出错文件中已写入的新 chunk，清单未更新，下次导入时会重新处理
+            try:
+                if dedup_index is not None:
+                    # 先移除本文件的引用和未写入的 chunk，避免回滚时它们被提升为原始 chunk
+                    file_written = set(written.get(idx, []))
+                    dedup_index.discard(plan.get('ref_ids', []) +
+                                        [chunk_id for chunk_id in plan['new_ids'] if chunk_id not in file_written])
+                if idx in written:
+                    self._delete_chunks(written[idx])
+            except Exception as e:
+                print(f"回滚文件 {results[idx]['filepath']} 时出错: {str(e)}")
+            results[idx]["file_id"] = None
+      
+    @_writes
+    def delItem(self, file_id: str):
+          """
+          根据文件ID删除知识库中的文件内容
+          
+          Args:
+              file_id: 文件唯一标识符，由addItem方法返回
+
+          Returns:
+              删除的 chunk 数量
+          """
+          return self.delItems([file_id])["chunks"]
+
+    @_writes
+    def delItems(self, file_ids: List[str], batch_size: int = 1000) -> Dict[str, int]:
+        """
+        批量删除多个文件的内容，chunk 按 batch_size 分批读取 id 并删除，不读取文本
+
+        Args:
+            file_ids: 文件唯一标识符列表
+            batch_size: 每批删除的 chunk 数量
+
+        Returns:
+            包含 files（删除的文件数）和 chunks（删除的 chunk 数）的字典
+        """
+        found = set()
+        deleted = 0
+        # 文件ID分组后用 $in 条件删除，避免单个条件过长
+        for start in range(0, len(file_ids), 100):
+            group = list(file_ids[start:start + 100])
+            for ids, metadatas in self._delete_matching({"file_id": {"$in": group}}, batch_size):
+                deleted += len(ids)
+                found.update(metadata.get('file_id') for metadata in metadatas)
+            # 同时移除导入清单中的记录，这会使知识库代数加一
+            found.update(self._get_manifest().remove_files(group))
+        self._refresh_routes(batch_size)
+        return {"files": len(found), "chunks": deleted}
+
+    @_writes
+    def delWhere(self, where: Dict[str, Any], batch_size: int = 1000) -> Dict[str, int]:
+        """
+        删除所有满足 metadata 条件的 chunk，例如税则修订后整章下架：delWhere({"chapter": "85"})
+
+        只删除了文件的一部分 chunk 时，该文件的清单记录会被标记为已变化，再次导入时补回缺失的 chunk。
+
+        Args:
+            where: metadata 过滤条件，不能为空
+            batch_size: 每批删除的 chunk 数量
+
+        Returns:
+            包含 files（chunk 已全部删除的文件数）和 chunks（删除的 chunk 数）的字典
+        """
+        if not where:
+            raise ValueError("delWhere 需要非空的过滤条件")
+
+        removed_files = []
+        deleted = 0
+        for ids, metadatas in self._delete_matching(where, batch_size):
+            deleted += len(ids)
+            by_file = {}
+            for chunk_id, metadata in zip(ids, metadatas):
+                by_file.setdefault(metadata.get('file_id'), []).append(chunk_id)
+            removed_files.extend(self._get_manifest().remove_chunks(by_file))
+        self._refresh_routes(batch_size)
+        return {"files": len(set(removed_files)), "chunks": deleted}
+
+    def _delete_matching(self, where: Dict[str, Any],
+                         batch_size: int) -> Iterator[Tuple[List[str], List[Dict[str, Any]]]]:
+        """
+        分批删除满足条件的 chunk，并同步更新路由索引、编码索引和倒排索引
+
+        只读取 id 和元数据，不读取文本和向量；涉及的类/章质心标记为待重算，由调用方在删除完成后用
+        _refresh_routes 只读取这些类/章下的 chunk 重新计算。按类分片的知识库删除整个类时直接删除其分片。
+
+        Args:
+            where: metadata 过滤条件
+            batch_size: 每批删除的 chunk 数量
+
+        Returns:
+            每批被删除的 (chunk id 列表, 元数据列表) 的迭代器
+        """
+        if self.collection is None:
+            return
+        dedup_index = self._get_dedup_index()
+        if dedup_index is not None:
+            # 先删除满足条件的引用，避免它们在删除原始 chunk 时被提升
+            references = dedup_index.matching(where)
+            if references:
+                dedup_index.discard([ref['id'] for ref in references])
+                yield [ref['id'] for ref in references], [ref['metadata'] for ref in references]
+
+        route_index = self._get_route_index()
+        section = self._whole_section(where)
+        if section is not None:
+            dropped = yield from self._drop_section_shard(section, batch_size)
+            if dropped:
+                return
+        while True:
+            batch = self.collection.get(where=where, limit=batch_size, include=["metadatas"])
+            if not batch['ids']:
+                break
+            self._promote_references(batch['ids'])
+            route_index.invalidate(batch['metadatas'])
+            self._get_code_index().remove(batch['ids'])
+            self._get_lexical_index().remove(batch['ids'])
+            self.collection.delete(ids=batch['ids'])
+            if dedup_index is not None:
+                dedup_index.discard(batch['ids'])
+            yield batch['ids'], batch['metadatas']
+
+    def _whole_section(self, where: Dict[str, Any]) -> Optional[str]:
+        """
+        按类分片的知识库中，过滤条件恰好选中一个完整的类时返回该类编号，否则返回 None
+
+        Args:
+            where: metadata 过滤条件，形如 {"section": x} 或 {"section": {"$eq": x}}
+        """
+        if not self.properties.get('sharded', False) or list(where) != ["section"]:
+            return None
+        condition = where["section"]
+        if isinstance(condition, dict):
+            if list(condition) != ["$eq"]:
+                return None
+            condition = condition["$eq"]
+        return condition if isinstance(condition, str) else None
+
+    def _drop_section_shard(self, section: str,
+                            batch_size: int) -> Iterator[Tuple[List[str], List[Dict[str, Any]]]]:
+        """
+        删除一个类的整个分片，不逐条删除向量；路由、编码、倒排和去重索引照常更新
+
+        分片名相同的其他类（类编号只在特殊字符上不同）也存放在该分片中时不做任何修改，返回 False，
+        由调用方逐条删除。
+
+        Args:
+            section: 类编号
+            batch_size: 每次读取的 chunk 数量
+
+        Returns:
+            每批被删除的 (chunk id 列表, 元数据列表) 的迭代器；生成器的返回值表示是否删除了分片
+        """
+        from sharded_collection import shard_key
+
+        collection = self.collection
+        key = shard_key(section)
+        shard = collection.shard(key)
+        if shard is None:
+            return True
+
+        batches = []
+        offset = 0
+        while True:
+            batch = shard.get(limit=batch_size, offset=offset, include=["metadatas"])
+            if not batch['ids']:
+                break
+            if any((metadata or {}).get('section') != section for metadata in batch['metadatas']):
+                return False
+            batches.append(batch)
+            offset += len(batch['ids'])
+
+        # 同一类的引用与原始 chunk 属于同一去重范围，已由调用方先行删除，无需提升
+        route_index = self._get_route_index()
+        dedup_index = self._get_dedup_index()
+        for batch in batches:
+            route_index.invalidate(batch['metadatas'])
+            self._get_code_index().remove(batch['ids'])
+            self._get_lexical_index().remove(batch['ids'])
+            if dedup_index is not None:
+                dedup_index.discard(batch['ids'])
+        collection.remove_shard(key)
+        self._drop_index(f"{self.properties['name']}-section-{key}")
+        for batch in batches:
+            yield batch['ids'], batch['metadatas']
+        return True
+
+    def list(self, limit: Optional[int] = None, offset: int = 0, source_file: Optional[str] = None,
+             ingested_after: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        列出知识库中的文件及其 chunk 数量
+
+        结果来自导入清单中的文件目录，无需扫描 collection；升级前创建的知识库在首次调用时
+        从 collection 重建目录。
+
+        Args:
+            limit: 返回的最大数量，None 表示全部
+            offset: 跳过的数量，用于分页
+            source_file: 源文件名过滤，支持 * 和 ? 通配符，例如 "16*.txt"
+            ingested_after: 只返回该时间戳（秒）之后导入的文件
+
+        Returns:
+            包含文件信息的列表，按源文件名排序，每个元素包含：
+                - file_id: 文件唯一标识符
+                - source_file: 源文件名
+                - chunk_count: 该文件的 chunk 数量
+                - source_path: 源文件路径（升级前导入的文件为 None）
+                - content_hash: 文件内容哈希（升级前导入的文件为 None）
+                - ingested_at: 导入时间戳（重建目录得到的记录为 None）
+        """
+        manifest = self._get_manifest()
+        if not manifest.catalog_ready():
+            if self.read_only:
+                raise ValueError("文件目录尚未建立，请先以写入模式打开知识库调用 rebuild_catalog()")
+            self.rebuild_catalog()
+        return manifest.list_files(limit=limit, offset=offset, source_file=source_file,
+                                   ingested_after=ingested_after)
+
+    @_writes
+    def rebuild_catalog(self, batch_size: int = 1000):
+        """
+        从 collection 中重新统计每个文件的 chunk 数量，重建文件目录
+
+        Args:
+            batch_size: 每次从 collection 读取的 chunk 数量
+        """
+        file_stats = {}
+        if self.collection is not None and self.collection.count() > 0:
+            for batch in self._iter_collection(["metadatas"], batch_size):
+                for metadata in batch['metadatas']:
+                    file_id = metadata.get('file_id')
+                    if file_id not in file_stats:
+                        file_stats[file_id] = [metadata.get('source_file', ''), 0]
+                    file_stats[file_id][1] += 1
+        # 近似重复的引用不在 collection 中，同样计入所属文件
+        dedup_index = self._get_dedup_index()
+        if dedup_index is not None:
+            for ref in dedup_index.matching({}):
+                file_id = ref['metadata'].get('file_id')
+                if file_id not in file_stats:
+                    file_stats[file_id] = [ref['metadata'].get('source_file', ''), 0]
+                file_stats[file_id][1] += 1
+        self._get_manifest().rebuild_catalog(
+            [(file_id, source_file, chunk_count) for file_id, (source_file, chunk_count) in file_stats.items()]
+        )
+
+    def query(self, text: str, top_k: int = 5, where: Optional[Dict[str, Any]] = None,
+              mode: str = "vector", route_sections: int = 2, route_chapters: int = 4,
+              exact: Optional[bool] = None, include: Optional[List[str]] = None,
+              min_score: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        输入自然语言查询字符串
+        
+        Args:
+            text: 查询文本
+            top_k: 返回结果数量
+            where: metadata 过滤条件，例如 {"section": "11"} 或 {"chapter": "45"}
+            mode: 检索模式:
+                  - "vector": 在全部 chunk 中做向量检索
+                  - "routed": 先按类/章质心打分，只在得分最高的若干章及其所属类的类级 chunk 中检索
+                  - "hybrid": 向量检索与字符二元组 BM25 检索的结果做倒数排名融合，
+                    对"非针织或非钩编"等专有措辞的召回更稳定
+                  - "lexical": 只做 BM25 检索，无需向量化
+            route_sections: routed 模式下保留的类数
+            route_chapters: routed 模式下保留的章数
+            exact: HS 编码精确查找。None（默认）时，查询文本只由编码组成（如 "8471"、"CH85"、"第十一类"）
+                   则直接从编码索引返回对应 chunk，无需向量化，找不到时退回向量检索；
+                   True 时只要文本中含有编码就只做精确查找；False 时始终做向量检索
+            include: 结果中包含的字段，可选 "ids"、"scores"、"metadata"、"text"，
+                     默认为 ["text", "metadata"]；不需要全文时省略 "text"，之后可用 get_texts 按 id 读取
+            min_score: 得分下限，低于该值的结果在读取文本和元数据之前被丢弃（得分含义见 SCORE_KINDS）
+            
+        Returns:
+            结构化结果列表，每个元素按 include 包含 id、score、metadata、text 字段
+        """
+        return self.query_many([text], top_k=top_k, where=where, mode=mode,
+                               route_sections=route_sections, route_chapters=route_chapters,
+                               exact=exact, include=include, min_score=min_score)[0]
+
+    def query_many(self, texts: List[str], top_k: int = 5, where: Optional[Dict[str, Any]] = None,
+                   mode: str = "vector", route_sections: int = 2, route_chapters: int = 4,
+                   exact: Optional[bool] = None, include: Optional[List[str]] = None,
+                   min_score: Optional[float] = None) -> List[List[Dict[str, Any]]]:
+        """
+        批量查询：所有查询文本一次性向量化，并通过一次 Chroma 查询完成检索
+        
+        Args:
+            texts: 查询文本列表
+            top_k: 每个查询返回的结果数量
+            where: metadata 过滤条件，对所有查询生效
+            mode: 检索模式，见 query
+            route_sections: routed 模式下保留的类数
+            route_chapters: routed 模式下保留的章数
+            exact: HS 编码精确查找，见 query
+            include: 结果中包含的字段，见 query
+            min_score: 得分下限，见 query
+            
+        Returns:
+            与 texts 一一对应的结构化结果列表
+        """
+        if not texts:
+            return []
+        if mode not in ("vector", "routed", "hybrid", "lexical"):
+            raise ValueError(f"不支持的查询模式: {mode}")
+        include = tuple(QUERY_INCLUDE_DEFAULT if include is None else include)
+        unknown = [field for field in include if field not in QUERY_FIELDS]
+        if unknown:
+            raise ValueError(f"不支持的 include 字段: {unknown}")
+
+        extra = () if mode == "vector" else (mode, route_sections, route_chapters)
+        if exact is not None:
+            extra += ("exact", exact)
+        if include != QUERY_INCLUDE_DEFAULT or min_score is not None:
+            extra += ("include", ",".join(sorted(include)), min_score)
+
+        # 知识库内容变化后缓存整体失效
+        self._query_cache.sync(self._sync_generation())
+        keys = [QueryCache.make_key(text, top_k, where, *extra) for text in texts]
+        all_results = [self._query_cache.get(key) for key in keys]
+        missing = [q for q, cached in enumerate(all_results) if cached is None]
+        if not missing:
+            return all_results
+
+        # 不需要文本和元数据时，检索阶段只取 id 和得分
+        fields = {QUERY_FIELDS[field] for field in include} & {"text", "metadata"}
+        # 有得分下限时先按得分过滤，再读取文本和元数据
+        prefetch = set() if min_score is not None else fields
+
+        # 编码查询直接走精确索引，不需要向量化
+        rows_by_query = {}
+        if exact is not False:
+            remaining = []
+            for q in missing:
+                codes, pure = parse_query_codes(texts[q])
+                if codes and (pure or exact):
+                    rows = self._lookup_codes(codes, top_k, where, prefetch)
+                    if rows or exact:
+                        rows_by_query[q] = rows
+                        continue
+                remaining.append(q)
+            missing_search = remaining
+        else:
+            missing_search = missing
+
+        if missing_search:
+            searched = self._query_uncached([texts[q] for q in missing_search], top_k, where,
+                                            mode, route_sections, route_chapters, prefetch)
+            rows_by_query.update(zip(missing_search, searched))
+
+        queries = list(rows_by_query)
+        if min_score is not None:
+            for q in queries:
+                rows_by_query[q] = [row for row in rows_by_query[q] if row["score"] >= min_score]
+        formatted = self._materialize([rows_by_query[q] for q in queries], include, fields)
+        for q, formatted_results in zip(queries, formatted):
+            all_results[q] = formatted_results
+            self._query_cache.put(keys[q], formatted_results)
+
+        return all_results
+
+    def get_texts(self, ids: List[str]) -> List[Optional[str]]:
+        """
+        按 chunk id 读取文本，用于 query 时省略了 "text" 字段、之后只需要部分结果全文的场景
+
+        Args:
+            ids: chunk id 列表
+
+        Returns:
+            与 ids 一一对应的文本，不存在的 id 为 None
+        """
+        if not ids:
+            return []
+        self._sync_generation()
+        found = self.collection.get(ids=list(ids), include=["documents"])
+        texts = dict(zip(found['ids'], found['documents']))
+        dedup_index = self._get_dedup_index()
+        if dedup_index is not None:
+            for ref in dedup_index.get([chunk_id for chunk_id in ids if chunk_id not in texts]):
+                texts[ref['id']] = ref['document']
+        return [texts.get(chunk_id) for chunk_id in ids]
+
+    def _get_executor(self, write: bool = False) -> ThreadPoolExecutor:
+        """
+        获取异步接口使用的线程池，首次使用时创建
+
+        查询使用 async_workers 个线程；写入使用单独的单线程线程池，按提交顺序依次执行，不占用查询线程。
+
+        Args:
+            write: 是否获取写入线程池
+        """
+        with self._executor_lock:
+            if write:
+                if self._write_executor is None:
+                    self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kb-async-write")
+                return self._write_executor
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._async_workers, thread_name_prefix="kb-async")
+            return self._executor
+
+    async def _run_async(self, write: bool, timeout: Optional[float], fn, *args, **kwargs):
+        """
+        在线程池中执行阻塞调用并等待结果，不阻塞事件循环
+
+        调用被取消或超时时，尚未开始执行的任务直接从线程池中撤销；已经开始的任务无法中断，
+        会在后台执行完毕，结果被丢弃。
+
+        Args:
+            write: 是否提交到写入线程池
+            timeout: 超时时间（秒），None 表示不限
+            fn: 阻塞函数
+            *args, **kwargs: 传给 fn 的参数
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._get_executor(write), functools.partial(fn, *args, **kwargs))
+        return await asyncio.wait_for(future, timeout)
+
+    async def aquery(self, text: str, top_k: int = 5, where: Optional[Dict[str, Any]] = None,
+                     timeout: Optional[float] = None, **options) -> List[Dict[str, Any]]:
+        """
+        query 的异步版本，向量化和检索在线程池中执行
+
+        Args:
+            text: 查询文本
+            top_k: 返回结果数量
+            where: metadata 过滤条件
+            timeout: 超时时间（秒），超时抛出 asyncio.TimeoutError
+            **options: query 的其他参数（mode、exact、include、min_score 等）
+
+        Returns:
+            同 query
+        """
+        return await self._run_async(False, timeout, self.query, text, top_k, where, **options)
+
+    async def aquery_many(self, texts: List[str], top_k: int = 5, where: Optional[Dict[str, Any]] = None,
+                          timeout: Optional[float] = None, **options) -> List[List[Dict[str, Any]]]:
+        """
+        query_many 的异步版本，参数同 aquery
+        """
+        return await self._run_async(False, timeout, self.query_many, texts, top_k, where, **options)
+
+    async def aaddItem(self, filepath: str, metadata: Dict[str, Any], timeout: Optional[float] = None,
+                       **options) -> str:
+        """
+        addItem 的异步版本，写入按提交顺序依次执行
+
+        超时或取消时，尚未开始的写入不会执行；已经开始的写入会完整执行，保证知识库状态一致。
+
+        Args:
+            filepath: 文件路径
+            metadata: 文件元数据
+            timeout: 超时时间（秒），超时抛出 asyncio.TimeoutError
+            **options: addItem 的其他参数（batch_size、write_queue_size）
+
+        Returns:
+            同 addItem
+        """
+        return await self._run_async(True, timeout, self.addItem, filepath, metadata, **options)
+
+    async def aaddItems(self, filepaths: List[str], metadatas: List[Dict[str, Any]],
+                        timeout: Optional[float] = None, **options) -> List[Dict[str, Any]]:
+        """
+        addItems 的异步版本，参数和取消语义同 aaddItem
+        """
+        return await self._run_async(True, timeout, self.addItems, filepaths, metadatas, **options)
+
+    def _materialize(self, all_rows: List[List[Dict[str, Any]]], include: Tuple[str, ...],
+                     fields: set) -> List[List[Dict[str, Any]]]:
+        """
+        为最终结果补齐文本和元数据，并按 include 输出字段
+
+        所有查询中尚缺字段的结果合并为一次 collection.get 读取。
+
+        Args:
+            all_rows: 每个查询的结果行，每行至少包含 id 和 score
+            include: query 的 include 参数
+            fields: 需要的 "text"、"metadata" 字段
+
+        Returns:
+            与 all_rows 一一对应的结果列表
+        """
+        missing_ids = list(dict.fromkeys(
+            row["id"] for rows in all_rows for row in rows if any(field not in row for field in fields)
+        ))
+        if missing_ids:
+            get_include = [field for field, name in (("documents", "text"), ("metadatas", "metadata")) if name in fields]
+            found = self.collection.get(ids=missing_ids, include=get_include)
+            loaded = {}
+            for i, chunk_id in enumerate(found['ids']):
+                loaded[chunk_id] = {
+                    "text": found['documents'][i] if "text" in fields else None,
+                    "metadata": found['metadatas'][i] if "metadata" in fields else None,
+                }
+            for rows in all_rows:
+                for row in rows:
+                    for field in fields:
+                        if field not in row:
+                            row[field] = loaded.get(row["id"], {}).get(field)
+
+        return [[{QUERY_FIELDS[field]: row[QUERY_FIELDS[field]] for field in include} for row in rows]
+                for rows in all_rows]
+
+    def _fetch_ranked(self, ranked_ids, n: int, where: Optional[Dict[str, Any]],
+                      fields: set = frozenset()) -> List[Dict[str, Any]]:
+        """
+        按给定顺序分页取前 n 个满足 where 条件的 chunk
+
+        Args:
+            ranked_ids: 函数 (limit, offset) -> 按相关性排列的 (chunk id, 得分) 列表
+            n: 返回结果数量
+            where: metadata 过滤条件
+            fields: 需要同时读取的 "text"、"metadata" 字段；没有过滤条件时不读取，留给 _materialize
+
+        Returns:
+            包含 id、score 以及 fields 中字段的结果列表，保持 ranked_ids 的顺序
+        """
+        if where is None:
+            return [{"id": chunk_id, "score": score} for chunk_id, score in ranked_ids(n, 0)]
+
+        include = [field for field, name in (("documents", "text"), ("metadatas", "metadata")) if name in fields]
+        page_size = max(n * 4, 64)
         formatted_results = []
-        for i in range(len(results['ids'][0])):
-            result = {
-                "text": results['documents'][0][i],
-                "metadata": results['metadatas'][0][i],
+        offset = 0
+        while len(formatted_results) < n:
+            page = ranked_ids(page_size, offset)
+            if not page:
+                break
+            offset += len(page)
+
+            found = self.collection.get(ids=[chunk_id for chunk_id, _ in page], where=where, include=include)
+            rows = {}
+            for i, chunk_id in enumerate(found['ids']):
+                row = {}
+                if "text" in fields:
+                    row["text"] = found['documents'][i]
+                if "metadata" in fields:
+                    row["metadata"] = found['metadatas'][i]
+                rows[chunk_id] = row
+            for chunk_id, score in page:
+                if chunk_id in rows and len(formatted_results) < n:
+                    formatted_results.append({"id": chunk_id, "score": score, **rows[chunk_id]})
+
+        return formatted_results
+
+    def _lookup_codes(self, codes: List[str], top_k: int, where: Optional[Dict[str, Any]],
+                      fields: set = frozenset()) -> List[Dict[str, Any]]:
+        """
+        通过编码索引查找 chunk
+
+        Args:
+            codes: parse_query_codes 返回的规范化编码
+            top_k: 返回结果数量
+            where: metadata 过滤条件
+            fields: 需要同时读取的字段，见 _fetch_ranked
+
+        Returns:
+            结果行列表，按编码顺序、元数据匹配优先排列，精确匹配的得分为 1.0
+        """
+        code_index = self._get_code_index()
+        return self._fetch_ranked(
+            lambda limit, offset: [(chunk_id, 1.0) for chunk_id in code_index.lookup(codes, limit=limit, offset=offset)],
+            top_k, where, fields
+        )
+
+    def _route_filters(self, query_embeddings: List[List[float]], where: Optional[Dict[str, Any]],
+                       route_sections: int, route_chapters: int) -> List[Optional[Dict[str, Any]]]:
+        """
+        为每个查询生成 routed 模式的过滤条件
+
+        条件为：属于得分最高的章，或属于得分最高的类且不属于任何章（类注释等类级 chunk），
+        并与用户提供的 where 条件取交集。路由索引为空时退化为 where 本身。
+
+        升级前创建的知识库在此自动重建质心，上次删除中断时遗留的待重算质心在此补算；查询不等待写锁，
+        其他线程或进程正在写入时跳过，待重算的类/章不参与本次路由。
+        """
+        route_index = self._get_route_index()
+        rebuild = route_index.is_empty() and not self.read_only and self.collection.count() > 0
+        if rebuild or (route_index.stale_keys() and not self.read_only):
+            with self._try_writing() as locked:
+                if locked and rebuild:
+                    self.rebuild_routes()
+                elif locked:
+                    self._refresh_routes()
+
+        filters = []
+        for sections, chapters in route_index.route(query_embeddings, route_sections, route_chapters):
+            if not sections:
+                filters.append(where)
+                continue
+            route = {"section": {"$in": sections}}
+            if chapters and self.properties.get('sharded', False):
+                # 选出的章都属于选出的类，条件写成先限定类的形式，分片 collection 据此只检索这些类的分片
+                route = {"$and": [route, {"$or": [{"chapter": {"$in": chapters}}, {"chapter": ""}]}]}
+            elif chapters:
+                route = {"$or": [
+                    {"chapter": {"$in": chapters}},
+                    {"$and": [{"section": {"$in": sections}}, {"chapter": ""}]}
+                ]}
+            filters.append({"$and": [where, route]} if where else route)
+        return filters
+
+    def _search_vector(self, texts: List[str], n: int, where: Optional[Dict[str, Any]],
+                       mode: str = "vector", route_sections: int = 2, route_chapters: int = 4,
+                       fields: set = frozenset()) -> List[List[Dict[str, Any]]]:
+        """
+        向量化查询文本并检索，routed 模式下先按类/章路由
+
+        得分为余弦相似度：向量已归一化，由平方 L2 距离换算为 1 - 距离 / 2
+        """
+        # 批量向量化查询文本；查询文本不经过 embedding 缓存，重复查询由查询结果缓存处理，
+        # 避免每次查询都写入或更新缓存，也避免查询文本挤出 chunk 的向量
+        query_embeddings = self._encode(texts)
+
+        # 按过滤条件分组，条件相同的查询合并为一次检索
+        if mode == "routed":
+            filters = self._route_filters(query_embeddings, where, route_sections, route_chapters)
+        else:
+            filters = [where] * len(texts)
+        groups = {}
+        for q, query_filter in enumerate(filters):
+            groups.setdefault(json.dumps(query_filter, sort_keys=True), (query_filter, []))[1].append(q)
+
+        include = ["distances"] + [field for field, name in (("documents", "text"), ("metadatas", "metadata"))
+                                   if name in fields]
+        all_results = [None] * len(texts)
+        for query_filter, group in groups.values():
+            # 构建查询参数
+            query_params = {
+                "query_embeddings": [query_embeddings[q] for q in group],
+                "n_results": n,
+                "include": include
             }
-            formatted_results.append(result)
-            
-        return formatted_results
\ No newline at end of file
+
+            # 如果有过滤条件，则添加到查询参数中
+            if query_filter is not None:
+                query_params["where"] = query_filter
+
+            # 执行查询
+            results = self.collection.query(**query_params)
+
+            # 构建返回结果
+            for i, q in enumerate(group):
+                rows = []
+                for j, (chunk_id, distance) in enumerate(zip(results['ids'][i], results['distances'][i])):
+                    row = {"id": chunk_id, "score": 1.0 - float(distance) / 2}
+                    if "text" in fields:
+                        row["text"] = results['documents'][i][j]
+                    if "metadata" in fields:
+                        row["metadata"] = results['metadatas'][i][j]
+                    rows.append(row)
+                all_results[q] = rows
+
+        return all_results
+
+    def _search_lexical(self, texts: List[str], n: int, where: Optional[Dict[str, Any]],
+                        fields: set = frozenset()) -> List[List[Dict[str, Any]]]:
+        """
+        用字符二元组倒排索引做 BM25 检索，不调用 embedding 模型；得分为 BM25 分数
+        """
+        lexical_index = self._get_lexical_index()
+        all_results = []
+        for text in texts:
+            ranked = lexical_index.search(text)
+            all_results.append(self._fetch_ranked(lambda limit, offset: ranked[offset:offset + limit],
+                                                  n, where, fields))
+        return all_results
+
+    def _query_uncached(self, texts: List[str], top_k: int, where: Optional[Dict[str, Any]],
+                        mode: str = "vector", route_sections: int = 2, route_chapters: int = 4,
+                        fields: set = frozenset()) -> List[List[Dict[str, Any]]]:
+        """
+        不经过查询缓存，直接检索
+
+        Returns:
+            每个查询的结果行，包含 id、score 以及 fields 中已经读取的字段
+        """
+        if mode == "lexical":
+            return self._search_lexical(texts, top_k, where, fields)
+        if mode == "hybrid":
+            # 两路各取更深的候选，只保留 id 和得分，融合后再读取所需字段
+            depth = max(top_k * 4, 20)
+            vector_results = self._search_vector(texts, depth, where)
+            lexical_results = self._search_lexical(texts, depth, where)
+            return [reciprocal_rank_fusion([vector_rows, lexical_rows], top_k)
+                    for vector_rows, lexical_rows in zip(vector_results, lexical_results)]
+        return self._search_vector(texts, top_k, where, mode, route_sections, route_chapters, fields)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+知识库查询服务（kb_server.py）的客户端
+
+接口与 kb 的同名方法一致，可以代替 kb 实例传给 agent.Agent 和 cli_client.KBCLI。
+只依赖标准库，不加载 chromadb 和模型。
+"""
+
+import json
+import urllib.error
+import urllib.request
+from typing import List, Dict, Any, Optional
+
+
+class KBClient:
+    """
+    知识库查询服务客户端
+    """
+
+    def __init__(self, url: str = "http://127.0.0.1:8765", timeout: float = 60.0):
+        """
+        初始化客户端
+
+        Args:
+            url: 服务地址
+            timeout: 请求超时时间（秒）
+        """
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def _request(self, route: str, body: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        发送请求
+
+        Args:
+            route: 接口路径
+            body: 请求参数，None 时发送 GET 请求
+
+        Returns:
+            响应内容
+
+        Raises:
+            ValueError: 请求参数错误
+            PermissionError: 服务以只读模式运行时请求修改知识库
+            RuntimeError: 服务端处理出错
+        """
+        data = None if body is None else json.dumps(body, ensure_ascii=False).encode("utf-8")
+        request = urllib.request.Request(self.url + route, data=data,
+                                         headers={"Content-Type": "application/json; charset=utf-8"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get("error", str(e))
+            except ValueError:
+                message = str(e)
+            if e.code == 400:
+                raise ValueError(message) from None
+            if e.code == 403:
+                raise PermissionError(message) from None
+            raise RuntimeError(message) from None
+
+    def health(self) -> bool:
+        """
+        检查服务是否可用
+
+        Returns:
+            服务是否正常响应
+        """
+        try:
+            return self._request("/health").get("status") == "ok"
+        except (OSError, RuntimeError, ValueError):
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取服务的请求合并统计、查询缓存统计和模型注册表统计
+
+        Returns:
+            包含 batcher、query_cache、models 的字典
+        """
+        return self._request("/stats")
+
+    def query(self, text: str, top_k: int = 5, where: Optional[Dict[str, Any]] = None,
+              **options) -> List[Dict[str, Any]]:
+        """
+        查询知识库，参数和返回值同 kb.query
+
+        并发的单条查询在服务端合并为一次批量检索。
+        """
+        return self._request("/query", {"text": text, "top_k": top_k, "where": where, **options})["results"]
+
+    def query_many(self, texts: List[str], top_k: int = 5, where: Optional[Dict[str, Any]] = None,
+                   **options) -> List[List[Dict[str, Any]]]:
+        """
+        批量查询，参数和返回值同 kb.query_many
+        """
+        return self._request("/query_many", {"texts": texts, "top_k": top_k, "where": where,
+                                             **options})["results"]
+
+    def get_texts(self, ids: List[str]) -> List[Optional[str]]:
+        """
+        按 chunk id 读取文本，同 kb.get_texts
+        """
+        return self._request("/get_texts", {"ids": ids})["texts"]
+
+    def list(self, limit: Optional[int] = None, offset: int = 0, source_file: Optional[str] = None,
+             ingested_after: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        列出知识库中的文件，同 kb.list
+        """
+        return self._request("/list", {"limit": limit, "offset": offset, "source_file": source_file,
+                                       "ingested_after": ingested_after})["files"]
+
+    def delItem(self, file_id: str) -> int:
+        """
+        删除文件，同 kb.delItem
+
+        Returns:
+            删除的 chunk 数量
+        """
+        return self._request("/delItem", {"file_id": file_id})["chunks"]
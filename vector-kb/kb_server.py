@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+常驻的知识库查询服务
+
+进程启动时加载一次模型，通过本地 HTTP 接口对外提供查询。短时间内并发到达的单条 query 请求
+在一个窗口内合并为一次 query_many，只做一次批量向量化和一次检索。
+
+启动:
+    python kb_server.py -p /path/to/kb --port 8765 --max-batch 32 --max-wait-ms 5
+
+客户端见 kb_client.KBClient。
+"""
+
+import json
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import List, Dict, Any, Optional
+
+import model_registry
+from kb import kb
+
+
+# query 请求中除 text 外的参数及默认值，参数全部相同的请求合并为一次 query_many
+QUERY_OPTIONS = {
+    "top_k": 5,
+    "where": None,
+    "mode": "vector",
+    "route_sections": 2,
+    "route_chapters": 4,
+    "exact": None,
+    "include": None,
+    "min_score": None,
+}
+
+
+class QueryBatcher:
+    """
+    请求合并器：在 max_wait 秒内收集最多 max_batch 条 query 请求，按参数分组后各执行一次 query_many
+    """
+
+    def __init__(self, kb_instance: kb, max_batch: int = 32, max_wait: float = 0.005):
+        """
+        初始化请求合并器并启动后台线程
+
+        Args:
+            kb_instance: 知识库实例
+            max_batch: 一批最多合并的请求数
+            max_wait: 收到一批中第一条请求后最多等待的时间（秒）
+        """
+        self.kb = kb_instance
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait)
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._requests = 0
+        self._batches = 0
+        self._largest_batch = 0
+        self._thread = threading.Thread(target=self._run, name="kb-query-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str, **options) -> Future:
+        """
+        提交一条查询
+
+        Args:
+            text: 查询文本
+            **options: query 的其他参数，见 QUERY_OPTIONS
+
+        Returns:
+            结果的 Future
+        """
+        unknown = [name for name in options if name not in QUERY_OPTIONS]
+        if unknown:
+            raise ValueError(f"不支持的查询参数: {unknown}")
+        future = Future()
+        self._queue.put((text, {**QUERY_OPTIONS, **options}, future))
+        return future
+
+    def query(self, text: str, timeout: Optional[float] = None, **options) -> List[Dict[str, Any]]:
+        """
+        提交一条查询并等待结果，参数同 kb.query
+        """
+        return self.submit(text, **options).result(timeout)
+
+    def _run(self):
+        """后台线程：收集一批请求并执行"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            self._process(batch)
+            if stop:
+                return
+
+    def _process(self, batch):
+        """按参数分组执行一批请求"""
+        groups = {}
+        for text, options, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            key = json.dumps(options, sort_keys=True, ensure_ascii=False)
+            groups.setdefault(key, (options, []))[1].append((text, future))
+
+        for options, requests in groups.values():
+            try:
+                results = self.kb.query_many([text for text, _ in requests], **options)
+            except Exception as e:
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(requests, results):
+                future.set_result(result)
+
+        with self._stats_lock:
+            self._requests += len(batch)
+            self._batches += 1
+            self._largest_batch = max(self._largest_batch, len(batch))
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取合并统计
+
+        Returns:
+            包含 requests、batches、avg_batch、largest_batch、max_batch、max_wait 的字典
+        """
+        with self._stats_lock:
+            return {
+                "requests": self._requests,
+                "batches": self._batches,
+                "avg_batch": self._requests / self._batches if self._batches else 0.0,
+                "largest_batch": self._largest_batch,
+                "max_batch": self.max_batch,
+                "max_wait": self.max_wait,
+            }
+
+    def close(self):
+        """处理完已提交的请求后停止后台线程"""
+        self._queue.put(None)
+        self._thread.join()
+
+
+class KBServer:
+    """
+    知识库 HTTP 查询服务
+
+    接口（请求和响应均为 JSON）:
+    - GET  /health
+    - GET  /stats
+    - POST /query       {"text", "top_k", "where", "mode", ..., "include", "min_score"} -> {"results"}
+    - POST /query_many  {"texts", ...} -> {"results"}
+    - POST /get_texts   {"ids"} -> {"texts"}
+    - POST /list        {"limit", "offset", "source_file", "ingested_after"} -> {"files"}
+    - POST /delItem     {"file_id"} -> {"chunks"}
+    """
+
+    def __init__(self, path: str, host: str = "127.0.0.1", port: int = 8765,
+                 max_batch: int = 32, max_wait: float = 0.005, **kb_kwargs):
+        """
+        打开知识库并加载模型
+
+        Args:
+            path: 知识库路径
+            host: 监听地址
+            port: 监听端口，0 表示随机分配
+            max_batch: 一批最多合并的 query 请求数
+            max_wait: 合并窗口（秒）
+            **kb_kwargs: 传给 kb 的其他参数，例如 query_cache_size、read_only
+        """
+        self.kb = kb(path, preload=True, **kb_kwargs)
+        if self.kb.is_new or 'model' not in self.kb.properties:
+            raise ValueError(f"路径 '{path}' 下没有知识库")
+        self.kb.wait_until_ready()
+
+        self.batcher = QueryBatcher(self.kb, max_batch, max_wait)
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        """服务地址"""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _call(self, route: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        执行一个接口
+
+        Args:
+            route: 接口路径
+            body: 请求参数
+
+        Returns:
+            响应内容
+        """
+        if route == "/query":
+            text = body.pop("text")
+            return {"results": self.batcher.query(text, **body)}
+        if route == "/query_many":
+            texts = body.pop("texts")
+            return {"results": self.kb.query_many(texts, **body)}
+        if route == "/get_texts":
+            return {"texts": self.kb.get_texts(body["ids"])}
+        if route == "/list":
+            return {"files": self.kb.list(**body)}
+        if route == "/delItem":
+            return {"chunks": self.kb.delItem(body["file_id"])}
+        raise LookupError(route)
+
+    def _handler_class(self):
+        """生成绑定到本服务的请求处理类"""
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, status: int, payload: Dict[str, Any]):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path == "/health":
+                    self._reply(200, {"status": "ok"})
+                elif self.path == "/stats":
+                    self._reply(200, {"batcher": server.batcher.stats(),
+                                      "query_cache": server.kb.query_cache_stats(),
+                                      "models": model_registry.stats()})
+                else:
+                    self._reply(404, {"error": f"未知接口: {self.path}"})
+
+            def do_POST(self):
+                try:
+                    length = int(self.headers.get("Content-Length") or 0)
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                    self._reply(200, server._call(self.path, body))
+                except LookupError:
+                    self._reply(404, {"error": f"未知接口: {self.path}"})
+                except PermissionError as e:
+                    self._reply(403, {"error": str(e)})
+                except (ValueError, KeyError, TypeError) as e:
+                    self._reply(400, {"error": f"请求参数错误: {str(e)}"})
+                except Exception as e:
+                    print(f"处理请求 {self.path} 时出错: {str(e)}")
+                    self._reply(500, {"error": str(e)})
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def serve_forever(self):
+        """处理请求，直到调用 shutdown"""
+        self.httpd.serve_forever()
+
+    def start(self) -> threading.Thread:
+        """
+        在后台线程中处理请求
+
+        Returns:
+            服务线程
+        """
+        thread = threading.Thread(target=self.serve_forever, name="kb-server", daemon=True)
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        """停止服务，保存查询缓存并释放模型"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.batcher.close()
+        self.kb.close()
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="知识库查询服务")
+    parser.add_argument('-p', '--path', required=True, help='知识库路径')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址，默认 127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765, help='监听端口，默认 8765')
+    parser.add_argument('--max-batch', type=int, default=32, help='一批最多合并的查询数，默认 32')
+    parser.add_argument('--max-wait-ms', type=float, default=5.0, help='合并窗口（毫秒），默认 5')
+    parser.add_argument('--read-only', action='store_true', help='以只读模式打开知识库，可与写入进程及其他服务进程同时运行')
+    parser.add_argument('--model-idle-timeout', type=float, default=None,
+                        help='模型空闲多久（秒）后卸载以释放内存，下次查询时重新加载；默认不卸载')
+    args = parser.parse_args()
+
+    if args.model_idle_timeout is not None:
+        model_registry.configure(args.model_idle_timeout, unload_referenced=True)
+
+    server = KBServer(args.path, args.host, args.port, args.max_batch, args.max_wait_ms / 1000,
+                      read_only=args.read_only)
+    print(f"知识库查询服务已启动: {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
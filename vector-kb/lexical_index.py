@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+中文字符二元组（bigram）倒排索引与 BM25 检索，以及多路检索结果的倒数排名融合（RRF）
+
+连续的汉字切分为相邻两字组成的二元组（单个汉字保留为一元组），字母和数字按词切分，
+例如 "非针织或非钩编的 T-shirt" -> 非针 针织 织或 或非 非钩 钩编 编的 t shirt。
+"""
+
+import re
+import math
+import threading
+from collections import Counter
+from typing import List, Dict, Any, Tuple
+
+from embedding_cache import normalize_text
+from concurrency import connect_sqlite
+
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# RRF 平滑常数
+RRF_K = 60
+
+_TOKEN_PATTERN = re.compile(r"[㐀-䶿一-鿿豈-﫿]+|[a-z0-9]+(?:\.[0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    将文本切分为检索词
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        检索词列表（保留重复，用于计算词频）
+    """
+    tokens = []
+    for run in _TOKEN_PATTERN.findall(normalize_text(text).lower()):
+        if run[0].isascii():
+            tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def reciprocal_rank_fusion(rankings: List[List[Dict[str, Any]]], top_k: int, k: int = RRF_K) -> List[Dict[str, Any]]:
+    """
+    倒数排名融合：每个结果的得分为其在各路结果中 1 / (k + 排名) 之和
+
+    Args:
+        rankings: 多路检索结果，每路为按相关性排序、带有 id 字段的结果列表
+        top_k: 返回结果数量
+        k: 平滑常数
+
+    Returns:
+        融合后的前 top_k 个结果，score 字段为融合得分
+    """
+    scores = {}
+    rows = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking):
+            scores[row["id"]] = scores.get(row["id"], 0.0) + 1.0 / (k + rank + 1)
+            rows.setdefault(row["id"], row)
+    fused = sorted(scores, key=lambda chunk_id: scores[chunk_id], reverse=True)[:top_k]
+    return [{**rows[chunk_id], "score": scores[chunk_id]} for chunk_id in fused]
+
+
+class LexicalIndex:
+    """
+    基于 SQLite 的倒排索引，使用 BM25 打分
+    """
+
+    def __init__(self, path: str, read_only: bool = False):
+        """
+        初始化倒排索引
+
+        Args:
+            path: 索引数据库文件路径
+            read_only: 是否以只读方式打开已有的索引
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(path, read_only)
+        if not read_only:
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS postings ("
+                "  term TEXT NOT NULL,"
+                "  chunk_id TEXT NOT NULL,"
+                "  tf INTEGER NOT NULL,"
+                "  length INTEGER NOT NULL,"
+                "  PRIMARY KEY (term, chunk_id)"
+                ") WITHOUT ROWID;"
+                "CREATE INDEX IF NOT EXISTS postings_chunk ON postings (chunk_id);"
+                "CREATE TABLE IF NOT EXISTS terms ("
+                "  term TEXT PRIMARY KEY,"
+                "  df INTEGER NOT NULL"
+                ") WITHOUT ROWID;"
+                "CREATE TABLE IF NOT EXISTS docs ("
+                "  chunk_id TEXT PRIMARY KEY,"
+                "  length INTEGER NOT NULL"
+                ") WITHOUT ROWID;"
+            )
+            self._conn.commit()
+
+    def _remove(self, ids: List[str]):
+        """删除一批 chunk 的倒排记录，调用方需持有锁并处于事务中"""
+        for chunk_id in ids:
+            terms = self._conn.execute("SELECT term FROM postings WHERE chunk_id = ?", (chunk_id,)).fetchall()
+            if not terms:
+                continue
+            self._conn.executemany("UPDATE terms SET df = df - 1 WHERE term = ?", terms)
+            self._conn.execute("DELETE FROM postings WHERE chunk_id = ?", (chunk_id,))
+            self._conn.execute("DELETE FROM docs WHERE chunk_id = ?", (chunk_id,))
+        self._conn.execute("DELETE FROM terms WHERE df <= 0")
+
+    def add(self, ids: List[str], documents: List[str]):
+        """
+        索引一批 chunk，已存在的 chunk 会先被移除再重新索引
+
+        Args:
+            ids: chunk id 列表
+            documents: chunk 文本列表
+        """
+        postings = []
+        terms = Counter()
+        docs = []
+        for chunk_id, document in zip(ids, documents):
+            tokens = tokenize(document or "")
+            counts = Counter(tokens)
+            postings.extend((term, chunk_id, tf, len(tokens)) for term, tf in counts.items())
+            terms.update(counts.keys())
+            docs.append((chunk_id, len(tokens)))
+
+        with self._lock, self._conn:
+            self._remove(ids)
+            self._conn.executemany(
+                "INSERT INTO postings (term, chunk_id, tf, length) VALUES (?, ?, ?, ?)", postings
+            )
+            self._conn.executemany(
+                "INSERT INTO terms (term, df) VALUES (?, ?) ON CONFLICT(term) DO UPDATE SET df = df + excluded.df",
+                list(terms.items())
+            )
+            self._conn.executemany("INSERT INTO docs (chunk_id, length) VALUES (?, ?)", docs)
+
+    def remove(self, ids: List[str]):
+        """
+        移除一批 chunk 的索引
+
+        Args:
+            ids: chunk id 列表
+        """
+        with self._lock, self._conn:
+            self._remove(ids)
+
+    def search(self, text: str) -> List[Tuple[str, float]]:
+        """
+        用 BM25 为包含查询词的 chunk 打分
+
+        Args:
+            text: 查询文本
+
+        Returns:
+            按得分从高到低排列的 (chunk_id, 得分) 列表
+        """
+        query_terms = Counter(tokenize(text))
+        if not query_terms:
+            return []
+
+        scores = {}
+        with self._lock:
+            n_docs, total_length = self._conn.execute("SELECT COUNT(*), SUM(length) FROM docs").fetchone()
+            if not n_docs:
+                return []
+            avg_length = total_length / n_docs
+
+            for term, query_tf in query_terms.items():
+                row = self._conn.execute("SELECT df FROM terms WHERE term = ?", (term,)).fetchone()
+                if row is None:
+                    continue
+                df = row[0]
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                for chunk_id, tf, length in self._conn.execute(
+                        "SELECT chunk_id, tf, length FROM postings WHERE term = ?", (term,)):
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                    score = query_tf * idf * tf * (BM25_K1 + 1) / (tf + norm)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + score
+
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+    def clear(self):
+        """清空索引"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM postings")
+            self._conn.execute("DELETE FROM terms")
+            self._conn.execute("DELETE FROM docs")
+
+    def stats(self) -> Dict[str, int]:
+        """
+        获取索引的统计信息
+
+        Returns:
+            包含 docs（chunk 数）、terms（检索词数）的字典
+        """
+        with self._lock:
+            docs = self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+            terms = self._conn.execute("SELECT COUNT(*) FROM terms").fetchone()[0]
+        return {"docs": docs, "terms": terms}
+
+    def close(self):
+        """关闭数据库连接"""
+        self._conn.close()
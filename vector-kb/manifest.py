@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+知识库导入清单：记录 源文件路径 -> 内容哈希 -> 文件ID -> 各 chunk 哈希 的对应关系，
+以及供 kb.list() 使用的文件目录（文件ID、源文件、chunk 数、内容哈希、导入时间）
+"""
+
+import time
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+
+from concurrency import connect_sqlite
+
+
+class Manifest:
+    """
+    基于 SQLite 的导入清单
+
+    用于判断文件是否变化，以及变化后哪些 chunk 需要新增、更新或删除。
+    清单同时维护知识库的代数（generation），每次写入或删除文件记录时加一，
+    供查询缓存等判断知识库内容是否发生变化。
+
+    文件目录（catalog 表）与清单记录在同一事务中写入和删除，列出文件时无需扫描 collection。
+    升级前创建的知识库中存在清单之外的文件，目录在 catalog_ready 标记为 1 之前需要由调用方
+    从 collection 重建（见 rebuild_catalog）。
+
+    这些文件的清单记录同样由调用方从 collection 回填（见 backfill_files），回填的记录没有源文件路径，
+    再次导入同名文件时由 get_unclaimed 认领，之后按路径查找。
+    """
+
+    def __init__(self, path: str, read_only: bool = False):
+        """
+        初始化导入清单
+
+        Args:
+            path: 清单数据库文件路径
+            read_only: 是否以只读方式打开已有的清单
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(path, read_only)
+        if not read_only:
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "  source_path TEXT PRIMARY KEY,"
+                "  file_id TEXT UNIQUE NOT NULL,"
+                "  source_file TEXT NOT NULL,"
+                "  content_hash TEXT NOT NULL,"
+                "  metadata TEXT NOT NULL"
+                ");"
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                "  file_id TEXT NOT NULL,"
+                "  chunk_key TEXT NOT NULL,"
+                "  chunk_id TEXT NOT NULL,"
+                "  chunk_index INTEGER NOT NULL,"
+                "  PRIMARY KEY (file_id, chunk_key)"
+                ");"
+                "CREATE TABLE IF NOT EXISTS meta ("
+                "  key TEXT PRIMARY KEY,"
+                "  value INTEGER NOT NULL"
+                ");"
+                "CREATE TABLE IF NOT EXISTS catalog ("
+                "  file_id TEXT PRIMARY KEY,"
+                "  source_path TEXT,"
+                "  source_file TEXT NOT NULL,"
+                "  chunk_count INTEGER NOT NULL,"
+                "  content_hash TEXT,"
+                "  ingested_at REAL"
+                ");"
+                "CREATE INDEX IF NOT EXISTS catalog_source_file ON catalog (source_file);"
+                "INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0);"
+                "INSERT OR IGNORE INTO meta (key, value) VALUES ('catalog_ready', 0);"
+                "INSERT OR IGNORE INTO meta (key, value) VALUES ('backfilled', 0);"
+            )
+            self._conn.commit()
+
+    def _bump_generation(self):
+        """代数加一，调用方需在事务中调用"""
+        self._conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+
+    def generation(self) -> int:
+        """
+        获取知识库当前代数
+
+        Returns:
+            代数，每次写入或删除文件记录时加一
+        """
+        with self._lock:
+            return self._conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+
+    def bump_generation(self):
+        """在不修改清单的情况下使代数加一，例如直接修改了 collection 时"""
+        with self._lock, self._conn:
+            self._bump_generation()
+
+    def _load(self, row) -> Optional[Dict[str, Any]]:
+        """将 files 表中的一行与其 chunk 记录组装为字典"""
+        if row is None:
+            return None
+        source_path, file_id, source_file, content_hash, metadata = row
+        chunk_rows = self._conn.execute(
+            "SELECT chunk_key, chunk_id, chunk_index FROM chunks WHERE file_id = ?", (file_id,)
+        ).fetchall()
+        return {
+            "source_path": source_path,
+            "file_id": file_id,
+            "source_file": source_file,
+            "content_hash": content_hash,
+            "metadata": metadata,
+            "chunks": {key: (chunk_id, index) for key, chunk_id, index in chunk_rows},
+        }
+
+    def get_by_path(self, source_path: str) -> Optional[Dict[str, Any]]:
+        """
+        按源文件路径查找清单记录
+
+        Args:
+            source_path: 源文件的绝对路径
+
+        Returns:
+            包含 file_id、content_hash、metadata、chunks 等字段的字典，不存在时为 None；
+            chunks 为 chunk 哈希 -> (chunk_id, chunk_index) 的映射
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT source_path, file_id, source_file, content_hash, metadata "
+                "FROM files WHERE source_path = ?", (source_path,)
+            ).fetchone()
+            return self._load(row)
+
+    def get_unclaimed(self, source_file: str, metadata: str) -> Optional[Dict[str, Any]]:
+        """
+        查找回填的、尚未被认领的同名文件记录，元数据相同的记录优先
+
+        Args:
+            source_file: 源文件名
+            metadata: JSON 序列化后的文件元数据
+
+        Returns:
+            与 get_by_path 相同格式的字典（source_path 和 content_hash 为空），不存在时为 None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT source_path, file_id, source_file, content_hash, metadata "
+                "FROM files WHERE source_path IS NULL AND source_file = ? "
+                "ORDER BY metadata = ? DESC, file_id LIMIT 1", (source_file, metadata)
+            ).fetchone()
+            return self._load(row)
+
+    def file_ids(self) -> set:
+        """
+        获取清单中记录的全部文件ID
+
+        Returns:
+            文件ID集合
+        """
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT file_id FROM files")}
+
+    def files_in_section(self, section: str) -> List[Dict[str, Any]]:
+        """
+        查找文件元数据中 section 为指定类的文件记录
+
+        Args:
+            section: 类编号
+
+        Returns:
+            包含 source_path、file_id、source_file、content_hash、metadata 的字典列表（不含 chunks），按源文件名排序
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source_path, file_id, source_file, content_hash, metadata FROM files "
+                "WHERE json_extract(metadata, '$.section') = ? ORDER BY source_file, file_id", (section,)
+            ).fetchall()
+        keys = ("source_path", "file_id", "source_file", "content_hash", "metadata")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def backfilled(self) -> bool:
+        """升级前导入的文件是否已回填到清单（新建的知识库或已调用过 backfill_files）"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'backfilled'").fetchone()
+            return row is not None and row[0] == 1
+
+    def backfill_files(self, files: List[Tuple[str, str, str, List[Tuple[str, str, int]]]]):
+        """
+        回填升级前导入、没有清单记录的文件，并将清单标记为已回填；不改变代数
+
+        源文件路径未知，记为 NULL（SQLite 中非 INTEGER 的主键允许为 NULL），内容哈希为空，
+        再次导入时按 chunk 哈希比对，只写入变化的部分。已有记录的文件ID被忽略。
+
+        Args:
+            files: (file_id, 源文件名, JSON 序列化后的文件元数据, (chunk 哈希, chunk_id, chunk_index) 列表) 列表
+        """
+        with self._lock, self._conn:
+            for file_id, source_file, metadata, chunks in files:
+                inserted = self._conn.execute(
+                    "INSERT OR IGNORE INTO files (source_path, file_id, source_file, content_hash, metadata) "
+                    "VALUES (NULL, ?, ?, '', ?)", (file_id, source_file, metadata)
+                ).rowcount
+                if inserted:
+                    self._conn.executemany(
+                        "INSERT OR IGNORE INTO chunks (file_id, chunk_key, chunk_id, chunk_index) VALUES (?, ?, ?, ?)",
+                        [(file_id, key, chunk_id, index) for key, chunk_id, index in chunks]
+                    )
+            self._conn.execute("UPDATE meta SET value = 1 WHERE key = 'backfilled'")
+
+    def mark_backfilled(self):
+        """新建的知识库没有需要回填的文件，直接将清单标记为已回填"""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE meta SET value = 1 WHERE key = 'backfilled'")
+
+    def save_file(self, source_path: str, file_id: str, source_file: str, content_hash: str,
+                  metadata: str, chunks: List[Tuple[str, str, int]]):
+        """
+        在一个事务中写入（或覆盖）一个文件的清单记录；同一文件ID的回填记录被替换
+
+        Args:
+            source_path: 源文件的绝对路径
+            file_id: 文件唯一标识符
+            source_file: 源文件名
+            content_hash: 文件内容哈希
+            metadata: JSON 序列化后的文件元数据
+            chunks: (chunk 哈希, chunk_id, chunk_index) 列表
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (source_path, file_id, source_file, content_hash, metadata) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (source_path, file_id, source_file, content_hash, metadata)
+            )
+            self._conn.execute("DELETE FROM chunks WHERE file_id = ?", (file_id,))
+            self._conn.executemany(
+                "INSERT INTO chunks (file_id, chunk_key, chunk_id, chunk_index) VALUES (?, ?, ?, ?)",
+                [(file_id, key, chunk_id, index) for key, chunk_id, index in chunks]
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO catalog "
+                "(file_id, source_path, source_file, chunk_count, content_hash, ingested_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (file_id, source_path, source_file, len(chunks), content_hash, time.time())
+            )
+            self._bump_generation()
+
+    def remove_files(self, file_ids: List[str]) -> List[str]:
+        """
+        在一个事务中删除多个文件的清单记录，代数只加一
+
+        Args:
+            file_ids: 文件唯一标识符列表
+
+        Returns:
+            确实存在清单或目录记录的文件ID列表
+        """
+        removed = []
+        with self._lock, self._conn:
+            for file_id in file_ids:
+                found = self._conn.execute("DELETE FROM files WHERE file_id = ?", (file_id,)).rowcount
+                self._conn.execute("DELETE FROM chunks WHERE file_id = ?", (file_id,))
+                found += self._conn.execute("DELETE FROM catalog WHERE file_id = ?", (file_id,)).rowcount
+                if found:
+                    removed.append(file_id)
+            self._bump_generation()
+        return removed
+
+    def remove_chunks(self, chunk_ids: Dict[str, List[str]]) -> List[str]:
+        """
+        记录按条件删除的部分 chunk
+
+        文件的 chunk 全部被删除时同时删除文件记录；只删除了一部分时清空内容哈希，
+        使下次导入同一文件时重新比对并补回缺失的 chunk。
+
+        Args:
+            chunk_ids: 文件ID -> 被删除的 chunk id 列表
+
+        Returns:
+            chunk 已全部删除、记录已移除的文件ID列表
+        """
+        removed = []
+        with self._lock, self._conn:
+            for file_id, ids in chunk_ids.items():
+                self._conn.executemany("DELETE FROM chunks WHERE file_id = ? AND chunk_id = ?",
+                                       [(file_id, chunk_id) for chunk_id in ids])
+                self._conn.execute("UPDATE catalog SET chunk_count = chunk_count - ? WHERE file_id = ?",
+                                   (len(ids), file_id))
+                in_manifest = self._conn.execute("SELECT 1 FROM files WHERE file_id = ?", (file_id,)).fetchone()
+                remaining = self._conn.execute("SELECT COUNT(*) FROM chunks WHERE file_id = ?",
+                                               (file_id,)).fetchone()[0]
+                catalog_row = self._conn.execute("SELECT chunk_count FROM catalog WHERE file_id = ?",
+                                                 (file_id,)).fetchone()
+                if (in_manifest and remaining == 0) or (not in_manifest and catalog_row and catalog_row[0] <= 0):
+                    self._conn.execute("DELETE FROM files WHERE file_id = ?", (file_id,))
+                    self._conn.execute("DELETE FROM catalog WHERE file_id = ?", (file_id,))
+                    removed.append(file_id)
+                else:
+                    self._conn.execute("UPDATE files SET content_hash = '' WHERE file_id = ?", (file_id,))
+                    self._conn.execute("UPDATE catalog SET content_hash = NULL WHERE file_id = ?", (file_id,))
+            self._bump_generation()
+        return removed
+
+    def catalog_ready(self) -> bool:
+        """文件目录是否已完整（新建的知识库或已调用过 rebuild_catalog）"""
+        with self._lock:
+            return self._conn.execute("SELECT value FROM meta WHERE key = 'catalog_ready'").fetchone()[0] == 1
+
+    def rebuild_catalog(self, files: List[Tuple[str, str, int]]):
+        """
+        用从 collection 统计出的文件列表重建文件目录，源文件路径和内容哈希从清单记录中补全
+
+        Args:
+            files: (file_id, source_file, chunk_count) 列表
+        """
+        with self._lock, self._conn:
+            # 已有目录记录的导入时间保留下来
+            ingested = dict(self._conn.execute("SELECT file_id, ingested_at FROM catalog").fetchall())
+            self._conn.execute("DELETE FROM catalog")
+            self._conn.executemany(
+                "INSERT INTO catalog (file_id, source_path, source_file, chunk_count, content_hash, ingested_at) "
+                "SELECT ?, f.source_path, ?, ?, f.content_hash, ? "
+                "FROM (SELECT 1) LEFT JOIN files f ON f.file_id = ?",
+                [(file_id, source_file, chunk_count, ingested.get(file_id), file_id)
+                 for file_id, source_file, chunk_count in files]
+            )
+            self._conn.execute("UPDATE meta SET value = 1 WHERE key = 'catalog_ready'")
+
+    def mark_catalog_ready(self):
+        """新建的知识库没有需要补录的文件，直接将文件目录标记为完整"""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE meta SET value = 1 WHERE key = 'catalog_ready'")
+
+    def list_files(self, limit: Optional[int] = None, offset: int = 0, source_file: Optional[str] = None,
+                   ingested_after: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        分页列出文件目录
+
+        Args:
+            limit: 返回的最大数量，None 表示不限
+            offset: 跳过的数量
+            source_file: 源文件名过滤，支持 * 和 ? 通配符（SQLite GLOB），例如 "16*.txt"
+            ingested_after: 只返回该时间戳（秒）之后导入的文件
+
+        Returns:
+            文件信息列表，按源文件名和文件ID排序
+        """
+        conditions = []
+        params = []
+        if source_file is not None:
+            conditions.append("source_file GLOB ?")
+            params.append(source_file)
+        if ingested_after is not None:
+            conditions.append("ingested_at > ?")
+            params.append(ingested_after)
+        sql = ("SELECT file_id, source_path, source_file, chunk_count, content_hash, ingested_at FROM catalog"
+               + (" WHERE " + " AND ".join(conditions) if conditions else "")
+               + " ORDER BY source_file, file_id LIMIT ? OFFSET ?")
+        params.extend([-1 if limit is None else limit, offset])
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [
+            {"file_id": file_id, "source_file": source_file, "chunk_count": chunk_count,
+             "source_path": source_path, "content_hash": content_hash, "ingested_at": ingested_at}
+            for file_id, source_path, source_file, chunk_count, content_hash, ingested_at in rows
+        ]
+
+    def close(self):
+        """关闭数据库连接"""
+        self._conn.close()
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+进程内共享的 embedding 模型注册表
+
+同一进程中打开多个知识库（例如按税则年份、按客户分开的知识库）时，使用相同模型配置的实例
+共用一个已加载的后端，而不是各自加载一份。注册表按 embedding_backends.backend_key 生成的键
+记录每个模型的引用计数：知识库首次向量化时获取引用，close() 或被回收时归还。
+
+引用计数归零后超过 idle_timeout 秒未被使用的模型会被卸载并从注册表中移除，期间重新打开的知识库可以直接复用。
+仍被引用的模型默认不卸载；以 unload_referenced=True 配置时，它们空闲超时后同样卸载，下一次向量化时重新加载。
+"""
+
+import gc
+import os
+import time
+import threading
+from typing import List, Dict, Any, Optional, Tuple, Callable
+
+
+# 默认的空闲卸载时间（秒）
+DEFAULT_IDLE_TIMEOUT = 600.0
+
+
+def _process_rss() -> Optional[int]:
+    """读取当前进程的常驻内存（字节），不支持的平台返回 None"""
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def _memory_bytes(model) -> Optional[int]:
+    """调用后端的 memory_bytes 估算内存占用，后端不支持时返回 None"""
+    try:
+        return int(model.memory_bytes())
+    except Exception:
+        return None
+
+
+class _Entry:
+    """注册表中一个模型的状态和使用统计"""
+
+    def __init__(self, key: Tuple, loader: Callable):
+        self.key = key
+        self.loader = loader
+        self.model = None
+        self.load_lock = threading.Lock()
+        self.refs = 0
+        self.active = 0
+        self.memory_bytes = None
+        self.loads = 0
+        self.unloads = 0
+        self.load_seconds = 0.0
+        self.encode_calls = 0
+        self.encoded_texts = 0
+        self.encode_seconds = 0.0
+        self.last_used = time.time()
+
+
+class ModelRegistry:
+    """
+    按模型配置共享 embedding 后端，带引用计数和空闲卸载
+    """
+
+    def __init__(self, idle_timeout: Optional[float] = DEFAULT_IDLE_TIMEOUT, unload_referenced: bool = False):
+        """
+        初始化注册表
+
+        Args:
+            idle_timeout: 不再被引用的模型空闲多久（秒）后卸载；None 表示引用计数归零时立即卸载
+            unload_referenced: 仍被引用的模型空闲超过 idle_timeout 后是否也卸载（下一次向量化时重新加载）；
+                               idle_timeout 为 None 时不生效
+        """
+        self.idle_timeout = idle_timeout
+        self.unload_referenced = unload_referenced
+        self._entries = {}  # 键 -> _Entry
+        self._lock = threading.Lock()
+        self._reaper = None
+        self._reaper_wakeup = threading.Event()
+
+    def configure(self, idle_timeout: Optional[float], unload_referenced: bool = False):
+        """
+        修改空闲卸载策略，对已加载的模型同样生效
+
+        Args:
+            idle_timeout: 同 __init__
+            unload_referenced: 同 __init__
+        """
+        self.idle_timeout = idle_timeout
+        self.unload_referenced = unload_referenced
+        self._reaper_wakeup.set()
+        self.collect()
+
+    def acquire(self, key: Tuple, loader: Callable):
+        """
+        获取一个模型的引用，模型在首次 get 或 encode 时才加载
+
+        Args:
+            key: 模型配置的键
+            loader: 无参数的加载函数，返回具有 encode(texts) 方法的后端；已注册的键沿用首次注册的加载函数
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry(key, loader)
+            entry.refs += 1
+        self._start_reaper()
+
+    def release(self, key: Tuple):
+        """
+        归还一个模型的引用
+
+        Args:
+            key: acquire 时使用的键
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.refs == 0:
+                return
+            entry.refs -= 1
+            entry.last_used = time.time()
+        self.collect()
+
+    def _entry(self, key: Tuple) -> _Entry:
+        """获取已注册的模型，未 acquire 时抛出 KeyError"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry.refs == 0:
+            raise KeyError(f"模型未注册: {key}")
+        return entry
+
+    def _load(self, entry: _Entry):
+        """确保模型已加载并返回，同一模型并发调用时只加载一次"""
+        model = entry.model
+        if model is not None:
+            return model
+        with entry.load_lock:
+            if entry.model is None:
+                start = time.perf_counter()
+                model = entry.loader()
+                seconds = time.perf_counter() - start
+                memory = _memory_bytes(model)
+                with self._lock:
+                    entry.model = model
+                    entry.memory_bytes = memory
+                    entry.loads += 1
+                    entry.load_seconds = seconds
+                    entry.last_used = time.time()
+            return entry.model
+
+    def get(self, key: Tuple):
+        """
+        获取已加载的后端，被卸载的模型会重新加载
+
+        Args:
+            key: acquire 时使用的键
+
+        Returns:
+            后端实例
+        """
+        entry = self._entry(key)
+        model = self._load(entry)
+        with self._lock:
+            entry.last_used = time.time()
+        return model
+
+    def encode(self, key: Tuple, texts: List[str]) -> List[List[float]]:
+        """
+        使用共享的后端向量化并记录使用统计；向量化期间模型不会被卸载
+
+        Args:
+            key: acquire 时使用的键
+            texts: 文本列表
+
+        Returns:
+            对应的向量数组
+        """
+        entry = self._entry(key)
+        with self._lock:
+            entry.active += 1
+        start = time.perf_counter()
+        try:
+            return self._load(entry).encode(texts)
+        finally:
+            with self._lock:
+                entry.active -= 1
+                entry.encode_calls += 1
+                entry.encoded_texts += len(texts)
+                entry.encode_seconds += time.perf_counter() - start
+                entry.last_used = time.time()
+
+    def collect(self) -> int:
+        """
+        卸载空闲超时的模型（默认只卸载不再被引用的模型），移除无引用且已卸载的模型
+
+        Returns:
+            本次卸载的模型数量
+        """
+        now = time.time()
+        unloaded = 0
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry.active:
+                    continue
+                if self.idle_timeout is None:
+                    expired = entry.refs == 0
+                elif entry.refs > 0 and not self.unload_referenced:
+                    expired = False
+                else:
+                    expired = now - entry.last_used >= self.idle_timeout
+                if entry.model is not None and expired and not entry.load_lock.locked():
+                    entry.model = None
+                    entry.memory_bytes = None
+                    entry.unloads += 1
+                    unloaded += 1
+                if entry.model is None and entry.refs == 0 and not entry.load_lock.locked():
+                    del self._entries[key]
+        if unloaded:
+            gc.collect()
+        return unloaded
+
+    def _start_reaper(self):
+        """启动定期执行 collect 的后台线程"""
+        with self._lock:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(target=self._run_reaper, name="kb-model-reaper", daemon=True)
+        self._reaper.start()
+
+    def _run_reaper(self):
+        """后台线程：按空闲超时时间的四分之一（最长 30 秒）为间隔检查"""
+        while True:
+            timeout = self.idle_timeout
+            interval = 30.0 if timeout is None else min(max(timeout / 4, 0.05), 30.0)
+            self._reaper_wakeup.wait(interval)
+            self._reaper_wakeup.clear()
+            try:
+                self.collect()
+            except Exception as e:
+                print(f"卸载空闲模型时出错: {str(e)}")
+
+    def model_stats(self, key: Tuple) -> Optional[Dict[str, Any]]:
+        """
+        获取一个模型的使用统计
+
+        Args:
+            key: 模型配置的键
+
+        Returns:
+            统计字典（字段见 stats），模型未注册时为 None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            return None if entry is None else self._entry_stats(entry, time.time())
+
+    @staticmethod
+    def _entry_stats(entry: _Entry, now: float) -> Dict[str, Any]:
+        """生成单个模型的统计字典，调用方需持有锁"""
+        return {
+            "backend": entry.key[0],
+            "model": entry.key[1],
+            "refs": entry.refs,
+            "loaded": entry.model is not None,
+            "memory_bytes": entry.memory_bytes,
+            "loads": entry.loads,
+            "unloads": entry.unloads,
+            "load_seconds": entry.load_seconds,
+            "encode_calls": entry.encode_calls,
+            "encoded_texts": entry.encoded_texts,
+            "encode_seconds": entry.encode_seconds,
+            "idle_seconds": now - entry.last_used,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取注册表的统计信息
+
+        Returns:
+            包含 idle_timeout、unload_referenced、loaded（已加载的模型数）、memory_bytes（已加载模型的估算内存之和）、
+            process_rss_bytes（进程常驻内存，不支持的平台为 None）和 models（各模型的 backend、model、
+            refs、loaded、memory_bytes、loads、unloads、load_seconds、encode_calls、encoded_texts、
+            encode_seconds、idle_seconds）的字典
+        """
+        now = time.time()
+        with self._lock:
+            models = [self._entry_stats(entry, now) for entry in self._entries.values()]
+        loaded = [m for m in models if m["loaded"]]
+        return {
+            "idle_timeout": self.idle_timeout,
+            "unload_referenced": self.unload_referenced,
+            "loaded": len(loaded),
+            "memory_bytes": sum(m["memory_bytes"] or 0 for m in loaded),
+            "process_rss_bytes": _process_rss(),
+            "models": models,
+        }
+
+
+# 进程内默认的注册表，所有 kb 实例共用
+_registry = ModelRegistry()
+
+
+def get_registry() -> ModelRegistry:
+    """
+    获取进程内共用的模型注册表
+
+    Returns:
+        ModelRegistry 实例
+    """
+    return _registry
+
+
+def configure(idle_timeout: Optional[float] = DEFAULT_IDLE_TIMEOUT, unload_referenced: bool = False):
+    """
+    设置进程内共用注册表的空闲卸载策略
+
+    Args:
+        idle_timeout: 不再被任何知识库引用的模型空闲多久（秒）后卸载；None 表示引用计数归零时立即卸载
+        unload_referenced: 仍被引用的模型空闲超过 idle_timeout 后是否也卸载，默认 False（常驻服务不会因空闲而重新加载模型）
+    """
+    _registry.configure(idle_timeout, unload_referenced)
+
+
+def stats() -> Dict[str, Any]:
+    """
+    获取进程内共用注册表的统计信息，字段见 ModelRegistry.stats
+    """
+    return _registry.stats()
@@ -0,0 +1,684 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基于 NumPy 的精确检索索引，适用于向量数量在数万级别的小型知识库
+
+向量以 float32 或 float16 行优先存放在内存映射文件中，元数据以列的形式保存在内存里，
+检索是一次向量化的矩阵-向量乘法（批量查询时为矩阵乘法），过滤条件同样以向量化方式计算。
+
+NumpyCollection 实现了 kb 用到的 Chroma collection 接口子集（add/upsert/update/get/delete/query/count），
+返回值格式与 Chroma 一致，可直接替换 Chroma collection 使用。
+
+可选的压缩模式（int8 / pq，见 quantization.py）在内存中只保留压缩编码用于生成候选集，
+候选结果再从内存映射的原始向量中读取并精确重排。
+"""
+
+import os
+import json
+import threading
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from quantization import create_quantizer
+from concurrency import connect_sqlite
+
+
+# 分块计算相似度时每块的行数，避免 float16 矩阵整体转换为 float32
+BLOCK_ROWS = 16384
+
+# 已删除行占比超过该值时压缩向量文件
+COMPACT_RATIO = 0.3
+
+# 乘积量化在行数达到该值时自动训练，训练前使用精确检索
+PQ_MIN_TRAIN = 1024
+
+# 乘积量化训练时最多使用的样本数
+PQ_TRAIN_SIZE = 20000
+
+
+class NumpyCollection:
+    """
+    内存映射矩阵 + 元数据列存储的精确检索 collection
+    """
+
+    def __init__(self, path: str, name: str, dtype: str = "float32", compression: Optional[str] = None,
+                 pq_m: int = 64, rerank_factor: int = 4, read_only: bool = False):
+        """
+        打开（或创建）一个 collection
+
+        Args:
+            path: collection 数据目录
+            name: collection 名称
+            dtype: 向量存储精度，"float32" 或 "float16"，仅在首次创建时生效
+            compression: 候选集使用的压缩编码，None（精确检索）、"int8" 或 "pq"，仅在首次创建时生效
+            pq_m: 乘积量化的子空间个数（每个向量的编码字节数），仅在首次创建时生效
+            rerank_factor: 压缩模式下精确重排的候选数为 n_results 的倍数，越大召回率越高
+            read_only: 是否以只读方式打开已有的 collection，只读时不修改任何文件，写入方法抛出 PermissionError
+        """
+        self.path = path
+        self.name = name
+        self.rerank_factor = rerank_factor
+        self.read_only = read_only
+        if not read_only:
+            os.makedirs(path, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._config_path = os.path.join(path, "index.json")
+        self._vectors_path = os.path.join(path, "vectors.bin")
+        self._codes_path = os.path.join(path, "codes.bin")
+
+        if os.path.exists(self._config_path):
+            with open(self._config_path, 'r', encoding='utf-8') as f:
+                self._config = json.load(f)
+        elif read_only:
+            raise ValueError(f"collection {name} 不存在")
+        else:
+            if dtype not in ("float32", "float16"):
+                raise ValueError(f"不支持的向量精度: {dtype}")
+            if compression not in (None, "int8", "pq"):
+                raise ValueError(f"不支持的压缩方式: {compression}")
+            self._config = {"name": name, "dtype": dtype, "dim": None,
+                            "compression": compression, "pq_m": pq_m}
+            self._save_config()
+        self._dtype = np.dtype(self._config["dtype"])
+        self._quantizer = None
+        self._codes = None
+
+        self._conn = connect_sqlite(os.path.join(path, "rows.sqlite3"), read_only)
+        if not read_only:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS rows ("
+                "row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, document TEXT, metadata TEXT)"
+            )
+            self._conn.commit()
+        self._load()
+
+    # ------------------------------------------------------------------
+    # 加载与持久化
+    # ------------------------------------------------------------------
+
+    def _save_config(self):
+        """保存 index.json"""
+        with open(self._config_path, 'w', encoding='utf-8') as f:
+            json.dump(self._config, f, ensure_ascii=False, indent=2)
+
+    def _load(self):
+        """从磁盘加载行信息、元数据列和向量矩阵"""
+        dim = self._config["dim"]
+        n_rows = 0
+        if dim and os.path.exists(self._vectors_path):
+            n_rows = os.path.getsize(self._vectors_path) // (dim * self._dtype.itemsize)
+
+        self._ids = [None] * n_rows
+        self._id_to_row = {}
+        self._matrix = None
+        self._sq_norms = np.zeros(0, dtype=np.float32)
+        self._alive = np.zeros(n_rows, dtype=bool)
+        self._columns = {}
+        self._numeric_cache = {}
+
+        for row, chunk_id, metadata in self._conn.execute("SELECT row, id, metadata FROM rows"):
+            if row >= n_rows:
+                # 向量写入前中断留下的记录
+                continue
+            self._ids[row] = chunk_id
+            self._id_to_row[chunk_id] = row
+            self._alive[row] = True
+            for key, value in json.loads(metadata or "{}").items():
+                self._column(key, n_rows)[row] = value
+
+        self._remap(n_rows)
+        self._load_codes()
+
+    def _remap(self, n_rows: int):
+        """重新映射向量文件，并计算新增行的平方范数"""
+        dim = self._config["dim"]
+        if n_rows == 0:
+            self._matrix = None
+            self._sq_norms = np.zeros(0, dtype=np.float32)
+            return
+        self._matrix = np.memmap(self._vectors_path, dtype=self._dtype, mode='r' if self.read_only else 'r+',
+                                 shape=(n_rows, dim))
+        known = len(self._sq_norms)
+        sq_norms = np.empty(n_rows, dtype=np.float32)
+        sq_norms[:known] = self._sq_norms
+        for start in range(known, n_rows, BLOCK_ROWS):
+            block = np.asarray(self._matrix[start:start + BLOCK_ROWS], dtype=np.float32)
+            sq_norms[start:start + BLOCK_ROWS] = np.einsum('ij,ij->i', block, block)
+        self._sq_norms = sq_norms
+
+    def _load_codes(self):
+        """加载压缩编码，缺失的行（例如写入中断）重新编码补齐；只读时只在内存中补齐"""
+        self._codes = None
+        if not self._config.get("compression") or not self._config["dim"]:
+            return
+        if self._quantizer is None:
+            self._quantizer = create_quantizer(self._config["compression"], self._config["dim"],
+                                               self._config.get("pq_m", 64))
+            self._quantizer.load(self.path)
+        if not self._quantizer.trained:
+            return
+
+        width = self._quantizer.code_bytes
+        codes = np.zeros((0, width), dtype=np.uint8)
+        if os.path.exists(self._codes_path):
+            codes = np.fromfile(self._codes_path, dtype=np.uint8)
+            codes = codes[:len(codes) // width * width].reshape(-1, width)
+        if len(codes) > self._n_rows:
+            codes = codes[:self._n_rows]
+            if not self.read_only:
+                with open(self._codes_path, 'wb') as f:
+                    f.write(codes.tobytes())
+        elif len(codes) < self._n_rows:
+            missing = self._encode_rows(len(codes), self._n_rows)
+            if not self.read_only:
+                with open(self._codes_path, 'r+b' if os.path.exists(self._codes_path) else 'wb') as f:
+                    f.seek(len(codes) * width)
+                    f.write(missing.tobytes())
+                    f.truncate()
+            codes = np.concatenate([codes, missing])
+        self._codes = np.ascontiguousarray(codes)
+
+    def _encode_rows(self, start: int, end: int) -> np.ndarray:
+        """分块读取原始向量并编码"""
+        parts = [np.zeros((0, self._quantizer.code_bytes), dtype=np.uint8)]
+        for block_start in range(start, end, BLOCK_ROWS):
+            block = np.asarray(self._matrix[block_start:min(block_start + BLOCK_ROWS, end)], dtype=np.float32)
+            parts.append(self._quantizer.encode(block))
+        return np.concatenate(parts)
+
+    def train_quantizer(self, sample_size: int = PQ_TRAIN_SIZE):
+        """
+        用当前的向量（重新）训练乘积量化的聚类中心，并重新编码所有行
+
+        pq 模式在行数首次达到 PQ_MIN_TRAIN 时会自动训练；知识库规模明显增长后可手动调用以提高召回率。
+
+        Args:
+            sample_size: 最多使用的训练样本数
+        """
+        self._check_writable()
+        with self._lock:
+            if self._config.get("compression") != "pq" or self._matrix is None:
+                return
+            if self._quantizer is None:
+                self._quantizer = create_quantizer("pq", self._config["dim"], self._config.get("pq_m", 64))
+            rows = np.flatnonzero(self._alive)
+            if len(rows) < 256:
+                print("训练乘积量化至少需要 256 个向量")
+                return
+            if len(rows) > sample_size:
+                rows = np.sort(np.random.default_rng(0).choice(rows, sample_size, replace=False))
+            self._quantizer.train(np.asarray(self._matrix[rows], dtype=np.float32))
+            self._quantizer.save(self.path)
+            if os.path.exists(self._codes_path):
+                os.remove(self._codes_path)
+            self._load_codes()
+
+    def _column(self, key: str, n_rows: int) -> np.ndarray:
+        """获取（必要时创建）元数据列"""
+        column = self._columns.get(key)
+        if column is None:
+            column = np.full(n_rows, None, dtype=object)
+            self._columns[key] = column
+        return column
+
+    @property
+    def _n_rows(self) -> int:
+        return len(self._ids)
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+
+    def _check_writable(self):
+        """只读模式下拒绝写入"""
+        if self.read_only:
+            raise PermissionError(f"collection {self.name} 以只读模式打开")
+
+    def _append(self, ids: List[str], embeddings, documents, metadatas):
+        """追加新行，调用方需持有锁且保证 ids 均不存在"""
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim != 2:
+            raise ValueError("embeddings 必须是二维数组")
+        if self._config["dim"] is None:
+            self._config["dim"] = int(vectors.shape[1])
+            self._save_config()
+        elif vectors.shape[1] != self._config["dim"]:
+            raise ValueError(f"向量维度不一致: 期望 {self._config['dim']}，实际 {vectors.shape[1]}")
+
+        start = self._n_rows
+        documents = documents if documents is not None else [None] * len(ids)
+        metadatas = metadatas if metadatas is not None else [None] * len(ids)
+
+        # 先写 SQLite（未提交），再追加向量文件，最后提交，保证两者一致
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO rows (row, id, document, metadata) VALUES (?, ?, ?, ?)",
+                [(start + i, chunk_id, document, json.dumps(metadata or {}, ensure_ascii=False))
+                 for i, (chunk_id, document, metadata) in enumerate(zip(ids, documents, metadatas))]
+            )
+            with open(self._vectors_path, 'ab') as f:
+                f.write(vectors.astype(self._dtype).tobytes())
+
+        n_rows = start + len(ids)
+        self._ids.extend(ids)
+        self._alive = np.concatenate([self._alive, np.ones(len(ids), dtype=bool)])
+        for key in list(self._columns):
+            self._columns[key] = np.concatenate([self._columns[key], np.full(len(ids), None, dtype=object)])
+        for i, (chunk_id, metadata) in enumerate(zip(ids, metadatas)):
+            self._id_to_row[chunk_id] = start + i
+            for key, value in (metadata or {}).items():
+                self._column(key, n_rows)[start + i] = value
+        self._numeric_cache.clear()
+        self._remap(n_rows)
+
+        if self._config.get("compression"):
+            if self._codes is not None:
+                codes = self._quantizer.encode(vectors)
+                with open(self._codes_path, 'ab') as f:
+                    f.write(codes.tobytes())
+                self._codes = np.concatenate([self._codes, codes])
+            elif self._config["compression"] == "pq" and self.count() >= PQ_MIN_TRAIN:
+                self.train_quantizer()
+            else:
+                self._load_codes()
+
+    def add(self, ids: List[str], embeddings, documents: Optional[List[str]] = None,
+            metadatas: Optional[List[Dict[str, Any]]] = None, **kwargs):
+        """
+        添加向量，已存在的 id 会被忽略（与 Chroma 行为一致）
+        """
+        self._check_writable()
+        with self._lock:
+            keep = [i for i, chunk_id in enumerate(ids) if chunk_id not in self._id_to_row]
+            if len(keep) < len(ids):
+                print(f"忽略 {len(ids) - len(keep)} 个已存在的 id")
+            if not keep:
+                return
+            self._append(
+                [ids[i] for i in keep],
+                [embeddings[i] for i in keep],
+                [documents[i] for i in keep] if documents is not None else None,
+                [metadatas[i] for i in keep] if metadatas is not None else None,
+            )
+
+    def upsert(self, ids: List[str], embeddings, documents: Optional[List[str]] = None,
+               metadatas: Optional[List[Dict[str, Any]]] = None, **kwargs):
+        """
+        添加或覆盖向量
+        """
+        self._check_writable()
+        with self._lock:
+            existing = [chunk_id for chunk_id in ids if chunk_id in self._id_to_row]
+            if existing:
+                self._delete_ids(existing)
+            self._append(list(ids), embeddings, documents, metadatas)
+
+    def update(self, ids: List[str], embeddings=None, documents: Optional[List[str]] = None,
+               metadatas: Optional[List[Dict[str, Any]]] = None, **kwargs):
+        """
+        更新已存在的行，不存在的 id 会被忽略
+        """
+        self._check_writable()
+        with self._lock:
+            n_rows = self._n_rows
+            with self._conn:
+                for i, chunk_id in enumerate(ids):
+                    row = self._id_to_row.get(chunk_id)
+                    if row is None:
+                        continue
+                    if embeddings is not None:
+                        vector = np.asarray(embeddings[i], dtype=np.float32)
+                        self._matrix[row] = vector.astype(self._dtype)
+                        self._sq_norms[row] = float(vector @ vector)
+                        if self._codes is not None:
+                            self._codes[row] = self._quantizer.encode(vector[None, :])[0]
+                    if documents is not None:
+                        self._conn.execute("UPDATE rows SET document = ? WHERE row = ?", (documents[i], row))
+                    if metadatas is not None:
+                        # 与 Chroma 一致：新的元数据与原有元数据合并
+                        metadata = self._row_metadata(row)
+                        metadata.update(metadatas[i] or {})
+                        self._conn.execute(
+                            "UPDATE rows SET metadata = ? WHERE row = ?",
+                            (json.dumps(metadata, ensure_ascii=False), row)
+                        )
+                        for key, value in metadata.items():
+                            self._column(key, n_rows)[row] = value
+            if embeddings is not None and self._matrix is not None:
+                self._matrix.flush()
+                if self._codes is not None:
+                    with open(self._codes_path, 'wb') as f:
+                        f.write(self._codes.tobytes())
+            self._numeric_cache.clear()
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None, **kwargs):
+        """
+        按 id 或过滤条件删除
+        """
+        self._check_writable()
+        with self._lock:
+            if ids is None and where is None:
+                return
+            mask = self._alive.copy()
+            if where is not None:
+                mask &= self._where_mask(where)
+            if ids is not None:
+                id_mask = np.zeros(self._n_rows, dtype=bool)
+                rows = [self._id_to_row[i] for i in ids if i in self._id_to_row]
+                id_mask[rows] = True
+                mask &= id_mask
+            self._delete_ids([self._ids[row] for row in np.flatnonzero(mask)])
+
+    def _delete_ids(self, ids: List[str]):
+        """删除一组已存在的 id，调用方需持有锁"""
+        rows = [self._id_to_row.pop(chunk_id) for chunk_id in ids if chunk_id in self._id_to_row]
+        if not rows:
+            return
+        with self._conn:
+            self._conn.executemany("DELETE FROM rows WHERE row = ?", [(row,) for row in rows])
+        for row in rows:
+            self._ids[row] = None
+            self._alive[row] = False
+            for column in self._columns.values():
+                column[row] = None
+        self._numeric_cache.clear()
+
+        dead = self._n_rows - int(self._alive.sum())
+        if dead > 1000 and dead > self._n_rows * COMPACT_RATIO:
+            self.compact()
+
+    def compact(self):
+        """
+        压缩向量文件，移除已删除的行并重新编号
+        """
+        self._check_writable()
+        with self._lock:
+            rows = np.flatnonzero(self._alive)
+            tmp_path = self._vectors_path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                for start in range(0, len(rows), BLOCK_ROWS):
+                    f.write(np.asarray(self._matrix[rows[start:start + BLOCK_ROWS]]).tobytes())
+            if self._codes is not None:
+                with open(self._codes_path + ".tmp", 'wb') as f:
+                    f.write(self._codes[rows].tobytes())
+            with self._conn:
+                # 先整体偏移再写回新行号，避免主键冲突
+                offset = self._n_rows + 1
+                self._conn.execute("UPDATE rows SET row = row + ?", (offset,))
+                self._conn.executemany(
+                    "UPDATE rows SET row = ? WHERE row = ?",
+                    [(new_row, int(old_row) + offset) for new_row, old_row in enumerate(rows)]
+                )
+            self._matrix = None
+            os.replace(tmp_path, self._vectors_path)
+            if self._codes is not None:
+                os.replace(self._codes_path + ".tmp", self._codes_path)
+            self._load()
+
+    # ------------------------------------------------------------------
+    # 读取
+    # ------------------------------------------------------------------
+
+    def count(self) -> int:
+        """返回有效行数"""
+        return int(self._alive.sum())
+
+    def _row_metadata(self, row: int) -> Dict[str, Any]:
+        """从元数据列中还原一行的元数据"""
+        return {key: column[row] for key, column in self._columns.items() if column[row] is not None}
+
+    def _documents(self, rows: List[int]) -> List[Optional[str]]:
+        """按行号批量读取文档文本"""
+        found = {}
+        for start in range(0, len(rows), 500):
+            batch = [int(row) for row in rows[start:start + 500]]
+            placeholders = ",".join("?" * len(batch))
+            for row, document in self._conn.execute(
+                    f"SELECT row, document FROM rows WHERE row IN ({placeholders})", batch):
+                found[row] = document
+        return [found.get(int(row)) for row in rows]
+
+    def _numeric_column(self, key: str) -> np.ndarray:
+        """元数据列的数值视图，非数值位置为 NaN"""
+        cached = self._numeric_cache.get(key)
+        if cached is not None:
+            return cached
+        column = self._columns.get(key)
+        values = np.full(self._n_rows, np.nan)
+        if column is not None:
+            for i, value in enumerate(column):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    values[i] = value
+        self._numeric_cache[key] = values
+        return values
+
+    def _where_mask(self, where: Dict[str, Any]) -> np.ndarray:
+        """
+        以向量化方式计算 Chroma 风格的过滤条件
+
+        支持 $and、$or 以及 $eq、$ne、$gt、$gte、$lt、$lte、$in、$nin 运算符
+        """
+        n_rows = self._n_rows
+        mask = np.ones(n_rows, dtype=bool)
+        for key, condition in where.items():
+            if key == "$and":
+                for sub in condition:
+                    mask &= self._where_mask(sub)
+                continue
+            if key == "$or":
+                any_mask = np.zeros(n_rows, dtype=bool)
+                for sub in condition:
+                    any_mask |= self._where_mask(sub)
+                mask &= any_mask
+                continue
+
+            column = self._columns.get(key)
+            if column is None:
+                column = np.full(n_rows, None, dtype=object)
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+
+            for op, value in condition.items():
+                if op == "$eq":
+                    mask &= column == value
+                elif op == "$ne":
+                    mask &= column != value
+                elif op in ("$in", "$nin"):
+                    in_mask = np.zeros(n_rows, dtype=bool)
+                    for v in value:
+                        in_mask |= column == v
+                    mask &= in_mask if op == "$in" else ~in_mask
+                elif op in ("$gt", "$gte", "$lt", "$lte"):
+                    numeric = self._numeric_column(key)
+                    with np.errstate(invalid='ignore'):
+                        if op == "$gt":
+                            mask &= numeric > value
+                        elif op == "$gte":
+                            mask &= numeric >= value
+                        elif op == "$lt":
+                            mask &= numeric < value
+                        else:
+                            mask &= numeric <= value
+                else:
+                    raise ValueError(f"不支持的过滤运算符: {op}")
+        return mask
+
+    def _select_rows(self, ids: Optional[List[str]], where: Optional[Dict[str, Any]]) -> np.ndarray:
+        """根据 ids 和 where 选出有效行号"""
+        mask = self._alive.copy()
+        if where:
+            mask &= self._where_mask(where)
+        if ids is not None:
+            rows = [self._id_to_row[i] for i in ids if i in self._id_to_row]
+            return np.array([row for row in rows if mask[row]], dtype=np.int64)
+        return np.flatnonzero(mask)
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None,
+            limit: Optional[int] = None, offset: Optional[int] = None,
+            include: Optional[List[str]] = None, **kwargs) -> Dict[str, Any]:
+        """
+        按 id 或过滤条件读取数据，返回格式与 Chroma 一致
+        """
+        include = ["metadatas", "documents"] if include is None else include
+        with self._lock:
+            rows = self._select_rows(ids, where)
+            if offset:
+                rows = rows[offset:]
+            if limit is not None:
+                rows = rows[:limit]
+            return {
+                "ids": [self._ids[row] for row in rows],
+                "embeddings": (np.asarray(self._matrix[rows], dtype=np.float32).tolist()
+                               if "embeddings" in include and len(rows) else
+                               ([] if "embeddings" in include else None)),
+                "documents": self._documents(rows) if "documents" in include else None,
+                "metadatas": [self._row_metadata(row) for row in rows] if "metadatas" in include else None,
+            }
+
+    def _distances(self, queries: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        """
+        分块计算查询向量与候选行的平方 L2 距离（与 Chroma 默认的距离度量一致）
+
+        Returns:
+            形状为 (查询数, 候选行数) 的距离矩阵
+        """
+        q_sq = np.einsum('ij,ij->i', queries, queries)[:, None]
+        if rows is None:
+            total = self._n_rows
+            parts = []
+            for start in range(0, total, BLOCK_ROWS):
+                block = np.asarray(self._matrix[start:start + BLOCK_ROWS], dtype=np.float32)
+                parts.append(block @ queries.T)
+            dots = np.concatenate(parts, axis=0).T if parts else np.zeros((len(queries), 0), np.float32)
+            return q_sq + self._sq_norms[None, :] - 2 * dots
+
+        parts = []
+        for start in range(0, len(rows), BLOCK_ROWS):
+            block_rows = rows[start:start + BLOCK_ROWS]
+            block = np.asarray(self._matrix[block_rows], dtype=np.float32)
+            parts.append(block @ queries.T)
+        dots = np.concatenate(parts, axis=0).T if parts else np.zeros((len(queries), 0), np.float32)
+        return q_sq + self._sq_norms[rows][None, :] - 2 * dots
+
+    @staticmethod
+    def _top_k(distances: np.ndarray, k: int) -> np.ndarray:
+        """返回一行距离中最小的 k 个位置（按距离升序）"""
+        k = min(k, len(distances))
+        if k == 0:
+            return np.zeros(0, dtype=np.int64)
+        top = np.argpartition(distances, k - 1)[:k]
+        return top[np.argsort(distances[top], kind='stable')]
+
+    def _search(self, queries: np.ndarray, rows: Optional[np.ndarray], k: int):
+        """
+        在候选行中检索每个查询的 top k
+
+        未启用压缩时直接计算精确距离；启用压缩时先用压缩编码的近似距离选出
+        k * rerank_factor 个候选，再读取这些行的原始向量精确重排。
+
+        Args:
+            queries: (查询数, 维度) 的 float32 矩阵
+            rows: 候选行号，None 表示全部行
+            k: 每个查询返回的结果数
+
+        Returns:
+            每个查询的 (行号数组, 距离数组) 列表
+        """
+        n_candidates = self._n_rows if rows is None else len(rows)
+        n_rerank = k * max(self.rerank_factor, 1)
+
+        if self._codes is None or n_candidates <= n_rerank:
+            distances = self._distances(queries, rows)
+            results = []
+            for q in range(len(queries)):
+                top = self._top_k(distances[q], k)
+                results.append((top if rows is None else rows[top], distances[q][top]))
+            return results
+
+        if rows is None:
+            approx = self._quantizer.distances(queries, self._codes, self._sq_norms)
+        else:
+            approx = self._quantizer.distances(queries, self._codes[rows], self._sq_norms[rows])
+
+        results = []
+        for q in range(len(queries)):
+            candidates = self._top_k(approx[q], n_rerank)
+            candidate_rows = candidates if rows is None else rows[candidates]
+            # 精确重排只读取候选行的原始向量
+            candidate_rows = np.sort(candidate_rows)
+            exact = self._distances(queries[q:q + 1], candidate_rows)[0]
+            top = self._top_k(exact, k)
+            results.append((candidate_rows[top], exact[top]))
+        return results
+
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[Dict[str, Any]] = None,
+              include: Optional[List[str]] = None, **kwargs) -> Dict[str, Any]:
+        """
+        检索最近邻，返回格式与 Chroma 一致；distances 始终是基于原始向量的精确平方 L2 距离
+        """
+        include = ["metadatas", "documents", "distances"] if include is None else include
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[None, :]
+
+        with self._lock:
+            result = {"ids": [], "embeddings": None, "documents": None, "metadatas": None, "distances": None}
+            for field in ("documents", "metadatas", "distances", "embeddings"):
+                if field in include:
+                    result[field] = []
+            if self._matrix is None:
+                for field in ("ids", "documents", "metadatas", "distances", "embeddings"):
+                    if result[field] is not None:
+                        result[field] = [[] for _ in range(len(queries))]
+                return result
+
+            if where:
+                rows = np.flatnonzero(self._alive & self._where_mask(where))
+            elif self._alive.all():
+                rows = None
+            else:
+                rows = np.flatnonzero(self._alive)
+
+            for top_rows, top_distances in self._search(queries, rows, n_results):
+                result["ids"].append([self._ids[row] for row in top_rows])
+                if result["distances"] is not None:
+                    result["distances"].append(top_distances.tolist())
+                if result["metadatas"] is not None:
+                    result["metadatas"].append([self._row_metadata(row) for row in top_rows])
+                if result["documents"] is not None:
+                    result["documents"].append(self._documents(top_rows))
+                if result["embeddings"] is not None:
+                    result["embeddings"].append(np.asarray(self._matrix[top_rows], dtype=np.float32).tolist())
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取索引的统计信息
+
+        Returns:
+            包含以下字段的字典:
+            - rows / count: 总行数（含已删除）/ 有效行数
+            - dim / dtype: 向量维度 / 原始向量存储精度
+            - compression: 压缩方式，None 表示精确检索
+            - trained: 压缩编码是否可用（pq 模式在训练前使用精确检索）
+            - bytes_per_vector: 检索时每个向量常驻内存的字节数（压缩模式下为编码长度）
+            - disk_bytes_per_vector: 每个向量在磁盘上占用的字节数（原始向量 + 编码）
+            - rerank_factor: 精确重排的候选倍数
+        """
+        dim = self._config["dim"] or 0
+        float_bytes = dim * self._dtype.itemsize
+        code_bytes = self._quantizer.code_bytes if self._codes is not None else 0
+        return {
+            "backend": "numpy",
+            "rows": self._n_rows,
+            "count": self.count(),
+            "dim": dim,
+            "dtype": self._config["dtype"],
+            "compression": self._config.get("compression"),
+            "trained": self._codes is not None,
+            "bytes_per_vector": code_bytes or float_bytes,
+            "disk_bytes_per_vector": float_bytes + code_bytes,
+            "rerank_factor": self.rerank_factor,
+        }
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+向量压缩编码，供 NumpyCollection 生成候选集使用
+
+- int8: 每个向量按自身最大绝对值缩放到 [-127, 127]，编码长度为 维度 + 4 字节（缩放系数）
+- pq: 乘积量化，将向量切分为 m 个子空间，每个子空间用 256 个聚类中心之一表示，编码长度为 m 字节
+
+编码统一以 (行数, code_bytes) 的 uint8 矩阵表示；distances 返回与平方 L2 距离同量纲的近似距离，
+候选结果再由原始浮点向量精确重排。
+"""
+
+import os
+from typing import Optional
+
+import numpy as np
+
+
+# 分块编码/计算距离时每块的行数
+BLOCK_ROWS = 16384
+
+
+class Int8Quantizer:
+    """
+    逐向量缩放的标量 int8 量化
+    """
+
+    kind = "int8"
+    trained = True
+
+    def __init__(self, dim: int):
+        """
+        Args:
+            dim: 向量维度
+        """
+        self.dim = dim
+        self.code_bytes = dim + 4
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        编码一组向量
+
+        Args:
+            vectors: (行数, 维度) 的 float32 矩阵
+
+        Returns:
+            (行数, code_bytes) 的 uint8 编码，前 4 字节为 float32 缩放系数
+        """
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        values = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        codes = np.empty((len(vectors), self.code_bytes), dtype=np.uint8)
+        codes[:, :4] = scales.astype(np.float32)[:, None].view(np.uint8)
+        codes[:, 4:] = values.view(np.uint8)
+        return codes
+
+    def distances(self, queries: np.ndarray, codes: np.ndarray, sq_norms: np.ndarray) -> np.ndarray:
+        """
+        计算近似平方 L2 距离
+
+        Args:
+            queries: (查询数, 维度) 的 float32 矩阵
+            codes: (行数, code_bytes) 的编码
+            sq_norms: 各行原始向量的平方范数
+
+        Returns:
+            (查询数, 行数) 的近似距离矩阵
+        """
+        scales = np.ascontiguousarray(codes[:, :4]).view(np.float32)[:, 0]
+        parts = []
+        for start in range(0, len(codes), BLOCK_ROWS):
+            block = codes[start:start + BLOCK_ROWS, 4:].view(np.int8).astype(np.float32)
+            parts.append(block @ queries.T)
+        dots = np.concatenate(parts, axis=0).T * scales[None, :]
+        q_sq = np.einsum('ij,ij->i', queries, queries)[:, None]
+        return q_sq + sq_norms[None, :] - 2 * dots
+
+    def save(self, path: str):
+        """int8 量化无需保存状态"""
+
+    def load(self, path: str):
+        """int8 量化无需加载状态"""
+
+
+class ProductQuantizer:
+    """
+    乘积量化（每个子空间 256 个聚类中心，编码为 m 字节）
+    """
+
+    kind = "pq"
+
+    def __init__(self, dim: int, m: int = 64, iterations: int = 12, seed: int = 0):
+        """
+        Args:
+            dim: 向量维度，必须能被 m 整除
+            m: 子空间个数，即每个向量的编码字节数
+            iterations: k-means 迭代次数
+            seed: 随机种子
+        """
+        if dim % m != 0:
+            raise ValueError(f"向量维度 {dim} 不能被 pq_m={m} 整除")
+        self.dim = dim
+        self.m = m
+        self.dsub = dim // m
+        self.code_bytes = m
+        self.iterations = iterations
+        self.seed = seed
+        self.codebooks = None  # (m, 256, dsub)
+
+    @property
+    def trained(self) -> bool:
+        return self.codebooks is not None
+
+    def train(self, vectors: np.ndarray):
+        """
+        用 k-means 训练各子空间的聚类中心
+
+        Args:
+            vectors: (行数, 维度) 的 float32 训练样本，行数不少于 256
+        """
+        rng = np.random.default_rng(self.seed)
+        codebooks = np.empty((self.m, 256, self.dsub), dtype=np.float32)
+        for j in range(self.m):
+            sub = np.ascontiguousarray(vectors[:, j * self.dsub:(j + 1) * self.dsub])
+            centroids = sub[rng.choice(len(sub), 256, replace=False)].copy()
+            for _ in range(self.iterations):
+                assign = self._assign(sub, centroids)
+                counts = np.bincount(assign, minlength=256)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assign, sub)
+                filled = counts > 0
+                centroids[filled] = sums[filled] / counts[filled, None]
+                # 空簇重新随机取样
+                empty = np.flatnonzero(~filled)
+                if len(empty):
+                    centroids[empty] = sub[rng.choice(len(sub), len(empty), replace=False)]
+            codebooks[j] = centroids
+        self.codebooks = codebooks
+
+    @staticmethod
+    def _assign(sub: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        """返回每行最近的聚类中心编号"""
+        dist = (centroids * centroids).sum(axis=1)[None, :] - 2 * sub @ centroids.T
+        return dist.argmin(axis=1)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        编码一组向量
+
+        Args:
+            vectors: (行数, 维度) 的 float32 矩阵
+
+        Returns:
+            (行数, m) 的 uint8 编码
+        """
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for start in range(0, len(vectors), BLOCK_ROWS):
+            block = vectors[start:start + BLOCK_ROWS]
+            for j in range(self.m):
+                sub = block[:, j * self.dsub:(j + 1) * self.dsub]
+                codes[start:start + BLOCK_ROWS, j] = self._assign(sub, self.codebooks[j])
+        return codes
+
+    def distances(self, queries: np.ndarray, codes: np.ndarray, sq_norms: np.ndarray) -> np.ndarray:
+        """
+        用查表法（ADC）计算近似平方 L2 距离
+
+        Args:
+            queries: (查询数, 维度) 的 float32 矩阵
+            codes: (行数, m) 的编码
+            sq_norms: 未使用，与 Int8Quantizer 保持相同签名
+
+        Returns:
+            (查询数, 行数) 的近似距离矩阵
+        """
+        result = np.zeros((len(queries), len(codes)), dtype=np.float32)
+        for j in range(self.m):
+            sub = queries[:, j * self.dsub:(j + 1) * self.dsub]
+            centroids = self.codebooks[j]
+            # (查询数, 256) 的子空间距离表
+            table = ((sub * sub).sum(axis=1)[:, None] + (centroids * centroids).sum(axis=1)[None, :]
+                     - 2 * sub @ centroids.T)
+            result += table[:, codes[:, j]]
+        return result
+
+    def save(self, path: str):
+        """保存聚类中心到 pq_codebooks.npy"""
+        if self.codebooks is not None:
+            np.save(os.path.join(path, "pq_codebooks.npy"), self.codebooks)
+
+    def load(self, path: str):
+        """从 pq_codebooks.npy 加载聚类中心（如果存在）"""
+        codebooks_path = os.path.join(path, "pq_codebooks.npy")
+        if os.path.exists(codebooks_path):
+            self.codebooks = np.load(codebooks_path)
+
+
+def create_quantizer(kind: Optional[str], dim: int, pq_m: int = 64):
+    """
+    创建量化器
+
+    Args:
+        kind: None（不压缩）、"int8" 或 "pq"
+        dim: 向量维度
+        pq_m: 乘积量化的子空间个数
+
+    Returns:
+        量化器实例，不压缩时为 None
+    """
+    if kind is None:
+        return None
+    if kind == "int8":
+        return Int8Quantizer(dim)
+    if kind == "pq":
+        return ProductQuantizer(dim, m=pq_m)
+    raise ValueError(f"不支持的压缩方式: {kind}")
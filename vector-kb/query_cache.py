@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+查询结果缓存：LRU + TTL，并以知识库的代数（generation）判断缓存是否失效
+"""
+
+import os
+import copy
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+
+from embedding_cache import normalize_text
+
+
+class QueryCache:
+    """
+    进程内的查询结果缓存
+
+    以 (规范化查询文本, top_k, 规范化 where 条件) 为键。知识库每次增删文件都会使代数加一，
+    代数变化后缓存整体失效。
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = None):
+        """
+        初始化缓存
+
+        Args:
+            max_entries: 最多缓存的查询数量，超出后淘汰最久未使用的条目
+            ttl: 缓存条目的有效期（秒），None 表示不过期
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.generation = None
+        self._entries = OrderedDict()  # 键 -> (过期时间, 结果)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(text: str, top_k: int, where: Optional[Dict[str, Any]], *extra) -> Tuple:
+        """
+        生成缓存键
+
+        Args:
+            text: 查询文本
+            top_k: 返回结果数量
+            where: metadata 过滤条件
+            extra: 其他影响查询结果的参数
+
+        Returns:
+            可哈希的缓存键
+        """
+        where_key = json.dumps(where, ensure_ascii=False, sort_keys=True)
+        return (normalize_text(text), top_k, where_key) + tuple(extra)
+
+    def sync(self, generation: int):
+        """
+        与知识库当前代数同步，代数变化时清空缓存
+
+        Args:
+            generation: 知识库当前代数
+        """
+        with self._lock:
+            if self.generation != generation:
+                self._entries.clear()
+                self.generation = generation
+
+    def get(self, key: Tuple) -> Optional[List[Dict[str, Any]]]:
+        """
+        读取缓存
+
+        Args:
+            key: make_key 生成的缓存键
+
+        Returns:
+            缓存的查询结果副本，未命中时为 None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is not None and entry[0] < time.time():
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def put(self, key: Tuple, value: List[Dict[str, Any]]):
+        """
+        写入缓存
+
+        Args:
+            key: make_key 生成的缓存键
+            value: 查询结果
+        """
+        if self.max_entries <= 0:
+            return
+
+        expires_at = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (expires_at, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取缓存统计信息
+
+        Returns:
+            包含 hits、misses、hit_rate、entries、max_entries 的字典
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+        }
+
+    def save(self, path: str):
+        """
+        将缓存保存到文件
+
+        Args:
+            path: 缓存文件路径
+        """
+        now = time.time()
+        with self._lock:
+            entries = [
+                [list(key), expires_at, value]
+                for key, (expires_at, value) in self._entries.items()
+                if expires_at is None or expires_at >= now
+            ]
+            data = {"generation": self.generation, "entries": entries}
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str, generation: int):
+        """
+        从文件加载缓存，文件中的代数与知识库当前代数不一致时忽略
+
+        Args:
+            path: 缓存文件路径
+            generation: 知识库当前代数
+        """
+        self.sync(generation)
+        if not os.path.exists(path):
+            return
+
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"读取查询缓存 {path} 时出错: {str(e)}")
+            return
+
+        if data.get("generation") != generation:
+            return
+
+        now = time.time()
+        with self._lock:
+            for entry in data.get("entries", []):
+                try:
+                    key, expires_at, value = entry
+                    if expires_at is None or expires_at >= now:
+                        self._entries[tuple(key)] = (expires_at, value)
+                except (TypeError, ValueError):
+                    # 格式不符（例如旧版本写入的嵌套键）的条目直接跳过
+                    continue
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
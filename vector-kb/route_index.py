@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+类/章路由索引：为每个类（section）和章（chapter）维护其下所有 chunk 向量的和与数量，
+查询时先用质心为类和章打分，再只在得分最高的若干章内检索，实现两段式检索。
+"""
+
+import sqlite3
+import threading
+from typing import List, Dict, Any, Tuple, Iterable
+
+import numpy as np
+
+from concurrency import connect_sqlite
+
+
+class RouteIndex:
+    """
+    基于 SQLite 持久化的类/章质心索引
+
+    质心以 (向量和, 数量) 的形式增量维护：写入 chunk 时累加，删除 chunk 时减去，
+    数量归零的类或章会被移除。按条件批量删除时不读取向量，只将涉及的类和章标记为待重算（invalidate），
+    由调用方在删除完成后用 stale_keys / recompute 重新计算；待重算的类和章不参与路由打分。
+    """
+
+    def __init__(self, path: str, read_only: bool = False):
+        """
+        初始化路由索引
+
+        Args:
+            path: 索引数据库文件路径
+            read_only: 是否以只读方式打开已有的索引
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(path, read_only)
+        if not read_only:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS centroids ("
+                "  level TEXT NOT NULL,"
+                "  key TEXT NOT NULL,"
+                "  parent TEXT NOT NULL,"
+                "  vector_sum BLOB NOT NULL,"
+                "  count INTEGER NOT NULL,"
+                "  PRIMARY KEY (level, key)"
+                ")"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS stale ("
+                "  level TEXT NOT NULL,"
+                "  key TEXT NOT NULL,"
+                "  PRIMARY KEY (level, key)"
+                ")"
+            )
+            self._conn.commit()
+
+        # level -> key -> [向量和, 数量, 上级类]
+        self._entries = {"section": {}, "chapter": {}}
+        for level, key, parent, vector_sum, count in self._conn.execute(
+                "SELECT level, key, parent, vector_sum, count FROM centroids"):
+            self._entries[level][key] = [np.frombuffer(vector_sum, dtype=np.float64).copy(), count, parent]
+        try:
+            self._stale = set(self._conn.execute("SELECT level, key FROM stale").fetchall())
+        except sqlite3.OperationalError:
+            # 只读打开升级前创建的索引时没有 stale 表
+            self._stale = set()
+
+    @staticmethod
+    def _keys(metadata: Dict[str, Any]) -> List[Tuple[str, str, str]]:
+        """返回一个 chunk 所属的 (level, key, parent) 列表，没有类/章信息的 chunk 不参与路由"""
+        section = str(metadata.get("section") or "")
+        chapter = str(metadata.get("chapter") or "")
+        keys = []
+        if section:
+            keys.append(("section", section, ""))
+        if chapter:
+            keys.append(("chapter", chapter, section))
+        return keys
+
+    def _apply(self, embeddings, metadatas: List[Dict[str, Any]], sign: int):
+        """累加（sign=1）或减去（sign=-1）一组 chunk 向量"""
+        touched = set()
+        with self._lock:
+            for embedding, metadata in zip(embeddings, metadatas):
+                for level, key, parent in self._keys(metadata or {}):
+                    vector = np.asarray(embedding, dtype=np.float64)
+                    entry = self._entries[level].get(key)
+                    if entry is None:
+                        if sign < 0:
+                            continue
+                        entry = [np.zeros_like(vector), 0, parent]
+                        self._entries[level][key] = entry
+                    entry[0] += sign * vector
+                    entry[1] += sign
+                    if parent:
+                        entry[2] = parent
+                    touched.add((level, key))
+
+            with self._conn:
+                for level, key in touched:
+                    entry = self._entries[level][key]
+                    if entry[1] <= 0:
+                        del self._entries[level][key]
+                        self._conn.execute("DELETE FROM centroids WHERE level = ? AND key = ?", (level, key))
+                    else:
+                        self._conn.execute(
+                            "INSERT OR REPLACE INTO centroids (level, key, parent, vector_sum, count) "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            (level, key, entry[2], entry[0].tobytes(), entry[1])
+                        )
+
+    def add(self, embeddings, metadatas: List[Dict[str, Any]]):
+        """
+        将新写入的 chunk 计入所属类和章的质心
+
+        Args:
+            embeddings: chunk 向量列表
+            metadatas: 对应的 chunk 元数据，使用其中的 section 和 chapter 字段
+        """
+        self._apply(embeddings, metadatas, 1)
+
+    def remove(self, embeddings, metadatas: List[Dict[str, Any]]):
+        """
+        将被删除的 chunk 从所属类和章的质心中减去
+
+        Args:
+            embeddings: chunk 向量列表
+            metadatas: 对应的 chunk 元数据
+        """
+        self._apply(embeddings, metadatas, -1)
+
+    def invalidate(self, metadatas: List[Dict[str, Any]]):
+        """
+        将一组 chunk 所属的类和章标记为待重算，用于不读取向量的批量删除
+
+        Args:
+            metadatas: 被删除的 chunk 的元数据
+        """
+        keys = {(level, key) for metadata in metadatas for level, key, _ in self._keys(metadata or {})}
+        with self._lock, self._conn:
+            keys -= self._stale
+            self._stale |= keys
+            self._conn.executemany("INSERT OR IGNORE INTO stale (level, key) VALUES (?, ?)", list(keys))
+
+    def stale_keys(self) -> List[Tuple[str, str]]:
+        """
+        获取待重算的类和章
+
+        Returns:
+            (level, key) 列表，level 为 "section" 或 "chapter"
+        """
+        with self._lock:
+            return sorted(self._stale)
+
+    def recompute(self, level: str, key: str, batches: Iterable[Tuple[Any, List[Dict[str, Any]]]]):
+        """
+        用一个类或章下现有的全部 chunk 重新计算其质心，并清除待重算标记
+
+        Args:
+            level: "section" 或 "chapter"
+            key: 类或章的编号
+            batches: 该类或章下所有 chunk 的 (向量列表, 元数据列表) 的迭代器
+        """
+        vector_sum, count, parent = None, 0, ""
+        for embeddings, metadatas in batches:
+            vectors = np.asarray(embeddings, dtype=np.float64)
+            if not len(vectors):
+                continue
+            vector_sum = vectors.sum(axis=0) if vector_sum is None else vector_sum + vectors.sum(axis=0)
+            count += len(vectors)
+            if level == "chapter":
+                parent = str((metadatas[-1] or {}).get("section") or parent)
+
+        with self._lock, self._conn:
+            if count == 0:
+                self._entries[level].pop(key, None)
+                self._conn.execute("DELETE FROM centroids WHERE level = ? AND key = ?", (level, key))
+            else:
+                self._entries[level][key] = [vector_sum, count, parent]
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO centroids (level, key, parent, vector_sum, count) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (level, key, parent, vector_sum.tobytes(), count)
+                )
+            self._stale.discard((level, key))
+            self._conn.execute("DELETE FROM stale WHERE level = ? AND key = ?", (level, key))
+
+    @staticmethod
+    def _scores(entries: Dict[str, list], keys: List[str], queries: np.ndarray) -> np.ndarray:
+        """计算查询向量与各质心的余弦相似度"""
+        centroids = np.stack([entries[key][0] for key in keys])
+        centroids /= np.clip(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12, None)
+        return queries @ centroids.T
+
+    def route(self, query_embeddings, n_sections: int, n_chapters: int) -> List[Tuple[List[str], List[str]]]:
+        """
+        为每个查询选出得分最高的类，再在这些类下选出得分最高的章
+
+        Args:
+            query_embeddings: 查询向量列表
+            n_sections: 保留的类数
+            n_chapters: 保留的章数
+
+        Returns:
+            与查询一一对应的 (类列表, 章列表)；索引为空时类和章列表均为空，待重算的类和章不会被选中
+        """
+        queries = np.asarray(query_embeddings, dtype=np.float64)
+        with self._lock:
+            sections = [key for key in self._entries["section"] if ("section", key) not in self._stale]
+            chapters = [key for key in self._entries["chapter"] if ("chapter", key) not in self._stale]
+            if not sections:
+                return [([], []) for _ in range(len(queries))]
+            section_scores = self._scores(self._entries["section"], sections, queries)
+            chapter_scores = self._scores(self._entries["chapter"], chapters, queries) if chapters else None
+            parents = [self._entries["chapter"][key][2] for key in chapters]
+
+        routes = []
+        for q in range(len(queries)):
+            top_sections = [sections[i] for i in np.argsort(-section_scores[q])[:n_sections]]
+            top_chapters = []
+            if chapter_scores is not None:
+                allowed = set(top_sections)
+                for i in np.argsort(-chapter_scores[q]):
+                    if parents[i] in allowed:
+                        top_chapters.append(chapters[i])
+                        if len(top_chapters) >= n_chapters:
+                            break
+            routes.append((top_sections, top_chapters))
+        return routes
+
+    def is_empty(self) -> bool:
+        """是否还没有任何质心"""
+        return not self._entries["section"] and not self._entries["chapter"]
+
+    def clear(self):
+        """清空所有质心"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM centroids")
+            self._conn.execute("DELETE FROM stale")
+            self._entries = {"section": {}, "chapter": {}}
+            self._stale = set()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        获取路由索引的统计信息
+
+        Returns:
+            包含 sections（类数）、chapters（章数）、chunks（计入的 chunk 数）的字典
+        """
+        with self._lock:
+            return {
+                "sections": len(self._entries["section"]),
+                "chapters": len(self._entries["chapter"]),
+                "chunks": sum(entry[1] for entry in self._entries["section"].values()),
+            }
+
+    def close(self):
+        """关闭数据库连接"""
+        self._conn.close()
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按 HS 类（section）分片的 collection
+
+每个类的 chunk 存放在单独的 collection（Chroma collection 或 NumpyCollection）中，写入时按 metadata
+中的 section 路由，没有 section 的 chunk 存放在 none 分片中。查询时根据 where 条件推出可能匹配的类，
+只检索这些分片（条件不限定类时检索全部分片），多个分片在线程池中并行检索后按距离合并前 n 个结果。
+
+接口与 Chroma collection 一致（add、upsert、update、delete、get、query、count），kb 无需区分。
+"""
+
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Callable, Tuple
+
+
+# 没有 section 的 chunk 所在的分片
+NO_SECTION = "none"
+
+# 并行检索分片的线程数
+DEFAULT_WORKERS = 8
+
+# 查询结果中除 ids 外的字段
+RESULT_FIELDS = ("embeddings", "documents", "metadatas", "distances")
+
+
+def shard_key(section: Any) -> str:
+    """
+    类编号对应的分片名
+
+    Args:
+        section: metadata 中的 section
+
+    Returns:
+        只含字母、数字和下划线的分片名，空值为 NO_SECTION
+    """
+    key = re.sub(r"[^0-9A-Za-z]", "_", str(section or "")).strip("_")
+    return key or NO_SECTION
+
+
+def where_sections(where: Optional[Dict[str, Any]]) -> Optional[set]:
+    """
+    从过滤条件中推出可能匹配的类
+
+    支持 {"section": x}、{"section": {"$eq": x}}、{"section": {"$in": [...]}} 以及它们的 $and / $or 组合。
+
+    Args:
+        where: metadata 过滤条件
+
+    Returns:
+        类编号集合，条件不限定类时为 None
+    """
+    if not where:
+        return None
+    sections = None
+    for key, condition in where.items():
+        if key == "$and":
+            found = None
+            for sub in condition:
+                sub_sections = where_sections(sub)
+                if sub_sections is not None:
+                    found = sub_sections if found is None else found & sub_sections
+        elif key == "$or":
+            subs = [where_sections(sub) for sub in condition]
+            found = None if any(sub is None for sub in subs) else set().union(*subs)
+        elif key == "section":
+            if not isinstance(condition, dict):
+                found = {condition}
+            elif "$eq" in condition:
+                found = {condition["$eq"]}
+            elif "$in" in condition:
+                found = set(condition["$in"])
+            else:
+                found = None
+        else:
+            continue
+        if found is not None:
+            sections = found if sections is None else sections & found
+    return sections
+
+
+def _pick(values, indices: List[int]):
+    """按下标取出子列表，values 为 None 时返回 None"""
+    return None if values is None else [values[i] for i in indices]
+
+
+class ShardedCollection:
+    """
+    由多个按类划分的 collection 组成的 collection
+    """
+
+    def __init__(self, name: str, open_shard: Callable[[str, bool], Any], keys: List[str],
+                 backend: str = "chroma", workers: int = DEFAULT_WORKERS):
+        """
+        打开已有的分片，其余分片在首次写入时创建
+
+        Args:
+            name: collection 名称
+            open_shard: 打开分片的函数，参数为 (分片名, 不存在时是否创建)
+            keys: 已有的分片名
+            backend: 分片使用的索引后端名称，仅用于统计
+            workers: 并行检索分片的线程数
+        """
+        self.name = name
+        self.backend = backend
+        self._open_shard = open_shard
+        self._workers = max(1, workers)
+        self._lock = threading.RLock()
+        self._shards = {key: open_shard(key, False) for key in sorted(keys)}
+        self._executor = None
+
+    # ------------------------------------------------------------------
+    # 分片管理
+    # ------------------------------------------------------------------
+
+    def keys(self) -> List[str]:
+        """已有的分片名，按名称排序"""
+        with self._lock:
+            return sorted(self._shards)
+
+    def shard(self, key: str):
+        """
+        获取一个分片
+
+        Args:
+            key: 分片名
+
+        Returns:
+            分片的 collection，不存在时为 None
+        """
+        with self._lock:
+            return self._shards.get(key)
+
+    def set_shard(self, key: str, collection):
+        """
+        替换一个分片（重建分片后调用）
+
+        Args:
+            key: 分片名
+            collection: 新的 collection
+        """
+        with self._lock:
+            self._shards[key] = collection
+
+    def remove_shard(self, key: str):
+        """
+        移除一个分片（删除整个类时调用），之后写入该类的数据会重新创建分片
+
+        Args:
+            key: 分片名
+
+        Returns:
+            被移除的 collection，不存在时为 None
+        """
+        with self._lock:
+            return self._shards.pop(key, None)
+
+    def _get_or_create(self, key: str):
+        """获取分片，不存在时创建"""
+        with self._lock:
+            shard = self._shards.get(key)
+            if shard is None:
+                shard = self._shards[key] = self._open_shard(key, True)
+            return shard
+
+    def _select(self, where: Optional[Dict[str, Any]]) -> List[Tuple[str, Any]]:
+        """按过滤条件选出需要检索的分片"""
+        sections = where_sections(where)
+        with self._lock:
+            if sections is None:
+                return sorted(self._shards.items())
+            keys = {shard_key(section) for section in sections}
+            return sorted((key, shard) for key, shard in self._shards.items() if key in keys)
+
+    def _map(self, fn: Callable, shards: List[Tuple[str, Any]]) -> List[Any]:
+        """对每个分片并行执行 fn(分片)，结果与 shards 一一对应"""
+        if len(shards) <= 1:
+            return [fn(shard) for _, shard in shards]
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="kb-shard")
+            executor = self._executor
+        return list(executor.map(lambda item: fn(item[1]), shards))
+
+    def _locate(self, ids: List[str], shards: Optional[List[Tuple[str, Any]]] = None) -> Dict[str, List[str]]:
+        """查找每个 id 所在的分片，返回 分片名 -> 该分片中的 id 列表"""
+        shards = sorted(self._shards.items()) if shards is None else shards
+        found = self._map(lambda shard: shard.get(ids=list(ids), include=[])['ids'], shards)
+        return {key: shard_ids for (key, _), shard_ids in zip(shards, found) if shard_ids}
+
+    @staticmethod
+    def _group(ids: List[str], metadatas: Optional[List[Dict[str, Any]]]) -> Dict[str, List[int]]:
+        """按 metadata 中的 section 将写入分组，返回 分片名 -> 下标列表"""
+        groups = {}
+        for i in range(len(ids)):
+            section = (metadatas[i] or {}).get("section") if metadatas is not None else None
+            groups.setdefault(shard_key(section), []).append(i)
+        return groups
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+
+    def add(self, ids: List[str], embeddings=None, documents: Optional[List[str]] = None,
+            metadatas: Optional[List[Dict[str, Any]]] = None, **kwargs):
+        """
+        按 section 将数据添加到对应分片，已存在的 id 会被忽略
+        """
+        for key, indices in self._group(ids, metadatas).items():
+            self._get_or_create(key).add(
+                ids=_pick(ids, indices), embeddings=_pick(embeddings, indices),
+                documents=_pick(documents, indices), metadatas=_pick(metadatas, indices)
+            )
+
+    def upsert(self, ids: List[str], embeddings=None, documents: Optional[List[str]] = None,
+               metadatas: Optional[List[Dict[str, Any]]] = None, **kwargs):
+        """
+        按 section 添加或覆盖数据；section 变化的 id 会从原分片中删除
+        """
+        groups = self._group(ids, metadatas)
+        target = {ids[i]: key for key, indices in groups.items() for i in indices}
+        for key, shard_ids in self._locate(ids).items():
+            stale = [chunk_id for chunk_id in shard_ids if target[chunk_id] != key]
+            if stale:
+                self._shards[key].delete(ids=stale)
+        for key, indices in groups.items():
+            self._get_or_create(key).upsert(
+                ids=_pick(ids, indices), embeddings=_pick(embeddings, indices),
+                documents=_pick(documents, indices), metadatas=_pick(metadatas, indices)
+            )
+
+    def update(self, ids: List[str], embeddings=None, documents: Optional[List[str]] = None,
+               metadatas: Optional[List[Dict[str, Any]]] = None, **kwargs):
+        """
+        更新已存在的数据；section 变化的 id 移动到新的分片，不存在的 id 被忽略
+        """
+        position = {chunk_id: i for i, chunk_id in enumerate(ids)}
+        for key, shard_ids in self._locate(ids).items():
+            shard = self._shards[key]
+            stay, move = [], []
+            for chunk_id in shard_ids:
+                i = position[chunk_id]
+                new_key = key if metadatas is None else shard_key((metadatas[i] or {}).get("section"))
+                (stay if new_key == key else move).append(i)
+
+            if stay:
+                shard.update(ids=_pick(ids, stay), embeddings=_pick(embeddings, stay),
+                             documents=_pick(documents, stay), metadatas=_pick(metadatas, stay))
+            if move:
+                old = shard.get(ids=_pick(ids, move), include=["embeddings", "documents", "metadatas"])
+                old_rows = {chunk_id: j for j, chunk_id in enumerate(old['ids'])}
+                rows = [old_rows[ids[i]] for i in move]
+                moved_ids = _pick(ids, move)
+                shard.delete(ids=moved_ids)
+                self.upsert(
+                    ids=moved_ids,
+                    embeddings=_pick(embeddings, move) if embeddings is not None else _pick(old['embeddings'], rows),
+                    documents=_pick(documents, move) if documents is not None else _pick(old['documents'], rows),
+                    metadatas=_pick(metadatas, move)
+                )
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None, **kwargs):
+        """
+        按 id 或过滤条件删除数据，只访问可能包含这些数据的分片
+        """
+        shards = self._select(where)
+        if ids is None:
+            for _, shard in shards:
+                shard.delete(where=where)
+            return
+        for key, shard_ids in self._locate(ids, shards).items():
+            if where:
+                self._shards[key].delete(ids=shard_ids, where=where)
+            else:
+                self._shards[key].delete(ids=shard_ids)
+
+    # ------------------------------------------------------------------
+    # 读取
+    # ------------------------------------------------------------------
+
+    def count(self) -> int:
+        """所有分片中的数据条数"""
+        return sum(shard.count() for _, shard in self._select(None))
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None,
+            limit: Optional[int] = None, offset: Optional[int] = None,
+            include: Optional[List[str]] = None, **kwargs) -> Dict[str, Any]:
+        """
+        按 id 或过滤条件读取数据，返回格式与 Chroma 一致
+
+        按 id 读取时并行访问各分片，结果按 ids 的顺序排列；分页读取时按分片名顺序拼接各分片。
+        """
+        include = ["metadatas", "documents"] if include is None else list(include)
+        fields = [field for field in RESULT_FIELDS if field in include]
+        result = {"ids": [], "embeddings": None, "documents": None, "metadatas": None}
+        for field in fields:
+            result[field] = []
+        params = {"include": include}
+        if where:
+            params["where"] = where
+        shards = self._select(where)
+
+        if ids is not None:
+            rows = {}
+            for part in self._map(lambda shard: shard.get(ids=list(ids), **params), shards):
+                for j, chunk_id in enumerate(part['ids']):
+                    rows[chunk_id] = (part, j)
+            for chunk_id in ids:
+                if chunk_id in rows:
+                    part, j = rows.pop(chunk_id)
+                    result['ids'].append(chunk_id)
+                    for field in fields:
+                        result[field].append(part[field][j])
+            return result
+
+        skip = offset or 0
+        remaining = limit
+        for _, shard in shards:
+            if remaining is not None and remaining <= 0:
+                break
+            if skip:
+                # 跳过整个分片时只需要知道其中匹配的条数
+                n = shard.count() if not where else len(shard.get(where=where, include=[])['ids'])
+                if skip >= n:
+                    skip -= n
+                    continue
+            part = shard.get(limit=remaining, offset=skip or None, **params)
+            skip = 0
+            result['ids'].extend(part['ids'])
+            for field in fields:
+                result[field].extend(part[field])
+            if remaining is not None:
+                remaining -= len(part['ids'])
+        return result
+
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[Dict[str, Any]] = None,
+              include: Optional[List[str]] = None, **kwargs) -> Dict[str, Any]:
+        """
+        并行检索过滤条件选中的分片，按距离合并每个查询的前 n_results 个结果，返回格式与 Chroma 一致
+        """
+        include = ["metadatas", "documents", "distances"] if include is None else list(include)
+        fields = [field for field in RESULT_FIELDS if field in include]
+        params = {"query_embeddings": query_embeddings, "n_results": n_results,
+                  "include": include if "distances" in include else include + ["distances"]}
+        if where:
+            params["where"] = where
+        parts = self._map(lambda shard: shard.query(**params), self._select(where))
+
+        result = {"ids": [], "embeddings": None, "documents": None, "metadatas": None, "distances": None}
+        for field in fields:
+            result[field] = []
+        for q in range(len(query_embeddings)):
+            candidates = [(distance, part, j) for part in parts for j, distance in enumerate(part['distances'][q])]
+            candidates.sort(key=lambda candidate: candidate[0])
+            top = candidates[:n_results]
+            result['ids'].append([part['ids'][q][j] for _, part, j in top])
+            for field in fields:
+                result[field].append([part[field][q][j] for _, part, j in top])
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取索引的统计信息
+
+        Returns:
+            包含 backend、sharded、count、dim、bytes_per_vector 和 shards（分片名 -> 条数）的字典
+        """
+        counts = {key: shard.count() for key, shard in self._select(None)}
+        dim = 0
+        bytes_per_vector = 0
+        for key, count in counts.items():
+            if count:
+                shard = self._shards[key]
+                if hasattr(shard, 'stats'):
+                    shard_stats = shard.stats()
+                    dim, bytes_per_vector = shard_stats['dim'], shard_stats['bytes_per_vector']
+                else:
+                    dim = len(shard.get(limit=1, include=["embeddings"])['embeddings'][0])
+                    bytes_per_vector = dim * 4
+                break
+        return {
+            "backend": self.backend,
+            "sharded": True,
+            "count": sum(counts.values()),
+            "dim": dim,
+            "bytes_per_vector": bytes_per_vector,
+            "shards": counts,
+        }
+
+    def close(self):
+        """停止并行检索使用的线程池"""
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=True)